@@ -0,0 +1,526 @@
+"""
+ランキング（リーダーボード）サービス
+
+ボードごとに「ユーザーID → スコア」のソート済み集合を保持し、順位を O(log n) で求める。
+本番では LEADERBOARD_REDIS_URL を設定し、Redis の sorted set に全ユーザーを保持して
+全ワーカーで共有する（集合の作り直しは rebuild_leaderboard コマンドで定期的に行う）。
+集合のキーが無い場合（期限切れ・Redis の再起動）は、リクエスト中には読み込まず、
+DB の COUNT で応答しながらバックグラウンドで作り直す（SET NX のロックで1プロセスだけが行う）。
+
+未設定（または redis パッケージ未導入）の場合はプロセス内に上位 LOCAL_MAX_MEMBERS 人だけを保持する。
+それより下のユーザーの順位と人数は、スコアの索引を使った DB の COUNT で求めるため、
+ユーザー数が多くてもワーカーのメモリ使用量と読み直しの時間は増えない。
+
+ボード:
+    all      総ポイント（User.points_total）
+    weekly   今週の獲得ポイント（UserQuizStats.week_points）
+    monthly  今月の獲得ポイント（UserQuizStats.month_points）
+    tier:<ランク名>  同じランク帯のユーザーの総ポイント
+
+上位N件の表示用データはキャッシュ（Django cache）にスナップショットとして保存し、
+セッション終了時に上位へ影響がある場合だけ作り直す。LEADERBOARD_REDIS_URL を設定すると
+キャッシュも同じ Redis になり全ワーカーで共有される。未設定時はプロセスごとのキャッシュのため、
+他のワーカーでの更新は SNAPSHOT_TIMEOUT 秒まで反映されない。
+"""
+import bisect
+import itertools
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .models import RANK_TABLE, User
+
+try:
+    import redis
+except ImportError:  # redis は任意の依存
+    redis = None
+
+
+BOARDS = ['all', 'weekly', 'monthly', 'tier']
+TIER_NAMES = [rank for rank, _ in RANK_TABLE]
+
+LEADERBOARD_CONFIG = {
+    'TOP_N': 20,                 # スナップショットに含める人数
+    'SNAPSHOT_TIMEOUT': 300,     # スナップショットのキャッシュ秒数
+    'LOCAL_RELOAD_INTERVAL': 60,  # プロセス内集合をDBから読み直す間隔（秒）
+    'LOCAL_MAX_MEMBERS': 1000,   # プロセス内集合に保持する上位の人数
+    'REDIS_KEY_TTL': 24 * 60 * 60,  # Redis の集合をDBから作り直す間隔（秒）
+    'REDIS_REBUILD_INTERVAL': 6 * 60 * 60,  # rebuild_leaderboard --loop の作り直し間隔（REDIS_KEY_TTL より短くする）
+    'REBUILD_LOCK_TTL': 10 * 60,  # Redis の集合の作り直し中に他のプロセスを待たせるロックの秒数
+    'LOAD_CHUNK_SIZE': 10000,    # DBから読み込む際のチャンクサイズ
+}
+
+
+class LocalSortedSetBackend:
+    """
+    プロセス内のソート済み集合（上位 max_members 人まで）
+
+    (−スコア, ユーザーID) のソート済みリストと ユーザーID → スコア の辞書を持ち、
+    順位は bisect で求める。load にはスコアの高い順に渡し、max_members 人で打ち切る。
+    打ち切った集合では、最下位のスコア以上の順位だけを求められる（covers）。
+    ワーカープロセスごとに独立しているため、他プロセスでの更新は
+    LOCAL_RELOAD_INTERVAL ごとの読み直しで反映される。
+    """
+
+    # load にはスコアの高い順の上位だけを渡す
+    ordered_load = True
+
+    def __init__(self, reload_interval: int, max_members: int = None):
+        self.reload_interval = reload_interval
+        self.max_members = max_members or LEADERBOARD_CONFIG['LOCAL_MAX_MEMBERS']
+        self._sets: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def is_loaded(self, key: str) -> bool:
+        entry = self._sets.get(key)
+        return entry is not None and time.monotonic() - entry['loaded_at'] < self.reload_interval
+
+    def load(self, key: str, items: Iterable[Tuple[int, int]]):
+        scores = {member: score for member, score in itertools.islice(items, self.max_members)}
+        entry = {
+            'scores': scores,
+            'order': sorted((-score, member) for member, score in scores.items()),
+            # 全員を読み込めた場合は、どのスコアの順位も集合だけで求められる
+            'complete': len(scores) < self.max_members,
+            'loaded_at': time.monotonic(),
+        }
+        with self._lock:
+            self._sets[key] = entry
+
+    def set_score(self, key: str, member: int, score: int):
+        with self._lock:
+            entry = self._sets.get(key)
+            if entry is None:
+                return
+            self._discard(entry, member)
+            order = entry['order']
+            # 打ち切った集合の最下位より低いスコアは集合の外（DBで数える範囲）に置く
+            if not entry['complete'] and order and (-score, member) > order[-1]:
+                return
+            entry['scores'][member] = score
+            bisect.insort(order, (-score, member))
+            if len(order) > self.max_members:
+                _, dropped = order.pop()
+                del entry['scores'][dropped]
+                entry['complete'] = False
+
+    def covers(self, key: str, score: int) -> bool:
+        """集合だけでこのスコアの順位を求められるか（より高いスコアの全員が集合にいるか）"""
+        entry = self._sets[key]
+        return entry['complete'] or (bool(entry['order']) and -entry['order'][-1][0] <= score)
+
+    def is_complete(self, key: str) -> bool:
+        """ボードの全員が集合にいるか（card がボードの人数になるか）"""
+        return self._sets[key]['complete']
+
+    def acquire_rebuild_lock(self, key: str) -> bool:
+        # プロセス内の集合は上位だけを読むため、同時に読み込んでも問題ない
+        return True
+
+    def release_rebuild_lock(self, key: str):
+        pass
+
+    def remove(self, key: str, member: int):
+        with self._lock:
+            entry = self._sets.get(key)
+            if entry is not None:
+                self._discard(entry, member)
+
+    def score(self, key: str, member: int) -> Optional[int]:
+        return self._sets[key]['scores'].get(member)
+
+    def count_above(self, key: str, score: int) -> int:
+        # (−score,) は同点の (−score, member) より前に並ぶため、より高いスコアの件数になる
+        return bisect.bisect_left(self._sets[key]['order'], (-score,))
+
+    def top(self, key: str, n: int) -> List[Tuple[int, int]]:
+        return [(member, -neg_score) for neg_score, member in self._sets[key]['order'][:n]]
+
+    def card(self, key: str) -> int:
+        return len(self._sets[key]['scores'])
+
+    def _discard(self, entry: Dict, member: int):
+        old_score = entry['scores'].pop(member, None)
+        if old_score is not None:
+            order = entry['order']
+            index = bisect.bisect_left(order, (-old_score, member))
+            if index < len(order) and order[index] == (-old_score, member):
+                del order[index]
+
+
+class RedisSortedSetBackend:
+    """
+    Redis の sorted set を使う集合
+
+    全ワーカーで1つの集合を共有する。キーには TTL を付け、期限切れ前に rebuild_leaderboard コマンドで
+    作り直す。作り直しは SET NX のロック（REBUILD_LOCK_TTL 秒で自動解除）で1プロセスだけが行う。
+    """
+
+    ordered_load = False
+
+    def __init__(self, client, key_ttl: int, chunk_size: int, lock_ttl: int = None):
+        self.client = client
+        self.key_ttl = key_ttl
+        self.chunk_size = chunk_size
+        self.lock_ttl = lock_ttl or LEADERBOARD_CONFIG['REBUILD_LOCK_TTL']
+
+    def _redis_key(self, key: str) -> str:
+        return f'kotoba:leaderboard:{key}'
+
+    def is_loaded(self, key: str) -> bool:
+        return bool(self.client.exists(self._redis_key(key)))
+
+    def load(self, key: str, items: Iterable[Tuple[int, int]]):
+        redis_key = self._redis_key(key)
+        tmp_key = f'{redis_key}:loading'
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(tmp_key)
+        # 空のボードでも「読み込み済み」と判定できるよう番兵を入れる
+        pipe.zadd(tmp_key, {'__sentinel__': -1})
+        chunk = {}
+        for member, score in items:
+            chunk[member] = score
+            if len(chunk) >= self.chunk_size:
+                pipe.zadd(tmp_key, chunk)
+                pipe.execute()
+                chunk = {}
+        if chunk:
+            pipe.zadd(tmp_key, chunk)
+        # 読み込み完了後に入れ替えるため、読み込み中も古い集合で応答できる
+        pipe.rename(tmp_key, redis_key)
+        pipe.expire(redis_key, self.key_ttl)
+        pipe.execute()
+
+    def set_score(self, key: str, member: int, score: int):
+        # 未読み込みの集合には追加しない（次回読み込み時にDBから反映される）
+        if self.is_loaded(key):
+            self.client.zadd(self._redis_key(key), {member: score})
+
+    def remove(self, key: str, member: int):
+        self.client.zrem(self._redis_key(key), member)
+
+    def score(self, key: str, member: int) -> Optional[int]:
+        value = self.client.zscore(self._redis_key(key), member)
+        return None if value is None else int(value)
+
+    def count_above(self, key: str, score: int) -> int:
+        return self.client.zcount(self._redis_key(key), f'({score}', '+inf')
+
+    def top(self, key: str, n: int) -> List[Tuple[int, int]]:
+        rows = self.client.zrevrange(self._redis_key(key), 0, n, withscores=True)
+        return [
+            (int(member), int(score)) for member, score in rows
+            if member not in (b'__sentinel__', '__sentinel__')
+        ][:n]
+
+    def card(self, key: str) -> int:
+        return max(self.client.zcard(self._redis_key(key)) - 1, 0)
+
+    def covers(self, key: str, score: int) -> bool:
+        return True
+
+    def is_complete(self, key: str) -> bool:
+        return True
+
+    def acquire_rebuild_lock(self, key: str) -> bool:
+        # 読み込み用の一時キーを共有するため、同時に作り直すのは1プロセスだけにする
+        return bool(self.client.set(f'{self._redis_key(key)}:rebuild_lock', 1, nx=True, ex=self.lock_ttl))
+
+    def release_rebuild_lock(self, key: str):
+        self.client.delete(f'{self._redis_key(key)}:rebuild_lock')
+
+
+class Leaderboard:
+    """ランキングの取得と更新"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def resolve_board(board: str, user) -> Optional[str]:
+        """
+        APIの board パラメータを内部のボード名に変換する
+
+        'tier' はリクエストしたユーザーのランク帯のボードになる。
+        不正な値の場合は None を返す。
+        """
+        if board == 'tier':
+            return f'tier:{user.rank}'
+        if board.startswith('tier:') and board[5:] in TIER_NAMES:
+            return board
+        if board in BOARDS:
+            return board
+        return None
+
+    def rank(self, user, board: str = 'all') -> Optional[int]:
+        """
+        ユーザーの順位（1始まり・同点は同順位）を返す
+
+        期間ボードでスコアがないユーザー（今週未プレイなど）は None。
+        """
+        key = self._ensure_loaded(board)
+        score = None if key is None else self.backend.score(key, user.id)
+        if score is None:
+            # 集合の外（読み込み後に登録・上位の外）のユーザーはDBのスコアで順位を求める
+            score = self._user_score(board, user)
+            if score is None:
+                return None
+        if key is not None and self.backend.covers(key, score):
+            return self.backend.count_above(key, score) + 1
+        # 上位の外（または集合の作り直し中）は、スコアの索引を使って自分より高いユーザーを数える
+        return self._queryset(board).filter(**{f'{self._score_field(board)}__gt': score}).count() + 1
+
+    def total(self, board: str = 'all') -> int:
+        """ボードに載っているユーザー数"""
+        key = self._ensure_loaded(board)
+        if key is not None and self.backend.is_complete(key):
+            return self.backend.card(key)
+        total_cache_key = f'leaderboard:total:{self._board_key(board)}'
+        total = cache.get(total_cache_key)
+        if total is None:
+            total = self._queryset(board).count()
+            cache.set(total_cache_key, total, LEADERBOARD_CONFIG['SNAPSHOT_TIMEOUT'])
+        return total
+
+    def rebuild(self, board: str) -> Optional[str]:
+        """
+        ボードの集合をDBから作り直す（rebuild_leaderboard コマンドから呼ぶ）
+
+        他のプロセスが作り直し中の場合は何もせず None を返す。
+        """
+        key = self._board_key(board)
+        if not self.backend.acquire_rebuild_lock(key):
+            return None
+        try:
+            self.backend.load(key, self._source(board))
+        finally:
+            self.backend.release_rebuild_lock(key)
+        return key
+
+    def top(self, board: str = 'all') -> List[Dict]:
+        """上位N件の表示用データ（スナップショット）を返す"""
+        snapshot = cache.get(self._snapshot_cache_key(board))
+        if snapshot is None:
+            snapshot = self.refresh_snapshot(board)
+        return snapshot
+
+    def refresh_snapshot(self, board: str) -> List[Dict]:
+        """上位N件のスナップショットを作り直してキャッシュに保存する"""
+        key = self._ensure_loaded(board)
+        if key is None:
+            top_scores = list(self._top_from_db(board, LEADERBOARD_CONFIG['TOP_N']))
+        else:
+            top_scores = self.backend.top(key, LEADERBOARD_CONFIG['TOP_N'])
+        users = User.objects.in_bulk([member for member, _ in top_scores])
+
+        snapshot = []
+        for member, score in top_scores:
+            user = users.get(member)
+            if user is None:
+                continue
+            snapshot.append({
+                'rank': len(snapshot) + 1,
+                'user_id': user.id,
+                'username': user.username,
+                'level': user.level,
+                'rank_name': user.rank,
+                'points_total': user.points_total,
+                'points': score,
+                'consecutive_days': user.consecutive_days,
+            })
+
+        cache.set(
+            self._snapshot_cache_key(board), snapshot, LEADERBOARD_CONFIG['SNAPSHOT_TIMEOUT']
+        )
+        return snapshot
+
+    def record(self, user, old_rank: Optional[str] = None):
+        """
+        セッション終了後にユーザーのスコアを各ボードへ反映する
+
+        finish_session から transaction.on_commit 経由で呼ばれる。
+        """
+        from quiz.models import UserQuizStats
+
+        month_start, week_start = UserQuizStats.period_starts(timezone.localdate())
+        stats = UserQuizStats.objects.filter(user=user).values(
+            'week_start', 'week_points', 'month_start', 'month_points'
+        ).first() or {}
+
+        scores = {'all': user.points_total, f'tier:{user.rank}': user.points_total}
+        if stats.get('week_start') == week_start:
+            scores['weekly'] = stats['week_points']
+        if stats.get('month_start') == month_start:
+            scores['monthly'] = stats['month_points']
+
+        if old_rank and old_rank != user.rank:
+            old_board = f'tier:{old_rank}'
+            self.backend.remove(self._board_key(old_board), user.id)
+            self._refresh_if_listed(old_board, user.id, None)
+
+        for board, score in scores.items():
+            self.backend.set_score(self._board_key(board), user.id, score)
+            self._refresh_if_listed(board, user.id, score)
+
+    def _refresh_if_listed(self, board: str, user_id: int, score: Optional[int]):
+        """
+        スナップショットに影響がある場合だけ作り直す
+
+        既に上位に載っているか、新しいスコアが上位N件の最下位以上の場合が対象。
+        """
+        snapshot = cache.get(self._snapshot_cache_key(board))
+        if snapshot is None:
+            return
+        listed = any(row['user_id'] == user_id for row in snapshot)
+        enters = score is not None and (
+            len(snapshot) < LEADERBOARD_CONFIG['TOP_N'] or score >= snapshot[-1]['points']
+        )
+        if listed or enters:
+            self.refresh_snapshot(board)
+
+    def _ensure_loaded(self, board: str) -> Optional[str]:
+        """
+        ボードの集合のキーを返す
+
+        プロセス内の集合は上位だけを読むため、その場で読み込む。
+        Redis の集合が無い場合は全ユーザーの読み込みをバックグラウンドで行い、None を返す
+        （呼び出し側は作り直しが終わるまで DB で応答する）。
+        """
+        key = self._board_key(board)
+        if self.backend.is_loaded(key):
+            return key
+        if self.backend.ordered_load:
+            self.rebuild(board)
+            return key
+        self._rebuild_in_background(board)
+        return None
+
+    def _rebuild_in_background(self, board: str):
+        """ロックを取れた場合だけ、別スレッドで集合を作り直す"""
+        key = self._board_key(board)
+        if not self.backend.acquire_rebuild_lock(key):
+            return
+
+        def run():
+            try:
+                self.backend.load(key, self._source(board))
+            except Exception as e:
+                print(f"ランキングの作り直しエラー ({key}): {e}")
+            finally:
+                self.backend.release_rebuild_lock(key)
+                # このスレッドのDB接続を残さない
+                connection.close()
+
+        threading.Thread(target=run, name='leaderboard-rebuild', daemon=True).start()
+
+    def _board_key(self, board: str) -> str:
+        """期間ボードは期間の開始日をキーに含め、期間が変わると新しい集合になる"""
+        if board in ('weekly', 'monthly'):
+            from quiz.models import UserQuizStats
+            month_start, week_start = UserQuizStats.period_starts(timezone.localdate())
+            start = week_start if board == 'weekly' else month_start
+            return f'{board}:{start.isoformat()}'
+        return board
+
+    def _snapshot_cache_key(self, board: str) -> str:
+        return f'leaderboard:snapshot:{self._board_key(board)}'
+
+    @staticmethod
+    def _score_field(board: str) -> str:
+        return {'weekly': 'week_points', 'monthly': 'month_points'}.get(board, 'points_total')
+
+    def _queryset(self, board: str):
+        """ボードに載っているユーザーの行（ユーザー・ユーザー統計）"""
+        if board == 'all':
+            return User.objects.all()
+        if board.startswith('tier:'):
+            return User.objects.filter(rank=board[5:])
+        from quiz.models import UserQuizStats
+        month_start, week_start = UserQuizStats.period_starts(timezone.localdate())
+        if board == 'weekly':
+            return UserQuizStats.objects.filter(week_start=week_start, week_sessions__gt=0)
+        return UserQuizStats.objects.filter(month_start=month_start, month_sessions__gt=0)
+
+    def _user_score(self, board: str, user) -> Optional[int]:
+        """ユーザーのボード上のスコア（期間ボードで今期未プレイの場合は None）"""
+        if board in ('weekly', 'monthly'):
+            return self._queryset(board).filter(user=user).values_list(
+                self._score_field(board), flat=True
+            ).first()
+        return user.points_total
+
+    def _source(self, board: str) -> Iterable[Tuple[int, int]]:
+        """
+        ボードの元データを (ユーザーID, スコア) で返す
+
+        プロセス内の集合にはスコアの索引を使って上位だけを高い順に読み込む。
+        """
+        if self.backend.ordered_load:
+            return iter(self._top_from_db(board, self.backend.max_members))
+        return self._values(board).order_by().iterator(chunk_size=LEADERBOARD_CONFIG['LOAD_CHUNK_SIZE'])
+
+    def _top_from_db(self, board: str, n: int):
+        """スコアの索引を使い、上位 n 人の (ユーザーID, スコア) を高い順に読む"""
+        score_field = self._score_field(board)
+        return self._values(board).order_by(f'-{score_field}', self._id_field(board))[:n]
+
+    def _values(self, board: str):
+        return self._queryset(board).values_list(self._id_field(board), self._score_field(board))
+
+    @staticmethod
+    def _id_field(board: str) -> str:
+        return 'id' if board == 'all' or board.startswith('tier:') else 'user_id'
+
+
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+
+def get_leaderboard() -> Leaderboard:
+    """
+    プロセス共通の Leaderboard を返す
+
+    LEADERBOARD_REDIS_URL が設定され redis パッケージが使える場合は Redis、
+    それ以外はプロセス内の集合を使う。
+    """
+    global _leaderboard
+    if _leaderboard is None:
+        with _leaderboard_lock:
+            if _leaderboard is None:
+                _leaderboard = Leaderboard(_create_backend())
+    return _leaderboard
+
+
+def _create_backend():
+    redis_url = getattr(settings, 'LEADERBOARD_REDIS_URL', None)
+    if redis_url and redis is not None:
+        print("ランキング: Redis を使用します")
+        return RedisSortedSetBackend(
+            redis.Redis.from_url(redis_url),
+            key_ttl=LEADERBOARD_CONFIG['REDIS_KEY_TTL'],
+            chunk_size=LEADERBOARD_CONFIG['LOAD_CHUNK_SIZE'],
+            lock_ttl=LEADERBOARD_CONFIG['REBUILD_LOCK_TTL'],
+        )
+    if redis_url:
+        print("ランキング: redis パッケージがないためプロセス内で保持します")
+    return LocalSortedSetBackend(
+        reload_interval=LEADERBOARD_CONFIG['LOCAL_RELOAD_INTERVAL'],
+        max_members=LEADERBOARD_CONFIG['LOCAL_MAX_MEMBERS'],
+    )
+
+
+def record_leaderboard(user, old_rank: Optional[str] = None):
+    """
+    セッション終了をランキングへ反映する
+
+    ランキングの更新に失敗してもクイズの終了処理は止めない。
+    """
+    try:
+        get_leaderboard().record(user, old_rank)
+    except Exception as e:
+        print(f"ランキング更新エラー: {e}")
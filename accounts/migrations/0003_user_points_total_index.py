@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_badge_user_badges_earned_user_consecutive_days_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="points_total",
+            field=models.PositiveIntegerField(
+                db_index=True,
+                default=0,
+                help_text="ユーザーが獲得した総ポイント数",
+                verbose_name="総ポイント数",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["rank", "-points_total"], name="accounts_user_rank_points_idx"
+            ),
+        ),
+    ]
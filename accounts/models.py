@@ -4,12 +4,25 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 
 
+# ランク名と必要ポイント数（昇順）
+RANK_TABLE = [
+    ("ノーマル", 0),
+    ("コモン", 100),
+    ("レア", 300),
+    ("エピック", 700),
+    ("レジェンダリー", 1500),
+    ("ミシック", 3000),
+    ("ゴッド", 5000),
+]
+
+
 class User(AbstractUser):
     """
     小学1年生向け国語クイズアプリのカスタムユーザーモデル
     """
     points_total = models.PositiveIntegerField(
         default=0,
+        db_index=True,
         verbose_name="総ポイント数",
         help_text="ユーザーが獲得した総ポイント数"
     )
@@ -73,6 +86,10 @@ class User(AbstractUser):
     class Meta:
         verbose_name = "ユーザー"
         verbose_name_plural = "ユーザー"
+        indexes = [
+            # ランク帯別ランキング用
+            models.Index(fields=['rank', '-points_total'], name='accounts_user_rank_points_idx'),
+        ]
         
     def __str__(self):
         return f"{self.username} (Lv.{self.level} {self.rank})"
@@ -81,16 +98,6 @@ class User(AbstractUser):
         """
         ポイント数に基づいてランクを更新する
         """
-        RANK_TABLE = [
-            ("ノーマル", 0),
-            ("コモン", 100),
-            ("レア", 300),
-            ("エピック", 700),
-            ("レジェンダリー", 1500),
-            ("ミシック", 3000),
-            ("ゴッド", 5000),
-        ]
-        
         old_rank = self.rank
         for rank, points in reversed(RANK_TABLE):
             if self.points_total >= points:
@@ -119,16 +126,6 @@ class User(AbstractUser):
         """
         次のランクまでの情報を取得する
         """
-        RANK_TABLE = [
-            ("ノーマル", 0),
-            ("コモン", 100),
-            ("レア", 300),
-            ("エピック", 700),
-            ("レジェンダリー", 1500),
-            ("ミシック", 3000),
-            ("ゴッド", 5000),
-        ]
-        
         current_rank_index = None
         for i, (rank, points) in enumerate(RANK_TABLE):
             if rank == self.rank:
@@ -1,3 +1,157 @@
-from django.test import TestCase
-
-# Create your tests here.
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from quiz.models import Question, QuizSession
+
+from . import leaderboard
+from .leaderboard import Leaderboard, LocalSortedSetBackend, RedisSortedSetBackend
+from .models import User
+from .views import user_ranking_api
+
+
+class LocalSortedSetBackendTests(TestCase):
+    def test_rank_counts_only_higher_scores(self):
+        backend = LocalSortedSetBackend(reload_interval=60)
+        backend.load('all', [(1, 50), (2, 80), (3, 50), (4, 10)])
+
+        self.assertEqual(backend.count_above('all', 80), 0)
+        self.assertEqual(backend.count_above('all', 50), 1)
+        self.assertEqual(backend.count_above('all', 10), 3)
+
+        backend.set_score('all', 4, 90)
+        self.assertEqual(backend.top('all', 2), [(4, 90), (2, 80)])
+        self.assertEqual(backend.card('all'), 4)
+
+    def test_capped_set_keeps_top_members_only(self):
+        backend = LocalSortedSetBackend(reload_interval=60, max_members=2)
+        backend.load('all', [(2, 80), (1, 50), (3, 50), (4, 10)])
+
+        self.assertEqual(backend.card('all'), 2)
+        self.assertFalse(backend.is_complete('all'))
+        self.assertTrue(backend.covers('all', 50))
+        self.assertFalse(backend.covers('all', 40))
+
+        # 上位に入ったスコアは集合に加わり、押し出された最下位は集合の外になる
+        backend.set_score('all', 4, 90)
+        self.assertEqual(backend.top('all', 3), [(4, 90), (2, 80)])
+        backend.set_score('all', 5, 20)
+        self.assertIsNone(backend.score('all', 5))
+
+
+class FakeRedis:
+    """集合の作り直しのロック（SET NX）と、キーの有無だけを扱う Redis の代わり"""
+
+    def __init__(self):
+        self.values = {}
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class UserRankingApiTests(TestCase):
+    def setUp(self):
+        leaderboard._leaderboard = None
+        cache.clear()
+        self.factory = RequestFactory()
+        self.alice = User.objects.create_user(username='alice', points_total=300, rank='レア')
+        self.bob = User.objects.create_user(username='bob', points_total=120, rank='コモン')
+        self.carol = User.objects.create_user(username='carol', points_total=120, rank='コモン')
+
+    def request_ranking(self, user, **params):
+        request = self.factory.get('/accounts/api/ranking/', params)
+        request.user = user
+        response = user_ranking_api(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_overall_ranking(self):
+        status, data = self.request_ranking(self.carol)
+        self.assertEqual(status, 200)
+
+        self.assertEqual(data['board'], 'all')
+        self.assertEqual([row['username'] for row in data['ranking']][0], 'alice')
+        self.assertEqual(data['current_user_rank'], 2)
+        self.assertEqual(data['total_users'], 3)
+
+    def test_ranks_below_local_top_are_counted_in_db(self):
+        dave = User.objects.create_user(username='dave', points_total=50, rank='コモン')
+        with mock.patch.dict(leaderboard.LEADERBOARD_CONFIG, {'LOCAL_MAX_MEMBERS': 1}):
+            leaderboard._leaderboard = None
+            _, carol = self.request_ranking(self.carol)
+            _, data = self.request_ranking(dave)
+
+        self.assertEqual(carol['current_user_rank'], 2)
+        self.assertEqual(data['current_user_rank'], 4)
+        self.assertEqual(data['total_users'], 4)
+        self.assertEqual([row['username'] for row in data['ranking']], ['alice'])
+
+    def test_tier_board_and_invalid_board(self):
+        _, data = self.request_ranking(self.bob, board='tier')
+        self.assertEqual(data['board'], 'tier:コモン')
+        self.assertEqual(data['total_users'], 2)
+
+        status, _ = self.request_ranking(self.bob, board='yearly')
+        self.assertEqual(status, 400)
+
+    def test_finish_session_updates_snapshot_and_weekly_board(self):
+        # スナップショットを作成しておく
+        self.request_ranking(self.bob)
+
+        session = QuizSession.objects.create(user=self.bob)
+        question = Question.objects.create(
+            session=session, text='問題', question_number=1,
+            choices=['あ', 'い', 'う'], correct_idx=0
+        )
+        question.answers.create(selected_idx=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            session.finish_session()
+
+        self.bob.refresh_from_db()
+        _, data = self.request_ranking(self.bob)
+        bob_row = next(row for row in data['ranking'] if row['username'] == 'bob')
+        self.assertEqual(bob_row['points_total'], self.bob.points_total)
+        self.assertEqual(data['current_user_rank'], 2)
+
+        _, weekly = self.request_ranking(self.bob, board='weekly')
+        self.assertEqual(weekly['current_user_rank'], 1)
+        self.assertEqual(weekly['total_users'], 1)
+        _, weekly = self.request_ranking(self.alice, board='weekly')
+        self.assertIsNone(weekly['current_user_rank'])
+
+    def test_missing_redis_set_is_served_from_db_and_rebuilt_in_background(self):
+        client = FakeRedis()
+        leaderboard._leaderboard = Leaderboard(RedisSortedSetBackend(client, key_ttl=60, chunk_size=100))
+
+        with mock.patch.object(leaderboard.threading, 'Thread') as thread:
+            status, data = self.request_ranking(self.carol)
+            self.request_ranking(self.bob)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['current_user_rank'], 2)
+        self.assertEqual(data['total_users'], 3)
+        self.assertEqual([row['username'] for row in data['ranking']], ['alice', 'bob', 'carol'])
+        # 作り直しはロックを取れた1回だけ
+        thread.assert_called_once()
+        self.assertIn('kotoba:leaderboard:all:rebuild_lock', client.values)
+
+    def test_rebuild_is_skipped_while_another_process_holds_the_lock(self):
+        client = FakeRedis()
+        client.set('kotoba:leaderboard:all:rebuild_lock', 1)
+        board = Leaderboard(RedisSortedSetBackend(client, key_ttl=60, chunk_size=100))
+
+        with mock.patch.object(leaderboard.threading, 'Thread') as thread:
+            self.assertEqual(board.rank(self.alice), 1)
+
+        thread.assert_not_called()
+        self.assertIsNone(board.rebuild('all'))
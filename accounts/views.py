@@ -6,7 +6,6 @@ from django.contrib import messages
 from django.urls import reverse_lazy
 from .models import User
 from .forms import CustomUserCreationForm
-from django.db import models
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 import json
@@ -34,14 +33,15 @@ class ProfileView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         
-        # 学習統計を計算
-        from quiz.models import QuizSession
+        # 学習統計（finish_session で差分更新される集計行を読む）
+        from quiz.models import QuizSession, UserQuizStats
         sessions = QuizSession.objects.filter(user=user, is_completed=True)
+        stats = UserQuizStats.for_user(user)
         
         context.update({
-            'total_sessions': sessions.count(),
-            'total_score': sum(session.score for session in sessions),
-            'average_score': sessions.aggregate(avg_score=models.Avg('score'))['avg_score'] or 0,
+            'total_sessions': stats.total_sessions,
+            'total_score': stats.total_score,
+            'average_score': stats.average_score,
             'recent_sessions': sessions.order_by('-started_at')[:5],
             'next_rank_info': user.get_next_rank_info(),
         })
@@ -147,29 +147,25 @@ def update_user_profile_api(request):
 
 @login_required
 def user_ranking_api(request):
-    """ユーザーランキング取得API"""
-    # トップ20ユーザーを取得
-    top_users = User.objects.order_by('-points_total')[:20]
-    
-    ranking_data = []
-    for i, user in enumerate(top_users, 1):
-        ranking_data.append({
-            'rank': i,
-            'username': user.username,
-            'level': user.level,
-            'rank_name': user.rank,
-            'points_total': user.points_total,
-            'consecutive_days': user.consecutive_days,
-        })
-    
-    # 現在のユーザーの順位を計算
-    current_user_rank = User.objects.filter(
-        points_total__gt=request.user.points_total
-    ).count() + 1
+    """
+    ユーザーランキング取得API
+
+    クエリパラメータ board で all（総合）/ weekly / monthly / tier（自分のランク帯）を切り替える。
+    上位はキャッシュ済みスナップショット、自分の順位はソート済み集合から求める。
+    プロセス内の集合（Redis 未使用時）の上位の外のユーザーは、スコアの索引を使った COUNT で求める。
+    """
+    from .leaderboard import get_leaderboard, Leaderboard
+
+    board = Leaderboard.resolve_board(request.GET.get('board', 'all'), request.user)
+    if board is None:
+        return JsonResponse({'status': 'error', 'message': '不正なランキング種別です'}, status=400)
+
+    leaderboard = get_leaderboard()
     
     return JsonResponse({
         'status': 'success',
-        'ranking': ranking_data,
-        'current_user_rank': current_user_rank,
-        'total_users': User.objects.count()
+        'board': board,
+        'ranking': leaderboard.top(board),
+        'current_user_rank': leaderboard.rank(request.user, board),
+        'total_users': leaderboard.total(board)
     })
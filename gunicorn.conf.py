@@ -0,0 +1,28 @@
+"""
+gunicorn の設定（Procfile の web プロセスはカレントディレクトリのこのファイルを自動で読み込む）
+
+環境変数:
+    GUNICORN_PRELOAD=1  マスタープロセスでアプリと重いモジュール（openai SDK・pykakasi の辞書）を
+                        フォーク前に読み込む（--preload と同じ。ワーカー間でメモリを共有する）
+    GUNICORN_WARMUP=0   ワーカー起動直後のウォームアップを行わない（既定は行う）
+
+ウォームアップの内容は quiz/warmup.py を参照。
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD') == '1'
+_warmup_enabled = os.environ.get('GUNICORN_WARMUP', '1') == '1'
+
+
+def when_ready(server):
+    # --preload の場合はアプリ（Django）が読み込み済みのため、フォーク前に共有できるものだけ読み込む
+    if preload_app and _warmup_enabled:
+        from quiz.warmup import warm_up
+        server.log.info('ウォームアップ（マスター）: %s', warm_up(per_process=False))
+
+
+def post_worker_init(worker):
+    # ワーカーがアプリを読み込んだ直後、最初のリクエストを受け付ける前に呼ばれる
+    if _warmup_enabled:
+        from quiz.warmup import warm_up
+        worker.log.info('ウォームアップ（ワーカー %s）: %s', worker.pid, warm_up())
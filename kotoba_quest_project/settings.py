@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util
 import os
 from dotenv import load_dotenv
 
@@ -63,6 +64,8 @@ if RAILWAY_APP_URL:
 # OpenAI API Settings
 # 環境変数から取得するように変更
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# OpenAI 互換APIの接続先（未設定時は公式API。負荷試験ではローカルの疑似サーバーを指定する）
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
 # Railway環境やマイグレーション時はAPIキーをオプションにする
 if not OPENAI_API_KEY and not DEBUG and not os.getenv('RAILWAY_ENVIRONMENT_NAME'):
     import sys
@@ -72,6 +75,21 @@ if not OPENAI_API_KEY and not DEBUG and not os.getenv('RAILWAY_ENVIRONMENT_NAME'
     else:
         print("Warning: OPENAI_API_KEY not set. Some features may not work.")
 
+# Leaderboard Settings
+# 設定するとランキングを Redis の sorted set で保持する（未設定時はプロセス内で保持）
+LEADERBOARD_REDIS_URL = os.getenv('LEADERBOARD_REDIS_URL')
+
+# Cache
+# ランキングのスナップショットなどを全ワーカーで共有するため、Redis がある場合は同じ Redis を使う
+# （未設定時は Django 既定のプロセスごとの LocMemCache）
+if LEADERBOARD_REDIS_URL and importlib.util.find_spec('redis') is not None:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': LEADERBOARD_REDIS_URL,
+        }
+    }
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import QuizSession, Question, Answer, PreGeneratedQuestion
+from .models import QuizSession, Question, Answer, PreGeneratedQuestion, UserQuizStats, UserSeenQuestions
 
 
 class QuestionInline(admin.TabularInline):
@@ -53,13 +53,34 @@ class AnswerAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('question__session__user')
 
 
+@admin.register(UserQuizStats)
+class UserQuizStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total_sessions', 'total_score', 'best_score', 'total_points', 'updated_at']
+    search_fields = ['user__username']
+    readonly_fields = [field.name for field in UserQuizStats._meta.fields]
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(UserSeenQuestions)
+class UserSeenQuestionsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'current_count', 'updated_at']
+    search_fields = ['user__username']
+    exclude = ['current_bits', 'previous_bits']
+    readonly_fields = ['user', 'current_count', 'updated_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
 @admin.register(PreGeneratedQuestion)
 class PreGeneratedQuestionAdmin(admin.ModelAdmin):
     list_display = ['question_text_short', 'category', 'quality_score', 'used_count', 'correct_rate', 'is_active', 'created_at']
     list_filter = ['category', 'is_active', 'quality_score']
     search_fields = ['question_text', 'Choice_1', 'choice_2', 'choice_3']
     ordering = ['-quality_score', '-created_at']
-    readonly_fields = ['used_count', 'correct_rate', 'created_at']
+    readonly_fields = ['used_count', 'attempt_count', 'correct_count', 'correct_rate', 'created_at']
     
     def question_text_short(self, obj):
         return obj.question_text[:50] + '...' if len(obj.question_text) > 50 else obj.question_text
@@ -73,7 +94,7 @@ class PreGeneratedQuestionAdmin(admin.ModelAdmin):
             'fields': ('quality_score', 'category')
         }),
         ('統計情報', {
-            'fields': ('used_count', 'correct_rate'),
+            'fields': ('used_count', ('attempt_count', 'correct_count'), 'correct_rate'),
             'classes': ('collapse',)
         }),
         ('管理', {
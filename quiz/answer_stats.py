@@ -0,0 +1,125 @@
+"""
+問題プールの回答数・正解数の差分集計
+
+回答API（submit_answer_api）では何もせず、定期的に実行するジョブが前回の続きから
+回答テーブルを集計する。処理済みの位置は StatsWatermark に Answer の id で保持する。
+
+1回の集計は「出題元ごとの GROUP BY 1回 + 件数を加算する UPDATE（500問ごとに1回）+
+処理済み位置の更新」で、同じトランザクション内で行うため二重に加算されることはない。
+
+id の順とコミットの順は一致しない（PostgreSQL では小さい id の回答が、大きい id を読んだ後に
+コミットされることがある）ため、最大の id をそのまま処理済み位置にすると回答を読み飛ばす。
+そこで最大の id を観測して記録しておき、ANSWER_STATS_COMMIT_LAG 秒たってから、その id までを
+集計する。観測時点で実行中だった回答の保存（短いトランザクション）はその間に確定している。
+回答日時（answered_at）は端末側の日時のため、この判定には使えない。
+"""
+from datetime import timedelta
+from typing import Dict
+
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Case, Count, F, FloatField, Max, Q, Value, When
+from django.db.models.functions import Cast
+
+from .models import Answer, PreGeneratedQuestion, StatsWatermark
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+WATERMARK_NAME = 'pregenerated_answer_stats'
+
+# 1回の UPDATE で更新する問題数（CASE 式の大きさを抑える）
+UPDATE_CHUNK_SIZE = 500
+
+
+def aggregate_answer_stats(batch_size: int = None, commit_lag: float = None) -> Dict:
+    """
+    前回の集計以降の回答を出題元の問題ごとに集計し、回答数・正解数に加算する
+
+    Args:
+        batch_size: 1回のトランザクションで集計する回答 id の範囲
+        commit_lag: 観測した最大の id を集計に使うまでの時間（秒。0 なら観測した id をすぐ使う）
+
+    Returns:
+        集計した回答数・更新した問題数・処理済みの位置
+    """
+    batch_size = batch_size or SPEED_OPTIMIZATION_CONFIG['ANSWER_STATS_BATCH_SIZE']
+    if commit_lag is None:
+        commit_lag = SPEED_OPTIMIZATION_CONFIG['ANSWER_STATS_COMMIT_LAG']
+    result = {'answers': 0, 'questions': 0, 'batches': 0, 'last_id': 0}
+    max_id = _safe_max_id(commit_lag)
+
+    while True:
+        with transaction.atomic():
+            watermark, _ = StatsWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+            result['last_id'] = watermark.last_id
+            if watermark.last_id >= max_id:
+                break
+            upper = min(max_id, watermark.last_id + batch_size)
+
+            totals = list(
+                Answer.objects.filter(
+                    id__gt=watermark.last_id, id__lte=upper, question__source__isnull=False
+                )
+                .values('question__source_id')
+                .annotate(attempts=Count('id'), corrects=Count('id', filter=Q(is_correct=True)))
+                .order_by()
+            )
+            for start in range(0, len(totals), UPDATE_CHUNK_SIZE):
+                _apply_totals(totals[start:start + UPDATE_CHUNK_SIZE])
+
+            watermark.last_id = upper
+            watermark.save(update_fields=['last_id', 'updated_at'])
+
+        result['answers'] += sum(row['attempts'] for row in totals)
+        result['questions'] += len(totals)
+        result['batches'] += 1
+        result['last_id'] = upper
+
+    return result
+
+
+def _safe_max_id(commit_lag: float) -> int:
+    """
+    集計してよい最大の id（それ以下の回答は全てコミット済みとみなせる位置）
+
+    前回観測した最大の id が commit_lag 秒以上前のものならそれを返し、新しく観測し直す。
+    まだ新しい場合は観測をそのまま残し、集計済みの位置を返す（頻繁に実行しても観測が
+    先送りされ続けることはない）。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        watermark, _ = StatsWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        # 観測より前に割り当てられた id は、観測時点で実行中でも commit_lag の間に確定する
+        max_id = Answer.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        if commit_lag <= 0:
+            return max_id
+
+        safe_id = watermark.last_id
+        observed_at = watermark.observed_at
+        if observed_at is not None and observed_at <= now - timedelta(seconds=commit_lag):
+            safe_id = max(safe_id, watermark.observed_id)
+            observed_at = None
+        if observed_at is None:
+            watermark.observed_id = max_id
+            watermark.observed_at = now
+            watermark.save(update_fields=['observed_id', 'observed_at', 'updated_at'])
+        return safe_id
+
+
+def _apply_totals(totals):
+    """出題元ごとの回答数・正解数を1回の UPDATE で加算し、正答率も更新する"""
+    attempts = Case(
+        *[When(id=row['question__source_id'], then=Value(row['attempts'])) for row in totals],
+        default=Value(0)
+    )
+    corrects = Case(
+        *[When(id=row['question__source_id'], then=Value(row['corrects'])) for row in totals],
+        default=Value(0)
+    )
+    # 右辺の列は更新前の値を参照するため、正答率は加算後の件数で計算する
+    PreGeneratedQuestion.objects.filter(
+        id__in=[row['question__source_id'] for row in totals]
+    ).update(
+        attempt_count=F('attempt_count') + attempts,
+        correct_count=F('correct_count') + corrects,
+        correct_rate=Cast(F('correct_count') + corrects, FloatField()) / (F('attempt_count') + attempts),
+    )
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class QuizConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quiz'
+
+    def ready(self):
+        # 問題プールの変更をスナップショットへ通知するシグナルを登録
+        from . import pool_snapshot  # noqa: F401
@@ -0,0 +1,175 @@
+"""
+負荷試験・テスト用のローカル OpenAI 互換サーバー
+
+/v1/chat/completions に対し、指定した遅延の後でプロンプトの問題数・問題タイプに
+合わせた応答を返す。モデルの応答待ちを再現するためのもので、本番では使用しない。
+stream=True の依頼には Server-Sent Events で応答し、問題ごとに question_delay 秒ずつ
+間を空けて断片を送る（最初の断片までの遅延は delay）。
+
+Usage:
+    with FakeOpenAIServer(delay=1.0) as base_url:
+        # settings.OPENAI_BASE_URL に base_url を指定して生成を呼び出す
+        ...
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _FakeOpenAIHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 数百の同時接続を受け付けられるようにする
+    request_queue_size = 1024
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        self.server.fake.record_request()
+
+        time.sleep(self.server.fake.delay)
+
+        messages = payload.get('messages', [])
+        system_prompt = messages[0]['content'] if messages else ''
+        user_prompt = messages[-1]['content'] if messages else ''
+        match = re.search(r'(\d+)問', user_prompt)
+        num_questions = int(match.group(1)) if match else 10
+
+        if '算数' in system_prompt:
+            content = self.server.fake.math_content(num_questions)
+        else:
+            content = self.server.fake.language_content(num_questions)
+
+        if payload.get('stream'):
+            try:
+                self._stream(payload, content)
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアントが必要数を受け取って接続を閉じた
+                self.close_connection = True
+            return
+        # 通常の応答は全ての問題が生成し終わってから返る
+        time.sleep(self.server.fake.question_delay * content.count('\n\n'))
+
+        body = json.dumps({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'gpt-4o-mini'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }, ensure_ascii=False).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, payload, content: str):
+        """応答本文を問題ごとの断片に分けて Server-Sent Events で送る"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def event(delta=None, usage=None):
+            data = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': payload.get('model', 'gpt-4o-mini'),
+                'choices': [] if delta is None else [{'index': 0, 'delta': delta, 'finish_reason': None}],
+                'usage': usage,
+            }
+            self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+
+        event({'role': 'assistant', 'content': ''})
+        blocks = content.split('\n\n')
+        for i, block in enumerate(blocks):
+            if i:
+                time.sleep(self.server.fake.question_delay)
+            text = block + ('\n\n' if i < len(blocks) - 1 else '')
+            # 実際の応答と同じく、行の途中で切れた断片として送る
+            middle = len(text) // 2
+            event({'content': text[:middle]})
+            event({'content': text[middle:]})
+        if (payload.get('stream_options') or {}).get('include_usage'):
+            event(usage={'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0})
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # 負荷試験中のアクセスログは出力しない
+        pass
+
+
+class FakeOpenAIServer:
+    """別スレッドで動く OpenAI 互換の疑似サーバー"""
+
+    def __init__(self, delay: float = 0.5, host: str = '127.0.0.1', port: int = 0, question_delay: float = 0.0):
+        self.delay = delay
+        self.question_delay = question_delay
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._serial = itertools.count(1)
+        self._httpd = _FakeOpenAIHTTPServer((host, port), _FakeOpenAIHandler)
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> str:
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def language_content(self, num_questions: int) -> str:
+        """国語問題の応答本文（重複排除で消えないよう問題文に通し番号を入れる）"""
+        blocks = []
+        for i in range(1, num_questions + 1):
+            serial = next(self._serial)
+            blocks.append(
+                f"問題{i}: 「わんわん」と なくのは どれでしょう？（{serial}）\n"
+                "A) いぬ\nB) ねこ\nC) とり\n正解: A"
+            )
+        return "\n\n".join(blocks)
+
+    def math_content(self, num_questions: int) -> str:
+        """算数問題の応答本文"""
+        blocks = []
+        for i in range(1, num_questions + 1):
+            a, b = i % 9 + 1, (i * 3) % 9 + 1
+            blocks.append(f"問題{i}: {a} + {b} = ?\n答え: {a + b}")
+        return "\n\n".join(blocks)
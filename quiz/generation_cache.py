@@ -0,0 +1,295 @@
+"""
+問題生成の応答キャッシュ
+
+_build_prompt / _build_math_prompt は問題数（と出題分野）が同じなら全く同じプロンプトになるため、
+モデル・プロンプト・サンプリング設定のハッシュをキーにして応答本文をキャッシュする。
+1つのキーには異なる応答を最大 GENERATION_CACHE_VARIANTS 件まで貯め、揃った後は
+順番に使い回す（毎回同じ問題にならないようにする）。揃うまではキャッシュミスとして API を呼ぶ。
+
+保存先はバックエンドで切り替える:
+    memory: プロセス内（LRU + TTL）
+    file:   GENERATION_CACHE_DIR 以下の JSON ファイル（更新日時による LRU + TTL）
+    django: Django のキャッシュ（settings.CACHES。TTL と追い出しはキャッシュ側に任せる）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .generation_engine import estimate_request_tokens
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+# キーに含めるサンプリング設定
+_KEY_PARAMS = ('model', 'temperature', 'top_p', 'max_tokens')
+
+
+def cache_key(chat_params: Dict) -> str:
+    """モデル + プロンプトのハッシュ + サンプリング設定からキャッシュキーを作る"""
+    prompt_hash = hashlib.sha256(
+        json.dumps(chat_params['messages'], ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    sampling = ':'.join(str(chat_params.get(name)) for name in _KEY_PARAMS[1:])
+    return f"quizgen:{chat_params['model']}:{sampling}:{prompt_hash}"
+
+
+class MemoryCacheBackend:
+    """プロセス内のキャッシュ（キー数の上限を超えたら最も使われていないキーから捨てる）"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry['created'] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: Dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCacheBackend:
+    """ディレクトリ内の JSON ファイルに保存するキャッシュ（プロセス再起動後も残る）"""
+
+    blocking = True
+
+    def __init__(self, directory: str, max_entries: int, ttl: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['created'] > self.ttl:
+            self._remove(path)
+            return None
+        # 更新日時を LRU の順序として使う
+        os.utime(path)
+        return entry
+
+    def set(self, key: str, entry: Dict):
+        path = self._path(key)
+        with self._lock:
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+            self._evict()
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                self._remove(os.path.join(self.directory, name))
+
+    def _evict(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class DjangoCacheBackend:
+    """Django のキャッシュフレームワークを使うキャッシュ（複数プロセスで共有できる）"""
+
+    blocking = True
+
+    def __init__(self, alias: str, ttl: int):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, entry: Dict):
+        # TTL は最初の応答を保存した時刻から数える
+        remaining = self.ttl - (time.time() - entry['created'])
+        if remaining > 0:
+            self.cache.set(key, entry, timeout=remaining)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class GenerationCache:
+    """
+    生成応答のキャッシュ（N件の応答を順番に使い回す）
+
+    Args:
+        backend: 保存先のバックエンド
+        variants: 1つのキーに貯める応答の数
+    """
+
+    def __init__(self, backend, variants: int = None):
+        self.backend = backend
+        self.variants = max(1, variants or SPEED_OPTIMIZATION_CONFIG['GENERATION_CACHE_VARIANTS'])
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'saved_tokens': 0, 'saved_cost_usd': 0.0}
+
+    @property
+    def blocking(self) -> bool:
+        """バックエンドがI/Oを伴うか（非同期ではスレッドで呼ぶ）"""
+        return self.backend.blocking
+
+    def get(self, chat_params: Dict) -> Optional[str]:
+        """
+        キャッシュ済みの応答本文を取得する
+
+        応答が variants 件揃っていない間は None（呼び出し元で API を呼んで put する）。
+        """
+        key = cache_key(chat_params)
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"生成キャッシュ取得エラー: {e}")
+            entry = None
+
+        if entry is None or len(entry['variants']) < self.variants:
+            self._count(misses=1)
+            return None
+
+        with self._lock:
+            index = entry['cursor'] % len(entry['variants'])
+            entry['cursor'] = index + 1
+        try:
+            self.backend.set(key, entry)
+        except Exception as e:
+            print(f"生成キャッシュ更新エラー: {e}")
+
+        variant = entry['variants'][index]
+        self._count(hits=1, saved_tokens=variant['prompt_tokens'] + variant['completion_tokens'],
+                    saved_cost_usd=self._cost(variant))
+        return variant['content']
+
+    def put(self, chat_params: Dict, content: str, usage=None):
+        """API の応答本文を保存する（同じ本文や上限を超える分は保存しない）"""
+        if not content:
+            return
+        key = cache_key(chat_params)
+        prompt_tokens, completion_tokens = self._usage_tokens(chat_params, usage)
+        try:
+            entry = self.backend.get(key) or {'created': time.time(), 'cursor': 0, 'variants': []}
+            if len(entry['variants']) >= self.variants:
+                return
+            if any(variant['content'] == content for variant in entry['variants']):
+                return
+            entry['variants'].append({
+                'content': content,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+            })
+            self.backend.set(key, entry)
+        except Exception as e:
+            print(f"生成キャッシュ保存エラー: {e}")
+            return
+        self._count(stores=1)
+
+    def stats(self) -> Dict:
+        """ヒット率と節約できたトークン数・費用（プロセス内の集計）"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['saved_cost_usd'] = round(stats['saved_cost_usd'], 6)
+        return stats
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self._stats[name] += amount
+
+    @staticmethod
+    def _usage_tokens(chat_params: Dict, usage):
+        """応答の usage を使い、無い場合は見積もり（プロンプト分 + max_tokens）で代用する"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        if not prompt_tokens and not completion_tokens:
+            estimated = estimate_request_tokens(chat_params)
+            completion_tokens = chat_params.get('max_tokens', 0)
+            prompt_tokens = estimated - completion_tokens
+        return prompt_tokens, completion_tokens
+
+    @staticmethod
+    def _cost(variant: Dict) -> float:
+        return (
+            variant['prompt_tokens'] * SPEED_OPTIMIZATION_CONFIG['OPENAI_INPUT_COST_PER_1M_TOKENS']
+            + variant['completion_tokens'] * SPEED_OPTIMIZATION_CONFIG['OPENAI_OUTPUT_COST_PER_1M_TOKENS']
+        ) / 1_000_000
+
+
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+
+def get_generation_cache() -> Optional[GenerationCache]:
+    """設定（GENERATION_CACHE_BACKEND）に応じた生成キャッシュを取得する（無効なら None）"""
+    global _generation_cache
+    backend_name = SPEED_OPTIMIZATION_CONFIG['GENERATION_CACHE_BACKEND']
+    if not backend_name:
+        return None
+    if _generation_cache is None:
+        with _generation_cache_lock:
+            if _generation_cache is None:
+                _generation_cache = GenerationCache(_create_backend(backend_name))
+    return _generation_cache
+
+
+def _create_backend(backend_name: str):
+    ttl = SPEED_OPTIMIZATION_CONFIG['CACHE_DURATION']
+    max_entries = SPEED_OPTIMIZATION_CONFIG['GENERATION_CACHE_MAX_KEYS']
+    if backend_name == 'file':
+        directory = SPEED_OPTIMIZATION_CONFIG['GENERATION_CACHE_DIR'] or os.path.join(
+            settings.BASE_DIR, '.generation_cache'
+        )
+        return FileCacheBackend(str(directory), max_entries, ttl)
+    if backend_name == 'django':
+        return DjangoCacheBackend(SPEED_OPTIMIZATION_CONFIG['GENERATION_CACHE_ALIAS'], ttl)
+    return MemoryCacheBackend(max_entries, ttl)
@@ -0,0 +1,177 @@
+"""
+問題の並列生成エンジン
+
+OpenAI API 呼び出しをスレッドプールで並列に実行し、完了したバッチから順に
+呼び出し元のコールバック（品質評価・DB保存）へ渡す。API呼び出しの前には
+RPM（リクエスト数/分）と TPM（トークン数/分）の両方の上限を守るよう待機する。
+
+DBへの書き込みはコールバックを呼び出すスレッド（呼び出し元）だけで行うため、
+ワーカースレッドはAPI呼び出しとパースのみを担当する。
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+
+
+class RateLimiter:
+    """
+    RPM / TPM のトークンバケット（スレッドセーフ）
+
+    バケットは1分あたりの上限量を容量とし、毎秒 上限/60 ずつ回復する。
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> float:
+        """
+        1リクエスト分と指定トークン数を確保できるまで待機する
+
+        Returns:
+            待機した秒数
+        """
+        # 1回で上限を超える要求は上限まで待てば通す（永久に待たない）
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return waited
+                wait_seconds = max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+
+def estimate_request_tokens(chat_params: Dict) -> int:
+    """
+    1リクエストの消費トークン数の見積もり
+
+    日本語は概ね1文字1トークン以下のため、プロンプトの文字数に
+    応答の上限（max_tokens）を足した値を上限側の見積もりとして使う。
+    """
+    prompt_chars = sum(len(message['content']) for message in chat_params['messages'])
+    return prompt_chars + chat_params.get('max_tokens', 0)
+
+
+class GenerationEngine:
+    """
+    バッチ生成をスレッドプールで並列実行するエンジン
+
+    Args:
+        generate_batch: 問題数を受け取り問題リストを返す関数（ワーカースレッドで実行）
+        concurrency: 同時に実行するAPI呼び出し数
+        rate_limiter: API呼び出し前に待機するレートリミッター（任意）
+        tokens_per_batch: 1バッチあたりの見積もりトークン数
+    """
+
+    def __init__(self, generate_batch: Callable[[int], List[Dict]], concurrency: int = 4,
+                 rate_limiter: RateLimiter = None, tokens_per_batch: int = 0):
+        self.generate_batch = generate_batch
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter
+        self.tokens_per_batch = tokens_per_batch
+        self._rate_limited_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def run(self, target: int, batch_size: int, max_generated: int,
+            on_batch: Callable[[List[Dict]], int], progress: Callable[[Dict], None] = None) -> Dict:
+        """
+        目標数が採用されるまでバッチ生成を並列に実行する
+
+        Args:
+            target: 採用したい問題数
+            batch_size: 1回のAPI呼び出しで生成する問題数
+            max_generated: 生成を依頼する問題数の上限（品質不足やエラーが続く場合の打ち切り）
+            on_batch: 完了したバッチを受け取り、採用した問題数を返すコールバック
+            progress: バッチ処理ごとに途中経過を受け取るコールバック（任意）
+
+        Returns:
+            実行結果の統計情報（questions_per_second を含む）
+        """
+        started = time.perf_counter()
+        accepted = 0
+        generated = 0
+        requested = 0
+        api_calls = 0
+        failed_batches = 0
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='quiz-gen') as executor:
+            while True:
+                # 採用率の実績から、実行中のバッチで目標に届く見込みなら追加投入しない
+                expected_yield = accepted / generated if generated else 1.0
+                expected = accepted + len(in_flight) * batch_size * expected_yield
+                while (len(in_flight) < self.concurrency
+                       and expected < target
+                       and requested + sum(in_flight.values()) < max_generated):
+                    size = min(batch_size, max(1, target - accepted))
+                    in_flight[executor.submit(self._call, size)] = size
+                    expected += size * expected_yield
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    requested += in_flight.pop(future)
+                    api_calls += 1
+                    try:
+                        questions = future.result()
+                    except Exception as e:
+                        failed_batches += 1
+                        print(f"⚠️ バッチ生成エラー: {e}")
+                        continue
+                    generated += len(questions)
+                    if accepted < target:
+                        accepted += on_batch(questions)
+
+                    if progress:
+                        progress(self._stats(started, target, accepted, generated, api_calls, failed_batches))
+
+                if accepted >= target:
+                    # 目標到達後に完了したバッチは待つだけで保存しない
+                    for future in in_flight:
+                        future.cancel()
+                    in_flight.clear()
+
+        return self._stats(started, target, accepted, generated, api_calls, failed_batches)
+
+    def _call(self, size: int) -> List[Dict]:
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire(self.tokens_per_batch)
+            with self._stats_lock:
+                self._rate_limited_seconds += waited
+        return self.generate_batch(size)
+
+    def _stats(self, started, target, accepted, generated, api_calls, failed_batches) -> Dict:
+        elapsed = time.perf_counter() - started
+        return {
+            'target': target,
+            'accepted': accepted,
+            'generated': generated,
+            'api_calls': api_calls,
+            'failed_batches': failed_batches,
+            'elapsed_seconds': round(elapsed, 2),
+            'questions_per_second': round(accepted / elapsed, 2) if elapsed > 0 else 0,
+            'rate_limited_seconds': round(self._rate_limited_seconds, 2),
+            'concurrency': self.concurrency,
+        }
@@ -0,0 +1,145 @@
+"""
+問題生成の再試行プランナー
+
+モデルの応答はパース失敗や重複排除で依頼数より少なくなることがあるため、
+過去の歩留まり（取得数/依頼数）から学習した係数の分だけ多めに依頼する（10問欲しい時に13問依頼など）。
+不足した場合の再依頼は回数と締め切り（API_TIMEOUT）の両方で打ち切り、
+残りは呼び出し元が指定した補完（問題プール → フォールバック問題）で埋める。
+"""
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+
+class YieldTracker:
+    """
+    問題タイプごとの「依頼数/取得数」の指数移動平均（プロセス内）
+
+    1.0 は依頼通りに取得できていることを表す。極端な値にならないよう上下限で丸める。
+    """
+
+    def __init__(self, alpha: float = 0.3, minimum: float = 1.0, maximum: float = 2.0):
+        self.alpha = alpha
+        self.minimum = minimum
+        self.maximum = maximum
+        self._factors: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def factor(self, question_type: str) -> float:
+        return self._factors.get(question_type, self.minimum)
+
+    def observe(self, question_type: str, requested: int, obtained: int):
+        ratio = requested / obtained if obtained else self.maximum
+        ratio = min(max(ratio, self.minimum), self.maximum)
+        with self._lock:
+            current = self._factors.get(question_type, self.minimum)
+            self._factors[question_type] = current + self.alpha * (ratio - current)
+
+
+# プロセス共通の歩留まり
+yield_tracker = YieldTracker()
+
+
+class GenerationPlanner:
+    """
+    多めの依頼・回数制限・締め切り付きで問題を集めるプランナー
+
+    Args:
+        question_type: 問題タイプ（歩留まりの学習単位）
+        deadline_seconds: 全体の締め切り（秒）。省略時は API_TIMEOUT
+        max_attempts: API呼び出し回数の上限
+        max_request_size: 1回に依頼する問題数の上限
+    """
+
+    # 残り時間がこれより短い場合は再依頼しない（秒）
+    MIN_REQUEST_SECONDS = 1.0
+
+    def __init__(self, question_type: str, deadline_seconds: float = None,
+                 max_attempts: int = 3, max_request_size: int = 20, tracker: YieldTracker = None):
+        self.question_type = question_type
+        self.deadline_seconds = deadline_seconds or SPEED_OPTIMIZATION_CONFIG['API_TIMEOUT']
+        self.max_attempts = max_attempts
+        self.max_request_size = max_request_size
+        self.tracker = tracker or yield_tracker
+        self.stats = {'attempts': 0, 'requested': 0, 'generated': 0, 'filled': 0}
+
+    def plan(self, num_questions: int,
+             request: Callable[[int, float], List[Dict]],
+             fill: Optional[Callable[[int, Set[str]], List[Dict]]] = None) -> List[Dict]:
+        """
+        問題を集める
+
+        Args:
+            num_questions: 必要な問題数
+            request: (依頼数, タイムアウト秒) を受け取り問題リストを返す関数
+            fill: (不足数, 取得済みの問題文) を受け取り補完用の問題を返す関数（任意）
+        """
+        deadline = time.monotonic() + self.deadline_seconds
+        questions, seen = [], set()
+
+        while self._should_request(num_questions, questions, deadline):
+            size = self._request_size(num_questions - len(questions))
+            try:
+                generated = request(size, deadline - time.monotonic())
+            except Exception as e:
+                print(f"問題生成エラー（{self.question_type}）: {e}")
+                break
+            self._merge(questions, seen, generated, size)
+
+        shortage = num_questions - len(questions)
+        if shortage > 0 and fill is not None:
+            self._merge_filled(questions, seen, fill(shortage, seen))
+        return questions[:num_questions]
+
+    async def aplan(self, num_questions: int,
+                    request: Callable[[int, float], Awaitable[List[Dict]]],
+                    fill: Optional[Callable[[int, Set[str]], Awaitable[List[Dict]]]] = None) -> List[Dict]:
+        """plan の非同期版（request / fill はコルーチン関数）"""
+        deadline = time.monotonic() + self.deadline_seconds
+        questions, seen = [], set()
+
+        while self._should_request(num_questions, questions, deadline):
+            size = self._request_size(num_questions - len(questions))
+            try:
+                generated = await request(size, deadline - time.monotonic())
+            except Exception as e:
+                print(f"非同期問題生成エラー（{self.question_type}）: {e}")
+                break
+            self._merge(questions, seen, generated, size)
+
+        shortage = num_questions - len(questions)
+        if shortage > 0 and fill is not None:
+            self._merge_filled(questions, seen, await fill(shortage, seen))
+        return questions[:num_questions]
+
+    def _should_request(self, num_questions: int, questions: List[Dict], deadline: float) -> bool:
+        return (len(questions) < num_questions
+                and self.stats['attempts'] < self.max_attempts
+                and deadline - time.monotonic() >= self.MIN_REQUEST_SECONDS)
+
+    def _request_size(self, missing: int) -> int:
+        """不足数に歩留まり係数を掛けた依頼数"""
+        size = math.ceil(missing * self.tracker.factor(self.question_type))
+        return max(missing, min(size, self.max_request_size))
+
+    def _merge(self, questions: List[Dict], seen: Set[str], generated: List[Dict], requested: int):
+        """生成結果を問題文の重複を除いて追加し、歩留まりを記録する"""
+        self.stats['attempts'] += 1
+        self.stats['requested'] += requested
+        added = 0
+        for question in generated:
+            if question['question'] not in seen:
+                seen.add(question['question'])
+                questions.append(question)
+                added += 1
+        self.stats['generated'] += added
+        self.tracker.observe(self.question_type, requested, added)
+
+    def _merge_filled(self, questions: List[Dict], seen: Set[str], filled: List[Dict]):
+        for question in filled:
+            seen.add(question['question'])
+            questions.append(question)
+        self.stats['filled'] += len(filled)
@@ -0,0 +1,176 @@
+"""
+締め切り付きのヘッジ生成
+
+OpenAI API への生成依頼を出しておき、予算時間（HEDGE_BUDGET_SECONDS）内に応答が
+なければ問題プールの問題をすぐに返す。間に合わなかった応答は捨てずに、
+バックグラウンドで品質評価して問題プールに保存する。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+# 生成依頼を実行するスレッドプール（予算切れ後も応答を待ち続けるためリクエストとは独立）
+_executor = ThreadPoolExecutor(
+    max_workers=SPEED_OPTIMIZATION_CONFIG['HEDGE_WORKERS'],
+    thread_name_prefix='quiz-hedge'
+)
+
+# 実行中のバックグラウンド処理（テストや終了処理で完了を待つため）
+_pending = set()
+_pending_lock = threading.Lock()
+
+# ヘッジ生成の集計（プロセス内）
+hedge_stats = {'requests': 0, 'answered_in_budget': 0, 'served_from_pool': 0, 'late_saved': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str, amount: int = 1):
+    with _stats_lock:
+        hedge_stats[key] += amount
+
+
+def drain_background(timeout: float = None) -> bool:
+    """実行中のバックグラウンド生成・保存の完了を待つ（全て完了したら True）"""
+    with _pending_lock:
+        pending = list(_pending)
+    futures = [item for item in pending if not isinstance(item, asyncio.Task)]
+    _, not_done = wait(futures, timeout=timeout)
+    return not not_done
+
+
+class HedgedGenerator:
+    """
+    予算時間内に生成が終わらなければ問題プールで応答するジェネレーター
+
+    Args:
+        generator: QuizGeneratorService（省略時はプロセス共通のインスタンス）
+        budget_seconds: OpenAI の応答を待つ時間（省略時は HEDGE_BUDGET_SECONDS）
+    """
+
+    def __init__(self, generator=None, budget_seconds: float = None):
+        if generator is None:
+            from .openai_service import get_quiz_generator
+            generator = get_quiz_generator()
+        self.generator = generator
+        self.budget_seconds = (
+            budget_seconds if budget_seconds is not None
+            else SPEED_OPTIMIZATION_CONFIG['HEDGE_BUDGET_SECONDS']
+        )
+
+    def generate(self, num_questions: int = 10, question_type: str = 'language', seen=None) -> List[Dict]:
+        """
+        問題を取得する（予算時間を過ぎたら問題プールから返す）
+        
+        seen（ユーザーが最近見た問題の判定器）は問題プールから返す場合に使う。
+
+        Returns:
+            問題のリスト（generate_questions と同じ形式）
+        """
+        _count('requests')
+        future = _executor.submit(self._generate_raw, num_questions, question_type)
+        try:
+            questions = future.result(timeout=self.budget_seconds)
+        except FutureTimeoutError:
+            self._store_when_done(future, question_type)
+            print(f"⏱️ {self.budget_seconds}秒以内に生成が終わらないため問題プールから出題します")
+            _count('served_from_pool')
+            return self.generator.pregenerated_service.get_pool_questions(
+                num_questions, question_type=question_type, seen=seen
+            )
+        except Exception as e:
+            print(f"ヘッジ生成エラー: {e}")
+            questions = []
+
+        _count('answered_in_budget')
+        return self._complete(questions, num_questions, question_type)
+
+    async def agenerate(self, num_questions: int = 10, question_type: str = 'language', seen=None) -> List[Dict]:
+        """generate の非同期版（応答待ちの間イベントループを解放する）"""
+        _count('requests')
+        task = asyncio.ensure_future(
+            self.generator._agenerate(num_questions, question_type, fill_shortage=False)
+        )
+        try:
+            questions = await asyncio.wait_for(asyncio.shield(task), self.budget_seconds)
+        except asyncio.TimeoutError:
+            self._astore_when_done(task, question_type)
+            print(f"⏱️ {self.budget_seconds}秒以内に生成が終わらないため問題プールから出題します")
+            _count('served_from_pool')
+            return await sync_to_async(self.generator.pregenerated_service.get_pool_questions)(
+                num_questions, question_type=question_type, seen=seen
+            )
+
+        _count('answered_in_budget')
+        return await sync_to_async(self._complete)(questions, num_questions, question_type)
+
+    def _generate_raw(self, num_questions: int, question_type: str) -> List[Dict]:
+        """ワーカースレッドで実行する生成（DBは使わない）"""
+        if question_type == 'math':
+            return self.generator._generate_math_questions(num_questions, fill_shortage=False)
+        return self.generator._generate_ai_questions(num_questions, fill_shortage=False)
+
+    def _complete(self, questions: List[Dict], num_questions: int, question_type: str) -> List[Dict]:
+        """予算内に届いた生成結果の不足分を補う"""
+        shortage = num_questions - len(questions)
+        if shortage > 0:
+            questions = questions + self.generator._fill_shortage(
+                shortage, question_type, {q['question'] for q in questions}
+            )
+        return questions[:num_questions]
+
+    def _store_when_done(self, future, question_type: str):
+        """生成が終わったら、結果をワーカースレッドで問題プールに保存する"""
+        stored = Future()
+        self._track(stored)
+        
+        def store():
+            try:
+                self._store_late(future.result(), question_type)
+            except Exception as e:
+                print(f"遅延した生成の保存エラー: {e}")
+            finally:
+                stored.set_result(None)
+        
+        # 生成完了後に保存を投入する（保存処理がワーカーを占有して生成を待つことはない）
+        future.add_done_callback(lambda _: _executor.submit(store))
+
+    def _astore_when_done(self, task, question_type: str):
+        """生成タスクの完了をイベントループ上で待ち、結果をワーカースレッドで問題プールに保存する"""
+        async def store():
+            try:
+                questions = await task
+            except Exception as e:
+                print(f"遅延した生成の取得エラー: {e}")
+                return
+            await asyncio.get_running_loop().run_in_executor(
+                _executor, self._store_late, questions, question_type
+            )
+
+        self._track(asyncio.ensure_future(store()))
+
+    def _store_late(self, questions: List[Dict], question_type: str) -> int:
+        """遅れて届いた問題をプールに保存する（ワーカースレッドで実行）"""
+        try:
+            saved = self.generator.pregenerated_service.store_generated_questions(questions, question_type)
+        finally:
+            # ワーカースレッドのDB接続を残さない
+            connections.close_all()
+        _count('late_saved', saved)
+        print(f"📥 遅れて届いた {len(questions)}問のうち {saved}問を問題プールに保存しました")
+        return saved
+
+    def _track(self, background):
+        with _pending_lock:
+            _pending.add(background)
+        background.add_done_callback(self._discard_pending)
+
+    @staticmethod
+    def _discard_pending(background):
+        with _pending_lock:
+            _pending.discard(background)
@@ -0,0 +1,57 @@
+"""
+問題プールの回答数・正解数の差分集計コマンド
+
+前回の集計以降の回答だけを出題元の問題ごとに集計し、回答数・正解数・正答率に反映する。
+
+Usage:
+    python manage.py aggregate_question_stats            # 1回だけ集計
+    python manage.py aggregate_question_stats --loop     # ワーカーとして常駐
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from quiz.answer_stats import aggregate_answer_stats
+from quiz.speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+
+class Command(BaseCommand):
+    help = '前回の集計以降の回答を集計し、問題プールの回答数・正解数・正答率を更新します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['ANSWER_STATS_BATCH_SIZE'],
+            help='1トランザクションで集計する回答IDの範囲'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='ワーカーとして常駐し、一定間隔で集計を繰り返す'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['ANSWER_STATS_INTERVAL'],
+            help='ワーカーモードの集計間隔（秒）'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                result = aggregate_answer_stats(options['batch_size'])
+            except Exception as e:
+                # ワーカーモードでは一時的なエラーで停止しないようにする
+                if not options['loop']:
+                    raise
+                self.stderr.write(f'集計エラー: {e}')
+            else:
+                self.stdout.write(
+                    f"回答: {result['answers']}件 / 更新した問題: {result['questions']}問 / "
+                    f"処理済みID: {result['last_id']}"
+                )
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
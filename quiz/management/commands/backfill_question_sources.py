@@ -0,0 +1,76 @@
+"""
+既存の問題の出題元の紐づけコマンド（任意・ベストエフォート）
+
+0009 の移行では、列の追加前に作成された問題の出題元（Question.source）を空のままにする
+（移行中に問題文で照合すると、大きな表では release の migrate が止まるため）。
+過去の問題も出題元に紐づけたい場合に、このコマンドで id 順に少しずつ紐づける。
+
+問題プールを (問題文, 選択肢) または (問題文, 正解の数値) をキーとする辞書にして照合するため、
+問題ごとにDBを検索しない。内容が一致すれば紐づけるので、問題プール以外（AI生成・フォールバック）
+から出題された問題が偶然同じ内容の場合も紐づく。集計済み位置より前の回答は正答率に再集計されない。
+
+Usage:
+    python manage.py backfill_question_sources
+    python manage.py backfill_question_sources --batch-size 5000 --limit 100000
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Value, When
+
+from quiz.models import PreGeneratedQuestion, Question
+
+# 1回の UPDATE で紐づける問題数（CASE 式の大きさを抑える）
+UPDATE_CHUNK_SIZE = 500
+
+
+def source_key(text, choices, answer_format, correct_value):
+    if answer_format == 'numeric':
+        return text, correct_value
+    return text, tuple(choices or ())
+
+
+class Command(BaseCommand):
+    help = '出題元が空の既存の問題を、内容が一致する事前生成問題に紐づけます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='1トランザクションで照合する問題数')
+        parser.add_argument('--limit', type=int, default=None, help='照合する問題数の上限（省略時は全件）')
+
+    def handle(self, *args, **options):
+        sources = {}
+        rows = PreGeneratedQuestion.objects.values_list(
+            'id', 'question_text', 'choice_1', 'choice_2', 'choice_3', 'answer_format', 'correct_value'
+        ).order_by('id')
+        for source_id, text, choice_1, choice_2, choice_3, answer_format, correct_value in rows.iterator():
+            key = source_key(text, [choice_1, choice_2, choice_3], answer_format, correct_value)
+            sources.setdefault(key, source_id)
+
+        last_id = 0
+        checked = linked = 0
+        while options['limit'] is None or checked < options['limit']:
+            size = options['batch_size']
+            if options['limit'] is not None:
+                size = min(size, options['limit'] - checked)
+            batch = list(
+                Question.objects.filter(source__isnull=True, id__gt=last_id).order_by('id').values_list(
+                    'id', 'text', 'choices', 'answer_format', 'correct_value'
+                )[:size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            checked += len(batch)
+
+            matches = {}
+            for question_id, text, choices, answer_format, correct_value in batch:
+                source_id = sources.get(source_key(text, choices, answer_format, correct_value))
+                if source_id is not None:
+                    matches[question_id] = source_id
+            matched = list(matches.items())
+            for start in range(0, len(matched), UPDATE_CHUNK_SIZE):
+                chunk = matched[start:start + UPDATE_CHUNK_SIZE]
+                Question.objects.filter(id__in=[question_id for question_id, _ in chunk]).update(source_id=Case(
+                    *[When(id=question_id, then=Value(source_id)) for question_id, source_id in chunk]
+                ))
+            linked += len(matched)
+
+        self.stdout.write(f'照合: {checked}問 / 紐づけ: {linked}問')
@@ -0,0 +1,84 @@
+"""
+ユーザー統計（UserQuizStats）の再集計コマンド
+
+既存の完了セッションから集計行を作り直す。導入時や集計値がずれた場合に実行する。
+
+Usage:
+    python manage.py backfill_quiz_stats
+"""
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from quiz.models import QuizSession, UserQuizStats
+
+
+class Command(BaseCommand):
+    help = '完了済みセッションからユーザー統計（UserQuizStats）を再集計します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='1回の bulk_create で書き込む行数'
+        )
+
+    def handle(self, *args, **options):
+        month_start, week_start = UserQuizStats.period_starts(timezone.localdate())
+        in_month = Q(finished_at__gte=self._start_of_day(month_start))
+        in_week = Q(finished_at__gte=self._start_of_day(week_start))
+
+        # ユーザーごとの集計を GROUP BY 1クエリで取得
+        rows = QuizSession.objects.filter(is_completed=True).values('user_id').annotate(
+            total_sessions=Count('id'),
+            total_score=Sum('score'),
+            total_points=Sum('points_earned'),
+            best_score=Max('score'),
+            month_sessions=Count('id', filter=in_month),
+            month_score=Sum('score', filter=in_month),
+            month_points=Sum('points_earned', filter=in_month),
+            week_sessions=Count('id', filter=in_week),
+            week_score=Sum('score', filter=in_week),
+            week_points=Sum('points_earned', filter=in_week),
+        ).order_by()
+
+        stats = [
+            UserQuizStats(
+                user_id=row['user_id'],
+                total_sessions=row['total_sessions'],
+                total_score=row['total_score'] or 0,
+                total_points=row['total_points'] or 0,
+                best_score=row['best_score'] or 0,
+                month_start=month_start,
+                month_sessions=row['month_sessions'],
+                month_score=row['month_score'] or 0,
+                month_points=row['month_points'] or 0,
+                week_start=week_start,
+                week_sessions=row['week_sessions'],
+                week_score=row['week_score'] or 0,
+                week_points=row['week_points'] or 0,
+            )
+            for row in rows.iterator()
+        ]
+
+        with transaction.atomic():
+            UserQuizStats.objects.bulk_create(
+                stats,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=[
+                    'total_sessions', 'total_score', 'total_points', 'best_score',
+                    'month_start', 'month_sessions', 'month_score', 'month_points',
+                    'week_start', 'week_sessions', 'week_score', 'week_points',
+                ],
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'{len(stats)}人分のユーザー統計を再集計しました'))
+
+    def _start_of_day(self, date):
+        return timezone.make_aware(datetime.combine(date, time.min))
@@ -0,0 +1,89 @@
+"""
+起動時間（モジュールの読み込み時間）の計測コマンド
+
+新しい Python プロセスを `python -X importtime` で起動し、起動の段階ごとに
+読み込み時間の合計と、時間のかかったモジュールを表示する。
+
+    setup   django.setup() まで（管理コマンドの起動）
+    urls    URLconf の読み込みまで（migrate のシステムチェック、ワーカーの最初のリクエスト）
+    warmup  ウォームアップ（quiz.warmup.warm_up(per_process=False)）まで
+
+Usage:
+    python manage.py bench_import_time
+    python manage.py bench_import_time --stage urls --repeat 5 --top 20
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+STAGE_SCRIPTS = {
+    'setup': 'import django; django.setup()',
+    'urls': 'import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns',
+    'warmup': 'import django; django.setup(); from quiz.warmup import warm_up; warm_up(per_process=False)',
+}
+
+# 読み込まれたかを表示する重いモジュール
+WATCHED_MODULES = ['openai', 'httpx', 'pykakasi', 'numpy']
+
+
+def run_importtime(script: str):
+    """
+    新しいプロセスで script を -X importtime 付きで実行する
+
+    Returns:
+        (経過時間（ミリ秒）, {モジュール名: (自身の時間, 累積時間)}（マイクロ秒）)
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, PYTHONWARNINGS='ignore')
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        env=env, cwd=settings.BASE_DIR, capture_output=True, text=True
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    if process.returncode != 0:
+        raise CommandError(process.stderr.strip().splitlines()[-1])
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        # import time:   self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative))
+    return elapsed, modules
+
+
+class Command(BaseCommand):
+    help = 'python -X importtime で起動時のモジュールの読み込み時間を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stage',
+            choices=list(STAGE_SCRIPTS) + ['all'],
+            default='all',
+            help='計測する起動の段階'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='計測回数（中央値を表示）')
+        parser.add_argument('--top', type=int, default=10, help='表示するモジュール数（自身の時間の順）')
+
+    def handle(self, *args, **options):
+        stages = list(STAGE_SCRIPTS) if options['stage'] == 'all' else [options['stage']]
+        for stage in stages:
+            runs = [run_importtime(STAGE_SCRIPTS[stage]) for _ in range(max(options['repeat'], 1))]
+            elapsed = statistics.median(run[0] for run in runs)
+            # 読み込み時間の合計が中央値の回のモジュール一覧を表示する
+            totals = sorted(runs, key=lambda run: sum(own for own, _ in run[1].values()))
+            _, modules = totals[len(totals) // 2]
+            import_total = sum(own for own, _ in modules.values()) / 1000
+
+            self.stdout.write(f'[{stage}] プロセス全体: {elapsed:.0f}ms / モジュールの読み込み: {import_total:.0f}ms')
+            loaded = [name for name in WATCHED_MODULES if name in modules]
+            not_loaded = [name for name in WATCHED_MODULES if name not in modules]
+            self.stdout.write(f"  読み込み済み: {', '.join(loaded) or 'なし'} / 未読み込み: {', '.join(not_loaded) or 'なし'}")
+            for name, (own, cumulative) in sorted(modules.items(), key=lambda item: -item[1][0])[:options['top']]:
+                self.stdout.write(f'  {own / 1000:>8.1f}ms (累積 {cumulative / 1000:>8.1f}ms)  {name}')
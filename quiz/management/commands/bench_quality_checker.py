@@ -0,0 +1,86 @@
+"""
+問題品質チェッカーのスループット計測コマンド
+
+合成した問題（語彙・漢字・英字・丁寧語・疑問の表現などを組み合わせたもの）を
+参照実装（基準ごとの _check_* メソッド）とコンパイル版の評価器で採点し、
+1秒あたりの評価数と、両者の点数が全問一致することを確認する。
+
+Usage:
+    python manage.py bench_quality_checker --count 100000
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz.quality_checker import (
+    COMPLEX_CONCEPTS, FUN_ELEMENTS, GRADE1_VOCABULARY, POLITE_WORDS, QUESTION_MARKERS,
+    QuestionQualityChecker, compiled_evaluator
+)
+
+# 実際の生成問題に近づけるため、ほとんどはひらがなの語にし、漢字・英字・記号は時々混ぜる
+FILLERS = ['は', 'の', 'が', 'を', 'に', 'と', 'なに', 'どれ', 'かな', 'ことば', 'みんな', 'ちいさな', 'まいにち',
+           'カタカナ', 'ー', '「', '」', '。', '、', '！', ' ']
+RARE_FILLERS = ['abc', '漢字', 'Ｘ', '★']
+
+
+def build_corpus(count: int, seed: int = 0):
+    """評価用の合成問題を count 件作る"""
+    rng = random.Random(seed)
+    keywords = [word for words in GRADE1_VOCABULARY.values() for word in words]
+    keywords += COMPLEX_CONCEPTS + POLITE_WORDS + FUN_ELEMENTS + QUESTION_MARKERS
+
+    def phrase(length):
+        words = []
+        for _ in range(length):
+            roll = rng.random()
+            if roll < 0.2:
+                words.append(rng.choice(keywords))
+            elif roll < 0.23:
+                words.append(rng.choice(RARE_FILLERS))
+            else:
+                words.append(rng.choice(FILLERS))
+        return ''.join(words)
+
+    corpus = []
+    for _ in range(count):
+        question = phrase(rng.randint(4, 14))
+        choices = [phrase(rng.randint(0, 3)) for _ in range(rng.choice([2, 3, 3, 3]))]
+        corpus.append({'question': question, 'choices': choices, 'answer': rng.randrange(len(choices))})
+    return corpus
+
+
+class Command(BaseCommand):
+    help = '問題品質チェッカーの評価速度（参照実装とコンパイル版）を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='評価する問題数')
+        parser.add_argument('--seed', type=int, default=0, help='合成問題の乱数シード')
+
+    def handle(self, *args, **options):
+        corpus = build_corpus(options['count'], options['seed'])
+        checker = QuestionQualityChecker()
+
+        started = time.perf_counter()
+        reference = [checker.reference_scores(question) for question in corpus]
+        reference_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        compiled = [compiled_evaluator.score(question) for question in corpus]
+        compiled_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for question in corpus:
+            checker.evaluate_question(question)
+        evaluate_seconds = time.perf_counter() - started
+
+        mismatches = sum(1 for a, b in zip(reference, compiled) if a != b)
+        count = len(corpus)
+        self.stdout.write(f'問題数: {count}')
+        self.stdout.write(f'参照実装:     {count / reference_seconds:>12,.0f} 問/秒 ({reference_seconds:.2f}秒)')
+        self.stdout.write(f'コンパイル版: {count / compiled_seconds:>12,.0f} 問/秒 ({compiled_seconds:.2f}秒)')
+        self.stdout.write(f'evaluate_question（詳細・改善提案込み）: {count / evaluate_seconds:>12,.0f} 問/秒')
+        self.stdout.write(f'速度比: {reference_seconds / compiled_seconds:.1f}倍')
+        if mismatches:
+            raise CommandError(f'参照実装と点数が一致しない問題が {mismatches} 件あります')
+        self.stdout.write(self.style.SUCCESS('全問の点数が参照実装と一致しました'))
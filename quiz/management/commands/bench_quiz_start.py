@@ -0,0 +1,77 @@
+"""
+クイズ開始APIのレイテンシ計測コマンド
+
+計測用のユーザー・セッションはトランザクション内で作成し、最後にロールバックする。
+
+Usage:
+    python manage.py bench_quiz_start --iterations 200 --type language
+"""
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from quiz.models import QuizSession
+from quiz.pool_snapshot import pool_snapshot_cache
+from quiz.views import start_quiz_api
+
+
+class Command(BaseCommand):
+    help = 'クイズ開始API (start_quiz_api) のレイテンシ (p50/p95/p99) を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100, help='計測回数')
+        parser.add_argument(
+            '--type',
+            choices=['language', 'math'],
+            default='language',
+            help='問題タイプ'
+        )
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        body = json.dumps({'question_type': options['type']})
+        timings = []
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username='__bench_quiz_start__')
+
+            for _ in range(options['iterations']):
+                request = factory.post(
+                    '/quiz/api/start/', data=body, content_type='application/json'
+                )
+                request.user = user
+
+                started = time.perf_counter()
+                response = start_quiz_api(request)
+                timings.append((time.perf_counter() - started) * 1000)
+
+                if response.status_code != 200:
+                    self.stderr.write(f'開始APIがエラーを返しました: {response.content.decode()}')
+                    break
+                # 次の開始で「未完了セッション」扱いにならないよう削除する
+                QuizSession.objects.filter(user=user).delete()
+
+            transaction.set_rollback(True)
+
+        if not timings:
+            return
+
+        timings.sort()
+        self.stdout.write(f"計測回数: {len(timings)}")
+        self.stdout.write(f"平均: {statistics.mean(timings):.1f}ms")
+        for label, ratio in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+            index = min(int(len(timings) * ratio), len(timings) - 1)
+            self.stdout.write(f"{label}: {timings[index]:.1f}ms")
+        self.stdout.write(f"最大: {timings[-1]:.1f}ms")
+
+        snapshot = pool_snapshot_cache.stats()
+        if snapshot['loaded']:
+            self.stdout.write(
+                f"問題プールのスナップショット: {snapshot['questions']}問 / "
+                f"{snapshot['memory_bytes'] / 1024:.1f}KB / 読み込みから{snapshot['age_seconds']}秒"
+            )
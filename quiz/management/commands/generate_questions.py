@@ -0,0 +1,61 @@
+"""
+高品質問題の一括生成コマンド（並列生成）
+
+Usage:
+    python manage.py generate_questions --count 5000 --concurrency 16
+    python manage.py generate_questions --count 500 --rpm 500 --tpm 200000
+"""
+from django.core.management.base import BaseCommand
+
+from quiz.openai_service import hiragana_cache
+from quiz.pre_generated_service import PreGeneratedQuestionService
+from quiz.speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+
+class Command(BaseCommand):
+    help = 'OpenAI API を並列に呼び出して高品質問題を一括生成し、問題プールに保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100, help='保存する問題数')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['GENERATION_CONCURRENCY'],
+            help='同時API呼び出し数'
+        )
+        parser.add_argument(
+            '--rpm',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['OPENAI_REQUESTS_PER_MINUTE'],
+            help='1分あたりのリクエスト数上限'
+        )
+        parser.add_argument(
+            '--tpm',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['OPENAI_TOKENS_PER_MINUTE'],
+            help='1分あたりのトークン数上限'
+        )
+        parser.add_argument('--batch-size', type=int, default=10, help='1回のAPI呼び出しで生成する問題数')
+
+    def handle(self, *args, **options):
+        result = PreGeneratedQuestionService().generate_and_store_questions(
+            count=options['count'],
+            concurrency=options['concurrency'],
+            requests_per_minute=options['rpm'],
+            tokens_per_minute=options['tpm'],
+            batch_size=options['batch_size'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['saved_to_db']}/{result['requested_count']}問を保存しました "
+            f"({result['elapsed_seconds']}秒, {result['questions_per_second']}問/秒)"
+        ))
+        self.stdout.write(
+            f"API呼び出し: {result['api_calls']}回 / 生成: {result['total_generated']}問 / "
+            f"高品質: {result['high_quality_found']}問 / レート制限による待機: {result['rate_limited_seconds']}秒"
+        )
+        stats = hiragana_cache.stats()
+        self.stdout.write(
+            f"ひらがな化: キャッシュヒット率 {stats['hit_rate']:.1%} / 変換不要 {stats['skipped']}件 / "
+            f"pykakasi {stats['misses']}件"
+        )
@@ -0,0 +1,177 @@
+"""
+問題生成の負荷試験コマンド（ローカルの疑似 OpenAI サーバーを使用）
+
+同時に多数のクイズ開始が来た場合を想定し、非同期クライアント（agenerate_questions）と
+同期クライアントをスレッドプールで動かした場合（gunicorn のスレッド数に相当）の
+処理時間・スループットを比較する。実際の OpenAI API は呼び出さない。
+
+Usage:
+    python manage.py loadtest_quiz_generation --concurrency 300 --delay 1.0
+    python manage.py loadtest_quiz_generation --mode sync --threads 8
+    python manage.py loadtest_quiz_generation --mode stream --question-delay 0.3   # 最初の問題までの時間
+
+--question-delay を指定すると疑似サーバーは問題1問ごとにその時間をかけて生成する（通常の応答は
+全問の生成後に返り、ストリーミング応答は1問ずつ届く）。
+
+同じプロンプトの応答は生成キャッシュ（GENERATION_CACHE_BACKEND）から使い回されるため、
+API呼び出し数と最後に表示するヒット率で効果を確認できる。
+"""
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from quiz.fake_openai_server import FakeOpenAIServer
+from quiz.generation_cache import get_generation_cache
+from quiz.openai_service import QuizGeneratorService, hiragana_cache
+
+
+class Command(BaseCommand):
+    help = '疑似 OpenAI サーバーに対して問題生成を同時実行し、非同期版と同期版を比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='同時に開始するクイズ数')
+        parser.add_argument('--delay', type=float, default=1.0, help='疑似サーバーの応答遅延（秒）')
+        parser.add_argument('--questions', type=int, default=10, help='1回あたりの問題数')
+        parser.add_argument(
+            '--question-delay',
+            type=float,
+            default=0.0,
+            help='疑似サーバーが問題1問の生成にかける時間（秒）'
+        )
+        parser.add_argument(
+            '--type',
+            choices=['language', 'math'],
+            default='language',
+            help='問題タイプ'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['async', 'sync', 'stream', 'both', 'all'],
+            default='both',
+            help='計測する方式（both は async と sync、all はストリーミング版も含む）'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='同期版で使うスレッド数（ワーカーの同時処理数に相当）'
+        )
+
+    def handle(self, *args, **options):
+        server = FakeOpenAIServer(delay=options['delay'], question_delay=options['question_delay'])
+        base_url = server.start()
+        self.stdout.write(
+            f"疑似サーバー: {base_url} (遅延 {options['delay']}秒 + 1問あたり {options['question_delay']}秒)"
+        )
+
+        try:
+            with override_settings(OPENAI_BASE_URL=base_url, OPENAI_API_KEY='sk-loadtest'):
+                if options['mode'] in ('async', 'both', 'all'):
+                    self._reset(server)
+                    self._report('async', *self._run_async(options), server.request_count)
+                if options['mode'] in ('sync', 'both', 'all'):
+                    self._reset(server)
+                    self._report(f"sync ({options['threads']}スレッド)", *self._run_sync(options), server.request_count)
+                if options['mode'] in ('stream', 'all'):
+                    self._reset(server)
+                    elapsed, results, first_timings = self._run_stream(options)
+                    self._report('stream', elapsed, results, server.request_count, first_timings)
+        finally:
+            server.stop()
+
+    def _reset(self, server):
+        """方式ごとに API 呼び出し数と生成キャッシュ・ひらがな化のキャッシュを空の状態から計測する"""
+        server.request_count = 0
+        cache = get_generation_cache()
+        if cache is not None:
+            cache.clear()
+        hiragana_cache.clear()
+
+    def _run_async(self, options):
+        service = QuizGeneratorService()
+
+        async def start_one():
+            started = time.perf_counter()
+            questions = await service.agenerate_questions(
+                options['questions'], question_type=options['type'], use_pregenerated=False
+            )
+            return (time.perf_counter() - started) * 1000, len(questions)
+
+        async def run_all():
+            return await asyncio.gather(*[start_one() for _ in range(options['concurrency'])])
+
+        started = time.perf_counter()
+        results = asyncio.run(run_all())
+        return time.perf_counter() - started, results
+
+    def _run_sync(self, options):
+        service = QuizGeneratorService()
+
+        def start_one(_):
+            started = time.perf_counter()
+            questions = service.generate_questions(
+                options['questions'], question_type=options['type'], use_pregenerated=False
+            )
+            return (time.perf_counter() - started) * 1000, len(questions)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(start_one, range(options['concurrency'])))
+        return time.perf_counter() - started, results
+
+    def _run_stream(self, options):
+        """ストリーミング版（astream_questions）。全問がそろうまでの時間と最初の問題までの時間を計る"""
+        service = QuizGeneratorService()
+
+        async def start_one():
+            started = time.perf_counter()
+            first = None
+            count = 0
+            async for _ in service.astream_questions(options['questions'], question_type=options['type']):
+                if first is None:
+                    first = (time.perf_counter() - started) * 1000
+                count += 1
+            return (time.perf_counter() - started) * 1000, count, first
+
+        async def run_all():
+            return await asyncio.gather(*[start_one() for _ in range(options['concurrency'])])
+
+        started = time.perf_counter()
+        results = asyncio.run(run_all())
+        elapsed = time.perf_counter() - started
+        return elapsed, [(timing, count) for timing, count, _ in results], [first for _, _, first in results]
+
+    def _report(self, label, elapsed, results, request_count, first_timings=None):
+        timings = sorted(timing for timing, _ in results)
+        short = sum(1 for _, count in results if count == 0)
+
+        self.stdout.write(f"[{label}]")
+        self.stdout.write(f"  完了: {len(results)}件 / {elapsed:.2f}秒 ({len(results) / elapsed:.1f}件/秒)")
+        self.stdout.write(f"  API呼び出し: {request_count}回 / 問題なし: {short}件")
+        self.stdout.write(f"  平均: {statistics.mean(timings):.0f}ms")
+        for name, ratio in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+            index = min(int(len(timings) * ratio), len(timings) - 1)
+            self.stdout.write(f"  {name}: {timings[index]:.0f}ms")
+        if first_timings:
+            first_timings = sorted(first_timings)
+            self.stdout.write(
+                f"  最初の問題まで: 平均 {statistics.mean(first_timings):.0f}ms / "
+                f"p95 {first_timings[min(int(len(first_timings) * 0.95), len(first_timings) - 1)]:.0f}ms"
+            )
+
+        cache = get_generation_cache()
+        if cache is not None:
+            stats = cache.stats()
+            self.stdout.write(
+                f"  生成キャッシュ: ヒット率 {stats['hit_rate']:.1%} / "
+                f"節約 {stats['saved_tokens']}トークン (${stats['saved_cost_usd']})"
+            )
+        stats = hiragana_cache.stats()
+        self.stdout.write(
+            f"  ひらがな化: ヒット率 {stats['hit_rate']:.1%} / 変換不要 {stats['skipped']}件 / "
+            f"pykakasi {stats['misses']}件"
+        )
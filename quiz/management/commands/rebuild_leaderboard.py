@@ -0,0 +1,73 @@
+"""
+ランキングの集合の作り直しコマンド
+
+Redis を使う場合（LEADERBOARD_REDIS_URL）に、全ボードの sorted set を DB から作り直す。
+集合のキーは REDIS_KEY_TTL（既定24時間）で期限切れになる。期限切れの間はリクエストが DB の COUNT で
+応答しながらバックグラウンドで作り直すため、期限より短い間隔で定期実行しておく
+（Procfile の leaderboard プロセス、または --loop なしでスケジューラから実行）。
+読み込み中も古い集合で応答する（読み込み完了後に入れ替える）。
+
+プロセス内の集合（Redis 未使用時）はワーカーごとに上位だけを保持するため、このコマンドは不要。
+
+Usage:
+    python manage.py rebuild_leaderboard
+    python manage.py rebuild_leaderboard --board all --board weekly
+    python manage.py rebuild_leaderboard --loop     # ワーカーとして常駐
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.leaderboard import LEADERBOARD_CONFIG, TIER_NAMES, RedisSortedSetBackend, get_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'ランキングの集合（Redis の sorted set）をDBから作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--board',
+            action='append',
+            choices=['all', 'weekly', 'monthly'] + [f'tier:{name}' for name in TIER_NAMES],
+            help='作り直すボード（複数指定可。省略時は全ボード）'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='ワーカーとして常駐し、一定間隔で作り直しを繰り返す'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=LEADERBOARD_CONFIG['REDIS_REBUILD_INTERVAL'],
+            help='ワーカーモードの作り直し間隔（秒）'
+        )
+
+    def handle(self, *args, **options):
+        leaderboard = get_leaderboard()
+        if not isinstance(leaderboard.backend, RedisSortedSetBackend):
+            self.stdout.write('Redis を使用していないため作り直しは不要です（プロセス内の集合は各ワーカーが読み込みます）')
+            return
+
+        boards = options['board'] or ['all', 'weekly', 'monthly'] + [f'tier:{name}' for name in TIER_NAMES]
+        while True:
+            for board in boards:
+                started = time.perf_counter()
+                try:
+                    key = leaderboard.rebuild(board)
+                except Exception as e:
+                    # ワーカーモードでは一時的なエラーで停止しないようにする
+                    if not options['loop']:
+                        raise
+                    self.stderr.write(f'{board}: 作り直しエラー: {e}')
+                    continue
+                if key is None:
+                    self.stdout.write(f'{board}: 他のプロセスが作り直し中のためスキップしました')
+                    continue
+                self.stdout.write(
+                    f'{key}: {leaderboard.backend.card(key)}人 ({time.perf_counter() - started:.1f}秒)'
+                )
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
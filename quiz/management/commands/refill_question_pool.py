@@ -0,0 +1,89 @@
+"""
+問題プール（事前生成問題）の補充コマンド
+
+Usage:
+    python manage.py refill_question_pool            # 1回だけ補充
+    python manage.py refill_question_pool --loop     # ワーカーとして常駐
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from quiz.pre_generated_service import PreGeneratedQuestionService, POOL_CATEGORIES
+from quiz.speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+
+class Command(BaseCommand):
+    help = 'カテゴリごとの最低在庫数を下回った問題プールをバッチ生成で補充します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type',
+            choices=['language', 'math', 'all'],
+            default='all',
+            help='補充する問題タイプ（デフォルト: all）'
+        )
+        parser.add_argument(
+            '--low-water-mark',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['POOL_LOW_WATER_MARK'],
+            help='カテゴリごとの最低在庫数'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['POOL_REFILL_BATCH_SIZE'],
+            help='1回のAPI呼び出しで生成する問題数'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['POOL_REFILL_MAX_BATCHES'],
+            help='1回の補充で行うAPI呼び出しの上限（問題タイプごと）'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='ワーカーとして常駐し、一定間隔で補充を繰り返す'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['POOL_REFILL_INTERVAL'],
+            help='ワーカーモードの補充間隔（秒）'
+        )
+
+    def handle(self, *args, **options):
+        question_types = list(POOL_CATEGORIES) if options['type'] == 'all' else [options['type']]
+        service = PreGeneratedQuestionService()
+
+        while True:
+            for question_type in question_types:
+                try:
+                    result = service.refill_pool(
+                        question_type=question_type,
+                        low_water_mark=options['low_water_mark'],
+                        batch_size=options['batch_size'],
+                        max_batches=options['max_batches'],
+                    )
+                except Exception as e:
+                    # ワーカーモードでは一時的なエラーで停止しないようにする
+                    if not options['loop']:
+                        raise
+                    self.stderr.write(f'補充エラー ({question_type}): {e}')
+                    continue
+                self._report(result)
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def _report(self, result):
+        self.stdout.write(
+            f"[{result['question_type']}] API呼び出し: {result['api_batches']}回 / "
+            f"生成: {result['total_generated']}問 / 保存: {result['saved_to_db']}問"
+        )
+        for category, deficit in result['remaining_deficits'].items():
+            saved = result['saved_by_category'].get(category, 0)
+            status = 'OK' if deficit == 0 else f'残り不足 {deficit}'
+            self.stdout.write(f"  {category}: +{saved} ({status})")
@@ -0,0 +1,40 @@
+"""
+問題プールの品質スコアの一括再計算コマンド
+
+品質基準を変更した後に、選択問題の品質スコアを全て採点し直す。
+点数が変わった問題だけを更新する（NumPy がインストールされていれば列単位のベクトル演算で採点）。
+
+Usage:
+    python manage.py rescore_question_pool
+    python manage.py rescore_question_pool --dry-run    # 点数が変わる問題数だけを表示
+"""
+from django.core.management.base import BaseCommand
+
+from quiz.quality_rescore import rescore_question_pool
+from quiz.speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+
+class Command(BaseCommand):
+    help = '問題プールの選択問題の品質スコアを現在の品質基準で再計算します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=SPEED_OPTIMIZATION_CONFIG['QUALITY_RESCORE_CHUNK_SIZE'],
+            help='1回に読み込んで採点する問題数'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='採点だけ行い、DBを更新しない'
+        )
+
+    def handle(self, *args, **options):
+        result = rescore_question_pool(options['chunk_size'], dry_run=options['dry_run'])
+        mode = 'ベクトル演算' if result['vectorized'] else '行ごと（NumPy 未インストール）'
+        action = '変わる問題' if options['dry_run'] else '更新した問題'
+        self.stdout.write(
+            f"採点: {result['questions']}問 / {action}: {result['changed']}問 / "
+            f"{result['elapsed_seconds']}秒 ({result['questions_per_second']}問/秒, {mode})"
+        )
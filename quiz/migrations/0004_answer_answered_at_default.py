@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0003_answer_numeric_answer_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="answer",
+            name="answered_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                help_text="オフライン中にまとめて送信された回答は端末側の回答日時",
+                verbose_name="回答日時",
+            ),
+        ),
+    ]
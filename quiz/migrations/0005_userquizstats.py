@@ -0,0 +1,117 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("quiz", "0004_answer_answered_at_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserQuizStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "total_sessions",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="完了セッション数"
+                    ),
+                ),
+                (
+                    "total_score",
+                    models.PositiveIntegerField(default=0, verbose_name="合計スコア"),
+                ),
+                (
+                    "total_points",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="合計獲得ポイント"
+                    ),
+                ),
+                (
+                    "best_score",
+                    models.PositiveSmallIntegerField(
+                        default=0, verbose_name="最高スコア"
+                    ),
+                ),
+                (
+                    "month_start",
+                    models.DateField(
+                        blank=True, null=True, verbose_name="月間集計の対象月（1日）"
+                    ),
+                ),
+                (
+                    "month_sessions",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="今月のセッション数"
+                    ),
+                ),
+                (
+                    "month_score",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="今月の合計スコア"
+                    ),
+                ),
+                (
+                    "month_points",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="今月の獲得ポイント"
+                    ),
+                ),
+                (
+                    "week_start",
+                    models.DateField(
+                        blank=True, null=True, verbose_name="週間集計の対象週（月曜日）"
+                    ),
+                ),
+                (
+                    "week_sessions",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="今週のセッション数"
+                    ),
+                ),
+                (
+                    "week_score",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="今週の合計スコア"
+                    ),
+                ),
+                (
+                    "week_points",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="今週の獲得ポイント"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新日時"),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="quiz_stats",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="ユーザー",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "ユーザー統計",
+                "verbose_name_plural": "ユーザー統計",
+            },
+        ),
+    ]
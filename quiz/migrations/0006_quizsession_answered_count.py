@@ -0,0 +1,50 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_answer_counts(apps, schema_editor):
+    """既存セッションの回答数・正解数を回答テーブルから集計する"""
+    QuizSession = apps.get_model("quiz", "QuizSession")
+    Answer = apps.get_model("quiz", "Answer")
+
+    answers = (
+        Answer.objects.filter(question__session=OuterRef("pk"))
+        .order_by()
+        .values("question__session")
+    )
+    QuizSession.objects.update(
+        answered_count=Coalesce(
+            Subquery(answers.annotate(count=Count("id")).values("count")), 0
+        ),
+        score=Coalesce(
+            Subquery(
+                answers.filter(is_correct=True)
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0005_userquizstats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quizsession",
+            name="answered_count",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="回答のたびに加算される回答済みの問題数",
+                verbose_name="回答数",
+            ),
+        ),
+        migrations.RunPython(backfill_answer_counts, migrations.RunPython.noop),
+    ]
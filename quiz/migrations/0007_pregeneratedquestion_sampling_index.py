@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0006_quizsession_answered_count"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pregeneratedquestion",
+            index=models.Index(
+                fields=[
+                    "is_active",
+                    "question_type",
+                    "category",
+                    "quality_score",
+                    "used_count",
+                ],
+                name="quiz_pregen_sampling_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("quiz", "0007_pregeneratedquestion_sampling_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSeenQuestions",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "current_bits",
+                    models.BinaryField(default=b"", verbose_name="現在の世代"),
+                ),
+                (
+                    "previous_bits",
+                    models.BinaryField(default=b"", verbose_name="1つ前の世代"),
+                ),
+                (
+                    "current_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="現在の世代の問題数"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新日時"),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="seen_questions",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="ユーザー",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "出題済み問題",
+                "verbose_name_plural": "出題済み問題",
+            },
+        ),
+    ]
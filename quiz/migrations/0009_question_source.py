@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0008_userseenquestions"),
+    ]
+
+    # 既存の問題の source は NULL のままにする（問題文での照合は大きな表では release の
+    # migrate を止めるため）。紐づけが必要なら backfill_question_sources コマンドで行う。
+    operations = [
+        migrations.AddField(
+            model_name="question",
+            name="source",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="session_questions",
+                to="quiz.pregeneratedquestion",
+                verbose_name="出題元の事前生成問題",
+            ),
+        ),
+    ]
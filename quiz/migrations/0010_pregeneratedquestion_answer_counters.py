@@ -0,0 +1,55 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0009_question_source"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatsWatermark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(max_length=50, unique=True, verbose_name="集計名"),
+                ),
+                (
+                    "last_id",
+                    models.BigIntegerField(
+                        default=0, verbose_name="集計済みの最後のID"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新日時"),
+                ),
+            ],
+            options={
+                "verbose_name": "集計の処理済み位置",
+                "verbose_name_plural": "集計の処理済み位置",
+            },
+        ),
+        migrations.AddField(
+            model_name="pregeneratedquestion",
+            name="attempt_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="回答数"),
+        ),
+        migrations.AddField(
+            model_name="pregeneratedquestion",
+            name="correct_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="正解数"),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0010_pregeneratedquestion_answer_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="statswatermark",
+            name="observed_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="最大のIDの観測日時"
+            ),
+        ),
+        migrations.AddField(
+            model_name="statswatermark",
+            name="observed_id",
+            field=models.BigIntegerField(default=0, verbose_name="観測した最大のID"),
+        ),
+    ]
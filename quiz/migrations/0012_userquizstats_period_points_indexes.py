@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0011_statswatermark_observed_id"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userquizstats",
+            index=models.Index(
+                fields=["week_start", "-week_points"], name="quiz_stats_week_points_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userquizstats",
+            index=models.Index(
+                fields=["month_start", "-month_points"],
+                name="quiz_stats_month_points_idx",
+            ),
+        ),
+    ]
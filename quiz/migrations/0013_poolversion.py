@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0012_userquizstats_period_points_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PoolVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "version",
+                    models.BigIntegerField(default=0, verbose_name="バージョン"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新日時"),
+                ),
+            ],
+            options={
+                "verbose_name": "問題プールのバージョン",
+                "verbose_name_plural": "問題プールのバージョン",
+            },
+        ),
+    ]
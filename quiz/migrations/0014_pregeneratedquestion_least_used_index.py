@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0013_poolversion"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pregeneratedquestion",
+            index=models.Index(
+                fields=["is_active", "question_type", "used_count", "quality_score"],
+                name="quiz_pregen_least_used_idx",
+            ),
+        ),
+    ]
@@ -1,7 +1,15 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from .seen_filter import RollingBloomFilter
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
 
 class QuizSession(models.Model):
     """
@@ -39,69 +47,339 @@ class QuizSession(models.Model):
         default=False,
         verbose_name="完了フラグ"
     )
+    
+    answered_count = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="回答数",
+        help_text="回答のたびに加算される回答済みの問題数"
+    )
 
     class Meta:
         verbose_name = "クイズセッション"
         verbose_name_plural = "クイズセッション"
         ordering = ['-started_at']
     
+    # 1問正解あたりの獲得ポイント
+    POINTS_PER_CORRECT = 10
+    
     def __str__(self):
         return f"{self.user.username} - {self.started_at.strftime('%Y/%m/%d %H:%M')}"
     
+    def record_answer(self, is_correct):
+        """
+        回答1件分の回答数・正解数を加算する（F() による UPDATE 1回）
+        """
+        QuizSession.objects.filter(pk=self.pk, is_completed=False).update(
+            answered_count=F('answered_count') + 1,
+            score=F('score') + (1 if is_correct else 0)
+        )
+        self.answered_count += 1
+        if is_correct:
+            self.score += 1
+    
+    @staticmethod
+    def answer_count_expressions():
+        """
+        回答テーブルから回答数・正解数を求める式（UPDATE の値に使う相関サブクエリ）
+        """
+        answers = Answer.objects.filter(
+            question__session=OuterRef('pk')
+        ).order_by().values('question__session')
+        return {
+            'answered_count': Coalesce(
+                Subquery(answers.annotate(count=Count('id')).values('count')), 0
+            ),
+            'score': Coalesce(
+                Subquery(answers.filter(is_correct=True).annotate(count=Count('id')).values('count')), 0
+            ),
+        }
+    
     def calculate_score(self):
         """
-        正解数を計算する
+        正解数を回答テーブルから集計し直す（UPDATE 1回）
+        
+        通常は回答時に加算される score をそのまま使う。一括保存などで
+        加算を経由しなかった回答がある場合に呼び出す。
+        終了済みのセッションは更新しない（finish_session が score からポイントを計算した後に
+        score だけが変わらないよう、record_answer と同じく未完了の場合に限る）。
         """
-        correct_answers = self.questions.filter(answers__is_correct=True).count()
-        self.score = correct_answers
-        self.points_earned = correct_answers * 10  # 1問正解につき10ポイント
-        self.save()
+        QuizSession.objects.filter(pk=self.pk, is_completed=False).update(**self.answer_count_expressions())
+        self.refresh_from_db(fields=['score', 'answered_count'])
         return self.score
     
     def finish_session(self):
         """
         セッションを終了し、ユーザーのポイント・レベル・バッジを更新する
+        
+        完了フラグは「未完了の場合だけ」更新する条件付きUPDATEで立てるため、
+        同じセッションの終了が同時に呼ばれても（複数タブ、最終回答と終了APIの競合など）
+        報酬を付与するのは1回だけになる。ユーザー行は select_for_update でロックしてから
+        最新の値を更新するので、別セッションの同時終了でポイントやバッジが失われない。
         """
-        if not self.is_completed:
-            self.finished_at = timezone.now()
-            self.is_completed = True
-            self.calculate_score()
+        if self.is_completed:
+            return {'score': self.score}
+        
+        with transaction.atomic():
+            finished_at = timezone.now()
+            
+            # 未完了の場合だけ完了にする（同時に呼ばれても成功するのは1回）
+            # 正解数は回答のたびに加算済みのため、回答テーブルの集計は不要
+            claimed = QuizSession.objects.filter(pk=self.pk, is_completed=False).update(
+                is_completed=True,
+                finished_at=finished_at,
+                points_earned=F('score') * self.POINTS_PER_CORRECT
+            )
+            self.refresh_from_db(fields=['is_completed', 'finished_at', 'score', 'points_earned', 'answered_count'])
+            if not claimed:
+                return {'score': self.score}
+            
+            # ユーザー行をロックし、最新の値から更新する
+            user = get_user_model().objects.select_for_update().get(pk=self.user_id)
+            self.user = user
             
             # 満点かどうかをチェック
             if self.score == 10:
-                self.user.perfect_scores += 1
+                user.perfect_scores += 1
             
             # 連続学習日数を更新
-            self.user.update_consecutive_days()
+            user.update_consecutive_days()
             
             # ユーザーの総ポイントを更新
-            self.user.points_total += self.points_earned
+            user.points_total += self.points_earned
             
             # レベルアップ処理
-            level_up = self.user.update_level(self.points_earned)
+            level_up = user.update_level(self.points_earned)
             
             # ランクアップ処理
-            rank_up = self.user.update_rank()
+            old_rank = user.rank
+            rank_up = user.update_rank()
             
             # 新しいバッジをチェック
-            new_badges = self.user.check_new_badges(self)
+            new_badges = user.check_new_badges(self)
             
-            self.user.save()
-            self.save()
+            user.save(update_fields=[
+                'perfect_scores', 'consecutive_days', 'last_study_date', 'points_total',
+                'experience_points', 'level', 'rank', 'badges_earned', 'updated_at',
+            ])
             
-            # 結果を辞書で返す
-            return {
-                'score': self.score,
-                'points_earned': self.points_earned,
-                'level_up': level_up,
-                'rank_up': rank_up,
-                'new_badges': new_badges,
-                'user_level': self.user.level,
-                'user_rank': self.user.rank,
-                'consecutive_days': self.user.consecutive_days
-            }
+            # ユーザーごとの集計行を差分更新
+            UserQuizStats.record_session(self)
+            
+            # コミット後にランキングへ反映
+            from accounts.leaderboard import record_leaderboard
+            transaction.on_commit(lambda: record_leaderboard(user, old_rank))
+        
+        # 結果を辞書で返す
+        return {
+            'score': self.score,
+            'points_earned': self.points_earned,
+            'level_up': level_up,
+            'rank_up': rank_up,
+            'new_badges': new_badges,
+            'user_level': user.level,
+            'user_rank': user.rank,
+            'consecutive_days': user.consecutive_days
+        }
+
+
+class UserQuizStats(models.Model):
+    """
+    ユーザーごとのクイズ統計（完了セッションの集計行）
+    
+    QuizSession.finish_session で差分更新するため、履歴・統計画面は
+    セッション数に関係なくこの1行を読むだけで済む。
+    月間・週間の集計は対象期間の開始日と一緒に保持し、期間が変わったら0から数え直す。
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name="ユーザー",
+        related_name="quiz_stats"
+    )
+    
+    total_sessions = models.PositiveIntegerField(default=0, verbose_name="完了セッション数")
+    total_score = models.PositiveIntegerField(default=0, verbose_name="合計スコア")
+    total_points = models.PositiveIntegerField(default=0, verbose_name="合計獲得ポイント")
+    best_score = models.PositiveSmallIntegerField(default=0, verbose_name="最高スコア")
+    
+    month_start = models.DateField(null=True, blank=True, verbose_name="月間集計の対象月（1日）")
+    month_sessions = models.PositiveIntegerField(default=0, verbose_name="今月のセッション数")
+    month_score = models.PositiveIntegerField(default=0, verbose_name="今月の合計スコア")
+    month_points = models.PositiveIntegerField(default=0, verbose_name="今月の獲得ポイント")
+    
+    week_start = models.DateField(null=True, blank=True, verbose_name="週間集計の対象週（月曜日）")
+    week_sessions = models.PositiveIntegerField(default=0, verbose_name="今週のセッション数")
+    week_score = models.PositiveIntegerField(default=0, verbose_name="今週の合計スコア")
+    week_points = models.PositiveIntegerField(default=0, verbose_name="今週の獲得ポイント")
+    
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "ユーザー統計"
+        verbose_name_plural = "ユーザー統計"
+        indexes = [
+            # 週間・月間ランキング用（上位の読み込みと、上位の外の順位の COUNT）
+            models.Index(fields=['week_start', '-week_points'], name='quiz_stats_week_points_idx'),
+            models.Index(fields=['month_start', '-month_points'], name='quiz_stats_month_points_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.total_sessions}回"
+    
+    @staticmethod
+    def period_starts(date):
+        """日付が属する月の初日と週の月曜日を返す"""
+        return date.replace(day=1), date - timedelta(days=date.weekday())
+    
+    @classmethod
+    def for_user(cls, user):
+        """ユーザーの統計行を取得する（未作成の場合は保存しない空の行を返す）"""
+        try:
+            return cls.objects.get(user=user)
+        except cls.DoesNotExist:
+            return cls(user=user)
+    
+    @classmethod
+    def record_session(cls, session):
+        """
+        完了したセッションを集計に加える
+        
+        行をロックせずに1回の UPDATE で加算するため、同時に完了したセッションがあっても
+        更新が失われない。行が無い場合だけ作成する。
+        """
+        finished_date = timezone.localdate(session.finished_at or timezone.now())
+        month_start, week_start = cls.period_starts(finished_date)
+        score = session.score
+        points = session.points_earned
+        
+        def bucket(start_field, start, field, amount):
+            # 同じ期間なら加算、期間が変わっていれば今回の値から数え直す
+            return Case(
+                When(**{start_field: start}, then=F(field) + amount),
+                default=Value(amount)
+            )
+        
+        updates = {
+            'total_sessions': F('total_sessions') + 1,
+            'total_score': F('total_score') + score,
+            'total_points': F('total_points') + points,
+            'best_score': Greatest(F('best_score'), Value(score)),
+            'month_sessions': bucket('month_start', month_start, 'month_sessions', 1),
+            'month_score': bucket('month_start', month_start, 'month_score', score),
+            'month_points': bucket('month_start', month_start, 'month_points', points),
+            'month_start': Value(month_start),
+            'week_sessions': bucket('week_start', week_start, 'week_sessions', 1),
+            'week_score': bucket('week_start', week_start, 'week_score', score),
+            'week_points': bucket('week_start', week_start, 'week_points', points),
+            'week_start': Value(week_start),
+            'updated_at': timezone.now(),
+        }
         
-        return {'score': self.score}
+        if cls.objects.filter(user_id=session.user_id).update(**updates):
+            return
+        
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    user_id=session.user_id,
+                    total_sessions=1,
+                    total_score=score,
+                    total_points=points,
+                    best_score=score,
+                    month_start=month_start,
+                    month_sessions=1,
+                    month_score=score,
+                    month_points=points,
+                    week_start=week_start,
+                    week_sessions=1,
+                    week_score=score,
+                    week_points=points,
+                )
+        except IntegrityError:
+            # 同時に作成された場合は加算でやり直す
+            cls.objects.filter(user_id=session.user_id).update(**updates)
+    
+    @property
+    def average_score(self):
+        """平均スコア"""
+        if self.total_sessions == 0:
+            return 0
+        return self.total_score / self.total_sessions
+    
+    def current_month_sessions(self, today=None):
+        """今月の完了セッション数（集計が前月以前のものなら0）"""
+        month_start, _ = self.period_starts(today or timezone.localdate())
+        return self.month_sessions if self.month_start == month_start else 0
+    
+    def current_week_average(self, today=None):
+        """今週の平均スコア（集計が前週以前のものなら0）"""
+        _, week_start = self.period_starts(today or timezone.localdate())
+        if self.week_start != week_start or self.week_sessions == 0:
+            return 0
+        return self.week_score / self.week_sessions
+
+
+class UserSeenQuestions(models.Model):
+    """
+    ユーザーが最近出題された問題プールの問題（2世代のブルームフィルター）
+    
+    履歴（Question）を毎回検索せずに、出題時に見たことのある問題を除外するために使う。
+    サイズは設定（SEEN_FILTER_CAPACITY / SEEN_FILTER_ERROR_RATE）で決まり、回答数に関係なく一定。
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name="ユーザー",
+        related_name="seen_questions"
+    )
+    
+    current_bits = models.BinaryField(default=b'', verbose_name="現在の世代")
+    previous_bits = models.BinaryField(default=b'', verbose_name="1つ前の世代")
+    current_count = models.PositiveIntegerField(default=0, verbose_name="現在の世代の問題数")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "出題済み問題"
+        verbose_name_plural = "出題済み問題"
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.current_count}問"
+    
+    @staticmethod
+    def _empty_filter(**kwargs) -> RollingBloomFilter:
+        return RollingBloomFilter(
+            SPEED_OPTIMIZATION_CONFIG['SEEN_FILTER_CAPACITY'],
+            SPEED_OPTIMIZATION_CONFIG['SEEN_FILTER_ERROR_RATE'],
+            **kwargs
+        )
+    
+    def as_filter(self) -> RollingBloomFilter:
+        return self._empty_filter(
+            current=bytes(self.current_bits),
+            previous=bytes(self.previous_bits),
+            current_count=self.current_count
+        )
+    
+    @classmethod
+    def filter_for_user(cls, user) -> RollingBloomFilter:
+        """ユーザーが最近見た問題の判定器（記録が無ければ空）"""
+        row = cls.objects.filter(user=user).first()
+        return row.as_filter() if row else cls._empty_filter()
+    
+    @classmethod
+    def record(cls, user, question_ids):
+        """出題した問題を記録する（行をロックして読み書きする）"""
+        question_ids = [question_id for question_id in question_ids if question_id]
+        if not question_ids:
+            return
+        with transaction.atomic():
+            row, _ = cls.objects.select_for_update().get_or_create(user=user)
+            seen = row.as_filter()
+            seen.update(question_ids)
+            row.current_bits = bytes(seen.current)
+            row.previous_bits = bytes(seen.previous)
+            row.current_count = seen.current_count
+            row.save(update_fields=['current_bits', 'previous_bits', 'current_count', 'updated_at'])
 
 
 class Question(models.Model):
@@ -170,6 +448,20 @@ class Question(models.Model):
         help_text="セッション内での問題番号（1-10）"
     )
     
+    # 出題元の事前生成問題（AI生成・フォールバック問題、この列の追加前に作成された問題は空。
+    # 追加前の問題は backfill_question_sources コマンドで内容が一致する問題にベストエフォートで紐づけられる）
+    # 出題はプロセス内のスナップショットから行うため、読み込み後に削除された問題を
+    # 指すことがあり得る。その場合もセッション作成が失敗しないようDB制約は付けない
+    source = models.ForeignKey(
+        'PreGeneratedQuestion',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        verbose_name="出題元の事前生成問題",
+        related_name="session_questions"
+    )
+    
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="作成日時"
@@ -194,6 +486,16 @@ class Question(models.Model):
             if 0 <= self.correct_idx < len(self.choices):
                 return self.choices[self.correct_idx]
         return None
+    
+    def is_correct_answer(self, selected_idx=None, numeric_answer=None):
+        """
+        回答が正解かどうかを判定する
+        """
+        if self.answer_format == 'numeric':
+            return numeric_answer == self.correct_value
+        elif self.answer_format == 'multiple_choice':
+            return selected_idx == self.correct_idx
+        return False
 
 
 class Answer(models.Model):
@@ -226,8 +528,9 @@ class Answer(models.Model):
     )
     
     answered_at = models.DateTimeField(
-        auto_now_add=True,
-        verbose_name="回答日時"
+        default=timezone.now,
+        verbose_name="回答日時",
+        help_text="オフライン中にまとめて送信された回答は端末側の回答日時"
     )
 
     class Meta:
@@ -243,13 +546,19 @@ class Answer(models.Model):
         """
         保存時に正解判定を行う
         """
-        if self.question.answer_format == 'numeric':
-            self.is_correct = self.numeric_answer == self.question.correct_value
-        elif self.question.answer_format == 'multiple_choice':
-            self.is_correct = self.selected_idx == self.question.correct_idx
-        else:
-            self.is_correct = False
-        super().save(*args, **kwargs)
+        self.is_correct = self.question.is_correct_answer(
+            selected_idx=self.selected_idx,
+            numeric_answer=self.numeric_answer
+        )
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        
+        # 新規の回答はセッションの回答数・正解数の加算と同じトランザクションで保存する
+        # （INSERT が失敗したら加算も行わないため、内側にセーブポイントは作らない）
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            self.question.session.record_answer(self.is_correct)
 
 
 class PreGeneratedQuestion(models.Model):
@@ -315,8 +624,10 @@ class PreGeneratedQuestion(models.Model):
         verbose_name="カテゴリ"
     )
     
-    # 使用統計
+    # 使用統計（回答数・正解数は aggregate_question_stats が回答テーブルから差分集計する）
     used_count = models.IntegerField(default=0, verbose_name="使用回数")
+    attempt_count = models.PositiveIntegerField(default=0, verbose_name="回答数")
+    correct_count = models.PositiveIntegerField(default=0, verbose_name="正解数")
     correct_rate = models.FloatField(default=0.0, verbose_name="正答率")
     
     # 管理情報
@@ -327,6 +638,18 @@ class PreGeneratedQuestion(models.Model):
         verbose_name = "事前生成問題"
         verbose_name_plural = "事前生成問題"
         ordering = ['-quality_score', '-created_at']
+        indexes = [
+            # 問題プールからの抽出（get_random_questions）で必要な列だけを読むための複合インデックス
+            models.Index(
+                fields=['is_active', 'question_type', 'category', 'quality_score', 'used_count'],
+                name='quiz_pregen_sampling_idx'
+            ),
+            # スナップショット未使用時の抽出で、使用回数の少ない順に上限件数だけを読むためのインデックス
+            models.Index(
+                fields=['is_active', 'question_type', 'used_count', 'quality_score'],
+                name='quiz_pregen_least_used_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.question_text[:30]}... (品質:{self.quality_score})"
@@ -340,6 +663,7 @@ class PreGeneratedQuestion(models.Model):
     def to_dict(self):
         """辞書形式で問題データを取得"""
         data = {
+            'pregenerated_id': self.id,
             'question': self.question_text,
             'question_type': self.question_type,
             'answer_format': self.answer_format,
@@ -358,3 +682,44 @@ class PreGeneratedQuestion(models.Model):
             })
         
         return data
+
+
+class StatsWatermark(models.Model):
+    """
+    差分集計の処理済み位置（集計ジョブごとに1行）
+    
+    集計済みの最後の id を保持し、次回はそれより後の行だけを集計する。
+    id の順とコミットの順は一致しないため、最後に観測した最大の id と観測日時も保持し、
+    観測から一定時間たって（それより小さい id のトランザクションが確定して）から集計に使う。
+    """
+    name = models.CharField(max_length=50, unique=True, verbose_name="集計名")
+    last_id = models.BigIntegerField(default=0, verbose_name="集計済みの最後のID")
+    observed_id = models.BigIntegerField(default=0, verbose_name="観測した最大のID")
+    observed_at = models.DateTimeField(null=True, blank=True, verbose_name="最大のIDの観測日時")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "集計の処理済み位置"
+        verbose_name_plural = "集計の処理済み位置"
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+class PoolVersion(models.Model):
+    """
+    問題プールのバージョン番号（1行だけ）
+    
+    問題プールを変更したプロセスがコミット後に加算し、各プロセスは一定間隔でこの番号を読んで
+    プロセス内のスナップショットを読み直すか判断する。プロセス間で共有されない
+    キャッシュ（既定の LocMemCache）でも、別プロセスのコマンドでの変更が全ワーカーに伝わる。
+    """
+    version = models.BigIntegerField(default=0, verbose_name="バージョン")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "問題プールのバージョン"
+        verbose_name_plural = "問題プールのバージョン"
+    
+    def __str__(self):
+        return f"問題プール v{self.version}"
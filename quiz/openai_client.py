@@ -0,0 +1,103 @@
+"""
+プロセス共通の OpenAI クライアント
+
+クライアントごとに httpx の接続プール（と TLS ハンドシェイク）が作られるため、
+同期クライアントは設定（APIキー・接続先）ごとにプロセスで1つだけ作って使い回す。
+非同期クライアントの接続プールはイベントループに紐づくため、ループごとに1つ作る。
+
+fork 後の子プロセス（gunicorn のワーカーなど）は親の接続を引き継がないよう作り直す。
+HTTP/2 は h2 パッケージがインストールされている場合のみ有効にする。
+
+openai SDK（と httpx）は読み込みに時間がかかるため、最初のクライアント作成時に読み込む
+（migrate などの管理コマンドやワーカーの起動では読み込まない。load_sdk() で事前に読み込める）。
+"""
+import asyncio
+import importlib.util
+import os
+import threading
+import weakref
+
+from django.conf import settings
+
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def load_sdk():
+    """openai SDK を読み込んで返す（2回目以降は読み込み済みのモジュールを返す）"""
+    import openai
+    return openai
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 を使うか（設定が有効で h2 がインストールされている場合）"""
+    return SPEED_OPTIMIZATION_CONFIG['OPENAI_HTTP2'] and importlib.util.find_spec('h2') is not None
+
+
+def _http_options() -> dict:
+    import httpx
+    return {
+        'limits': httpx.Limits(
+            max_connections=SPEED_OPTIMIZATION_CONFIG['OPENAI_MAX_CONNECTIONS'],
+            max_keepalive_connections=SPEED_OPTIMIZATION_CONFIG['OPENAI_MAX_KEEPALIVE_CONNECTIONS'],
+            keepalive_expiry=SPEED_OPTIMIZATION_CONFIG['OPENAI_KEEPALIVE_EXPIRY'],
+        ),
+        'http2': http2_enabled(),
+    }
+
+
+def _client_key():
+    return (settings.OPENAI_API_KEY, getattr(settings, 'OPENAI_BASE_URL', None))
+
+
+def get_openai_client():
+    """プロセス共通の同期 OpenAI クライアント（openai.OpenAI）を取得する"""
+    key = _client_key()
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                api_key, base_url = key
+                openai = load_sdk()
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=openai.DefaultHttpxClient(**_http_options())
+                )
+                _clients[key] = client
+    return client
+
+
+def get_async_openai_client():
+    """実行中のイベントループ用の AsyncOpenAI クライアント（openai.AsyncOpenAI）を取得する"""
+    loop = asyncio.get_running_loop()
+    key = _client_key()
+    loop_clients = _async_clients.setdefault(loop, {})
+    client = loop_clients.get(key)
+    if client is None:
+        api_key, base_url = key
+        openai = load_sdk()
+        client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=openai.DefaultAsyncHttpxClient(**_http_options())
+        )
+        loop_clients[key] = client
+    return client
+
+
+def reset_clients():
+    """作成済みのクライアントを破棄する（fork 後の子プロセスで呼ばれる）"""
+    global _lock
+    _clients.clear()
+    _async_clients.clear()
+    # fork 時に他スレッドが保持していたロックを引き継がない
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_clients)
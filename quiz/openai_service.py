@@ -1,48 +1,201 @@
-import openai
+import math
+import random
 import re
-from django.conf import settings
-from typing import List, Dict
-
-# ひらがな変換ライブラリ
-try:
-    from pykakasi import kakasi  # type: ignore
-    _kks = kakasi()
-    _kks.setMode("J", "H")  # 漢字(Kanji)→ひらがな
-    _kks.setMode("K", "H")  # カタカナ→ひらがな（全角）
-    _converter = _kks.getConverter()
-except Exception:  # ランタイムにライブラリが無い場合でも動作
-    _converter = None
+import threading
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from typing import AsyncIterator, Iterator, List, Dict, Optional
+from .generation_cache import get_generation_cache
+from .generation_planner import GenerationPlanner, yield_tracker
+from .question_stream import ANSWER_PREFIXES, QuestionStreamParser
+from .openai_client import get_async_openai_client, get_openai_client
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+# ひらがな変換ライブラリ（辞書の読み込みに時間がかかるため、最初に変換が必要になった時に作る）
+_converter = None
+_converter_loaded = False
+_converter_lock = threading.Lock()
+
+
+def get_hiragana_converter():
+    """pykakasi の変換器（ライブラリが無い場合は None）"""
+    global _converter, _converter_loaded
+    if not _converter_loaded:
+        with _converter_lock:
+            if not _converter_loaded:
+                try:
+                    from pykakasi import kakasi  # type: ignore
+                    _kks = kakasi()
+                    _kks.setMode("J", "H")  # 漢字(Kanji)→ひらがな
+                    _kks.setMode("K", "H")  # カタカナ→ひらがな（全角）
+                    _converter = _kks.getConverter()
+                except Exception:  # ランタイムにライブラリが無い場合でも動作
+                    _converter = None
+                _converter_loaded = True
+    return _converter
+
 
 KANJI_PATTERN = re.compile(r"[一-龯]+")  # Kanji Unicode 範囲
+# pykakasi が変換するカタカナ（長音記号「ー」と半角カタカナを含む）
+KATAKANA_PATTERN = re.compile(r"[ァ-ヺーｦ-ﾟ]+")
+
+# 問題プール補充時にプロンプトへ添える出題分野
+CATEGORY_PROMPT_HINTS = {
+    'animals': 'どうぶつ（なきごえ・とくちょう）',
+    'sounds': 'おとや ようすを あらわす ことば（ぎおんご・ぎたいご）',
+    'opposites': 'はんたいの ことば',
+    'colors': 'いろの なまえ',
+    'hiragana': 'ひらがな（ちいさい「ゃ・ゅ・ょ」など）',
+    'basic': 'みのまわりの ものの なまえ',
+    'others': 'あいさつ・マナー',
+    'addition': 'たしざん',
+    'subtraction': 'ひきざん',
+    'numbers': 'かずの おおきさ',
+    'counting': 'かぞえかた',
+}
+
+class HiraganaCache:
+    """
+    ひらがな化の結果の LRU キャッシュ
+
+    選択肢（いぬ・ねこ など）や同じ問題文は何度も変換されるため、pykakasi の結果を
+    上限件数まで保持する。漢字・カタカナを含まない文字列はキャッシュせずにそのまま返す（skipped）。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'skipped': 0}
+
+    def get(self, text: str) -> Optional[str]:
+        with self._lock:
+            converted = self._entries.get(text)
+            if converted is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(text)
+            self._stats['hits'] += 1
+            return converted
+
+    def put(self, text: str, converted: str):
+        with self._lock:
+            self._entries[text] = converted
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def skip(self, count: int = 1):
+        with self._lock:
+            self._stats['skipped'] += count
+
+    def stats(self) -> Dict:
+        """ヒット率と件数（プロセス内の集計）"""
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_entries=self.max_entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for name in self._stats:
+                self._stats[name] = 0
+
+
+hiragana_cache = HiraganaCache(SPEED_OPTIMIZATION_CONFIG['HIRAGANA_CACHE_SIZE'])
+
+
+def _needs_conversion(text: str) -> bool:
+    """漢字・カタカナを含むか（含まない文字列は pykakasi を通しても変わらない）"""
+    return bool(KANJI_PATTERN.search(text) or KATAKANA_PATTERN.search(text))
+
 
 def _to_hiragana(text: str) -> str:
-    """文字列をひらがな化（pykakasi が利用可能な場合）"""
-    if _converter is not None:
-        return _converter.do(text)
-    # フォールバック: そのまま返す
-    return text
+    """文字列をひらがな化（pykakasi が利用可能な場合。結果はキャッシュする）"""
+    if not _needs_conversion(text):
+        hiragana_cache.skip()
+        return text
+    converter = get_hiragana_converter()
+    if converter is None:
+        # フォールバック: そのまま返す
+        return text
+    converted = hiragana_cache.get(text)
+    if converted is None:
+        converted = converter.do(text)
+        hiragana_cache.put(text, converted)
+    return converted
+
+
+def to_hiragana_batch(texts: List[str]) -> List[str]:
+    """
+    複数の文字列をまとめてひらがな化する
+
+    キャッシュに無い文字列（重複は1つにまとめる）を改行でつないで pykakasi を1回だけ呼び出す。
+    """
+    results = list(texts)
+    pending = {}  # 変換する文字列 → 結果を入れる位置
+    skipped = 0
+    for i, text in enumerate(texts):
+        if text in pending:
+            pending[text].append(i)
+        elif not _needs_conversion(text):
+            skipped += 1
+        else:
+            converted = hiragana_cache.get(text)
+            if converted is None:
+                pending[text] = [i]
+            else:
+                results[i] = converted
+    if skipped:
+        hiragana_cache.skip(skipped)
+    converter = get_hiragana_converter() if pending else None
+    if converter is None:
+        # 変換が不要、またはライブラリが無い場合はそのまま返す
+        return results
+
+    sources = list(pending)
+    converted_texts = None
+    if not any('\n' in text for text in sources):
+        converted_texts = converter.do('\n'.join(sources)).split('\n')
+    if converted_texts is None or len(converted_texts) != len(sources):
+        # 改行を含む場合などは1件ずつ変換する
+        converted_texts = [converter.do(text) for text in sources]
+
+    for text, converted in zip(sources, converted_texts):
+        hiragana_cache.put(text, converted)
+        for i in pending[text]:
+            results[i] = converted
+    return results
 
 
 class QuizGeneratorService:
     """
     OpenAI APIを使用してクイズ問題を生成するサービスクラス
+    
+    状態を持たないため生成は軽量（クライアントはプロセス共通のものを使う）。
+    通常は get_quiz_generator() の共有インスタンスを使う。
     """
     
-    def __init__(self):
-        openai.api_key = settings.OPENAI_API_KEY
-        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        # 事前生成問題サービスの遅延読み込み（循環インポート回避）
-        self._pregenerated_service = None
+    # 事前生成問題サービスの遅延読み込み（循環インポート回避）
+    _pregenerated_service = None
+    
+    @property
+    def client(self):
+        """プロセス共通の OpenAI クライアント（接続プールを共有する）"""
+        return get_openai_client()
     
     @property
     def pregenerated_service(self):
         """事前生成問題サービスの遅延読み込み"""
         if self._pregenerated_service is None:
-            from .pre_generated_service import PreGeneratedQuestionService
-            self._pregenerated_service = PreGeneratedQuestionService()
+            from .pre_generated_service import get_pregenerated_service
+            self._pregenerated_service = get_pregenerated_service()
         return self._pregenerated_service
     
-    def generate_questions(self, num_questions: int = 10, question_type: str = 'language', use_pregenerated: bool = True) -> List[Dict]:
+    def generate_questions(self, num_questions: int = 10, question_type: str = 'language', use_pregenerated: bool = True,
+                           seen=None) -> List[Dict]:
         """
         指定された数の問題を生成する（高品質事前生成問題を優先使用）
         
@@ -50,6 +203,7 @@ class QuizGeneratorService:
             num_questions: 生成する問題数（デフォルト: 10）
             question_type: 問題のタイプ ('language' または 'math')
             use_pregenerated: 事前生成問題を使用するか（デフォルト: True）
+            seen: ユーザーが最近見た問題の判定器（事前生成問題から除外する、任意）
             
         Returns:
             問題のリスト [{"question": "...", "choices": [...], "answer": 0}, ...]
@@ -60,59 +214,367 @@ class QuizGeneratorService:
             # 事前生成問題とAI生成問題を混合使用（70%:30%）
             return self.pregenerated_service.get_mixed_questions(
                 count=num_questions,
-                pregenerated_ratio=0.7
+                pregenerated_ratio=0.7,
+                seen=seen
             )
         else:
             # 従来のAI生成のみ
             return self._generate_ai_questions(num_questions)
     
-    def _generate_ai_questions(self, num_questions: int) -> List[Dict]:
+    async def agenerate_questions(self, num_questions: int = 10, question_type: str = 'language', use_pregenerated: bool = True,
+                                  seen=None) -> List[Dict]:
+        """
+        generate_questions の非同期版（ASGI で使用）
+        
+        モデルの応答を待つ間はイベントループを解放するため、1プロセスで多数の
+        クイズ開始を並行して処理できる。DBを使う事前生成問題の取得はスレッドで実行する。
+        
+        Args:
+            num_questions: 生成する問題数（デフォルト: 10）
+            question_type: 問題のタイプ ('language' または 'math')
+            use_pregenerated: 事前生成問題を使用するか（デフォルト: True）
+            seen: ユーザーが最近見た問題の判定器（任意）
+            
+        Returns:
+            問題のリスト（generate_questions と同じ形式）
+        """
+        if question_type == 'math':
+            return await self._agenerate(num_questions, 'math')
+        if not use_pregenerated:
+            return await self._agenerate(num_questions, 'language')
+        
+        # 事前生成問題とAI生成問題を混合使用（70%:30%）
+        questions = await sync_to_async(self.pregenerated_service.get_random_questions)(
+            int(num_questions * 0.7), seen=seen
+        )
+        remaining = num_questions - len(questions)
+        if remaining > 0:
+            questions.extend(await self._agenerate(remaining, 'language'))
+        random.shuffle(questions)
+        return questions[:num_questions]
+    
+    async def _agenerate(self, num_questions: int, question_type: str, category: str = None,
+                         fill_shortage: bool = True, use_cache: bool = True) -> List[Dict]:
+        """
+        AsyncOpenAI で問題を生成する（内部メソッド）
+        
+        再依頼の回数と締め切りは GenerationPlanner で制限し、
+        不足分は fill_shortage が True の場合のみ問題プール → フォールバック問題の順で補う。
+        """
+        print(f"非同期問題生成開始 - モデル: gpt-4o-mini, タイプ: {question_type}, 問題数: {num_questions}")
+        cache = get_generation_cache() if use_cache else None
+        
+        async def request(size, timeout):
+            params = self._chat_params(size, question_type, category)
+            if cache is not None:
+                # ファイル・Django キャッシュはI/Oを伴うためスレッドで実行する
+                cached = await sync_to_async(cache.get)(params) if cache.blocking else cache.get(params)
+                if cached is not None:
+                    return self._parse_content(cached, question_type)
+            
+            client = get_async_openai_client().with_options(timeout=timeout, max_retries=0)
+            response = await client.chat.completions.create(**params)
+            content = response.choices[0].message.content
+            if cache is not None:
+                if cache.blocking:
+                    await sync_to_async(cache.put)(params, content, response.usage)
+                else:
+                    cache.put(params, content, response.usage)
+            return self._parse_content(content, question_type)
+        
+        async def fill(shortage, exclude):
+            return await sync_to_async(self._fill_shortage)(shortage, question_type, exclude)
+        
+        return await GenerationPlanner(question_type).aplan(
+            num_questions, request, fill if fill_shortage else None
+        )
+    
+    def _generate_ai_questions(self, num_questions: int, category: str = None, fill_shortage: bool = True,
+                               use_cache: bool = True) -> List[Dict]:
         """
         AIで問題を生成する（内部メソッド）
         
         Args:
             num_questions: 生成する問題数
+            category: 重点的に出題する分野（問題プール補充用、任意）
+            fill_shortage: 生成できなかった分を問題プール・フォールバック問題で補うか
+            use_cache: 生成応答のキャッシュを使うか（問題プール補充では新しい問題が必要なため False）
             
         Returns:
             問題のリスト
         """
-        try:
-            print(f"AI問題生成開始 - モデル: gpt-4o-mini, 問題数: {num_questions}")
-            prompt = self._build_prompt(num_questions)
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self._get_system_prompt()
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.4,  # 少し創造性を上げて質の高い問題を生成
-                max_tokens=1200,   # トークン数を増加して詳細な説明を可能に
-                top_p=0.9        # 応答の多様性を少し上げる
-            )
+        print(f"AI問題生成開始 - モデル: gpt-4o-mini, 問題数: {num_questions}")
+        return self._plan_questions(num_questions, 'language', category, fill_shortage, use_cache)
+    
+    def _plan_questions(self, num_questions: int, question_type: str, category: str = None,
+                        fill_shortage: bool = True, use_cache: bool = True) -> List[Dict]:
+        """
+        GenerationPlanner で問題を集める（国語・算数で共通）
+        
+        歩留まりを見込んで多めに依頼し、再依頼は回数と締め切り（API_TIMEOUT）で打ち切る。
+        残りの不足分は fill_shortage が True の場合のみ問題プール → フォールバック問題で補う。
+        同じプロンプトの応答は生成キャッシュ（use_cache）から使い回す。
+        """
+        cache = get_generation_cache() if use_cache else None
+        
+        def request(size, timeout):
+            params = self._chat_params(size, question_type, category)
+            cached = cache.get(params) if cache is not None else None
+            if cached is not None:
+                return self._parse_content(cached, question_type)
             
+            client = self.client.with_options(timeout=timeout, max_retries=0)
+            response = client.chat.completions.create(**params)
             content = response.choices[0].message.content
-            questions = self._parse_response(content)
-            
-            # 重複排除 & ひらがな化
-            questions = self._post_process_questions(questions)
-            
-            # 不足分があれば追加生成
-            if len(questions) < num_questions:
-                remaining = num_questions - len(questions)
-                questions.extend(self._generate_ai_questions(remaining))
-            
-            return questions[:num_questions]
-            
+            if cache is not None:
+                cache.put(params, content, response.usage)
+            return self._parse_content(content, question_type)
+        
+        def fill(shortage, exclude):
+            return self._fill_shortage(shortage, question_type, exclude)
+        
+        return GenerationPlanner(question_type).plan(
+            num_questions, request, fill if fill_shortage else None
+        )
+    
+    def stream_questions(self, num_questions: int = 10, question_type: str = 'language', category: str = None,
+                         fill_shortage: bool = True, use_cache: bool = True) -> Iterator[Dict]:
+        """
+        問題をストリーミングで生成し、1問ずつ返すジェネレーター
+        
+        応答を stream=True で受け取り、問題ブロックが完成するたびにパースして返すため、
+        応答全体を待たずに最初の問題を使える。必要数が揃ったら応答の受信を打ち切る。
+        不足分は fill_shortage が True の場合のみ問題プール → フォールバック問題の順で補う。
+        
+        Args:
+            num_questions: 生成する問題数
+            question_type: 問題のタイプ ('language' または 'math')
+            category: 重点的に出題する分野（任意）
+            fill_shortage: 生成できなかった分を問題プール・フォールバック問題で補うか
+            use_cache: 生成応答のキャッシュを使うか（応答を最後まで受け取った場合のみ保存する）
+        """
+        print(f"ストリーミング問題生成開始 - モデル: gpt-4o-mini, タイプ: {question_type}, 問題数: {num_questions}")
+        seen = set()
+        generated = self._stream_generated(self._stream_request_size(num_questions, question_type),
+                                           question_type, category, use_cache)
+        try:
+            for question in generated:
+                if question['question'] in seen:
+                    continue
+                seen.add(question['question'])
+                yield question
+                if len(seen) >= num_questions:
+                    return
+        finally:
+            generated.close()
+        
+        if fill_shortage:
+            yield from self._fill_shortage(num_questions - len(seen), question_type, seen)
+    
+    async def astream_questions(self, num_questions: int = 10, question_type: str = 'language', category: str = None,
+                                fill_shortage: bool = True, use_cache: bool = True) -> AsyncIterator[Dict]:
+        """stream_questions の非同期版（AsyncOpenAI で受信し、DBを使う補完はスレッドで実行する）"""
+        print(f"非同期ストリーミング問題生成開始 - モデル: gpt-4o-mini, タイプ: {question_type}, 問題数: {num_questions}")
+        seen = set()
+        generated = self._astream_generated(self._stream_request_size(num_questions, question_type),
+                                            question_type, category, use_cache)
+        try:
+            async for question in generated:
+                if question['question'] in seen:
+                    continue
+                seen.add(question['question'])
+                yield question
+                if len(seen) >= num_questions:
+                    return
+        finally:
+            await generated.aclose()
+        
+        if fill_shortage:
+            for question in await sync_to_async(self._fill_shortage)(num_questions - len(seen), question_type, seen):
+                yield question
+    
+    def _stream_request_size(self, num_questions: int, question_type: str) -> int:
+        """歩留まりを見込んだ依頼数（GenerationPlanner と同じく20問まで）"""
+        size = math.ceil(num_questions * yield_tracker.factor(question_type))
+        return max(num_questions, min(size, 20))
+    
+    def _stream_params(self, size: int, question_type: str, category: str = None) -> Dict:
+        params = self._chat_params(size, question_type, category)
+        return dict(params, stream=True, stream_options={'include_usage': True})
+    
+    def _stream_parser(self, question_type: str):
+        """ストリーミング応答のブロック分割器と、ブロックを問題に変換する関数"""
+        parse = self._parse_single_math_question if question_type == 'math' else self._parse_single_question
+        
+        def parse_block(block: str) -> Optional[Dict]:
+            try:
+                return parse(block)
+            except Exception as e:
+                print(f"ストリーミング応答のパースエラー: {e}")
+                return None
+        
+        return QuestionStreamParser(ANSWER_PREFIXES[question_type]), parse_block
+    
+    def _stream_generated(self, size: int, question_type: str, category: str = None,
+                          use_cache: bool = True) -> Iterator[Dict]:
+        """ストリーミング応答から完成した問題を順に返す（重複排除・補完はしない）"""
+        params = self._chat_params(size, question_type, category)
+        cache = get_generation_cache() if use_cache else None
+        cached = cache.get(params) if cache is not None else None
+        if cached is not None:
+            yield from self._parse_content(cached, question_type)
+            return
+        
+        parser, parse_block = self._stream_parser(question_type)
+        client = self.client.with_options(timeout=SPEED_OPTIMIZATION_CONFIG['API_TIMEOUT'], max_retries=0)
+        content, usage, parsed = [], None, 0
+        try:
+            stream = client.chat.completions.create(**self._stream_params(size, question_type, category))
         except Exception as e:
-            print(f"問題生成エラー: {e}")
-            # フォールバック問題を返す
-            return self._get_fallback_questions(num_questions)
+            print(f"ストリーミング生成エラー（{question_type}）: {e}")
+            return
+        try:
+            for chunk in stream:
+                usage = chunk.usage or usage
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                content.append(text)
+                for question in filter(None, map(parse_block, parser.feed(text))):
+                    parsed += 1
+                    yield question
+            for question in filter(None, map(parse_block, parser.finish())):
+                parsed += 1
+                yield question
+        except Exception as e:
+            print(f"ストリーミング生成エラー（{question_type}）: {e}")
+            return
+        finally:
+            # 必要数が揃って途中で打ち切った場合も接続を閉じる
+            stream.close()
+        
+        # 応答を最後まで受け取った場合のみ歩留まりの記録とキャッシュへの保存を行う
+        yield_tracker.observe(question_type, size, parsed)
+        if cache is not None:
+            cache.put(params, ''.join(content), usage)
+    
+    async def _astream_generated(self, size: int, question_type: str, category: str = None,
+                                 use_cache: bool = True) -> AsyncIterator[Dict]:
+        """_stream_generated の非同期版"""
+        params = self._chat_params(size, question_type, category)
+        cache = get_generation_cache() if use_cache else None
+        cached = None
+        if cache is not None:
+            # ファイル・Django キャッシュはI/Oを伴うためスレッドで実行する
+            cached = await sync_to_async(cache.get)(params) if cache.blocking else cache.get(params)
+        if cached is not None:
+            for question in self._parse_content(cached, question_type):
+                yield question
+            return
+        
+        parser, parse_block = self._stream_parser(question_type)
+        client = get_async_openai_client().with_options(
+            timeout=SPEED_OPTIMIZATION_CONFIG['API_TIMEOUT'], max_retries=0
+        )
+        content, usage, parsed = [], None, 0
+        try:
+            stream = await client.chat.completions.create(**self._stream_params(size, question_type, category))
+        except Exception as e:
+            print(f"非同期ストリーミング生成エラー（{question_type}）: {e}")
+            return
+        try:
+            async for chunk in stream:
+                usage = chunk.usage or usage
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                content.append(text)
+                for question in filter(None, map(parse_block, parser.feed(text))):
+                    parsed += 1
+                    yield question
+            for question in filter(None, map(parse_block, parser.finish())):
+                parsed += 1
+                yield question
+        except Exception as e:
+            print(f"非同期ストリーミング生成エラー（{question_type}）: {e}")
+            return
+        finally:
+            await stream.close()
+        
+        yield_tracker.observe(question_type, size, parsed)
+        if cache is not None:
+            if cache.blocking:
+                await sync_to_async(cache.put)(params, ''.join(content), usage)
+            else:
+                cache.put(params, ''.join(content), usage)
+    
+    def _fill_shortage(self, num_questions: int, question_type: str, exclude: set = None) -> List[Dict]:
+        """
+        不足分を問題プール → フォールバック問題の順で補う（取得済みの問題文は除く）
+        
+        同じセッションで同じ問題を出さないよう、問題文が重複するものは使わない。
+        フォールバック問題は取得済みの問題を除いても足りるだけの数を見る
+        （1セッション10問では、フォールバック問題の種類数より不足が多くなることはない）。
+        """
+        exclude = set(exclude or ())
+        filled = []
+        try:
+            pool_questions = self.pregenerated_service.get_random_questions(
+                num_questions, question_type=question_type
+            )
+        except Exception as e:
+            print(f"問題プール取得エラー: {e}")
+            pool_questions = []
+        
+        if question_type == 'math':
+            fallback_questions = self._get_fallback_math_questions(num_questions + len(exclude))
+        else:
+            fallback_questions = self._get_fallback_questions(num_questions + len(exclude))
+        
+        for question in pool_questions + fallback_questions:
+            if len(filled) >= num_questions:
+                break
+            if question['question'] not in exclude:
+                exclude.add(question['question'])
+                filled.append(question)
+        
+        if len(filled) < num_questions:
+            print(f"⚠️ 重複しない補充問題が不足 ({question_type}): {len(filled)}/{num_questions}")
+        return filled
+    
+    def _chat_params(self, num_questions: int, question_type: str = 'language', category: str = None) -> Dict:
+        """
+        チャット補完APIのリクエストパラメータ（同期・非同期クライアントで共通）
+        """
+        if question_type == 'math':
+            return {
+                'model': "gpt-4o-mini",
+                'messages': [
+                    {"role": "system", "content": self._get_math_system_prompt()},
+                    {"role": "user", "content": self._build_math_prompt(num_questions, category)},
+                ],
+                'temperature': 0.3,  # 数学は創造性よりも正確性を重視
+                'max_tokens': 800,
+                'top_p': 0.8,
+            }
+        return {
+            'model': "gpt-4o-mini",
+            'messages': [
+                {"role": "system", "content": self._get_system_prompt()},
+                {"role": "user", "content": self._build_prompt(num_questions, category)},
+            ],
+            'temperature': 0.4,  # 少し創造性を上げて質の高い問題を生成
+            'max_tokens': 1200,   # トークン数を増加して詳細な説明を可能に
+            'top_p': 0.9,        # 応答の多様性を少し上げる
+        }
+    
+    def _parse_content(self, content: str, question_type: str = 'language') -> List[Dict]:
+        """
+        応答本文を問題リストに変換する（国語は重複排除 & ひらがな化まで行う）
+        """
+        if question_type == 'math':
+            return self._parse_math_response(content)
+        return self._post_process_questions(self._parse_response(content))
     
     def _get_system_prompt(self) -> str:
         """
@@ -151,11 +613,11 @@ B) 選択肢2
 C) 選択肢3
 正解: A"""
     
-    def _build_prompt(self, num_questions: int) -> str:
+    def _build_prompt(self, num_questions: int, category: str = None) -> str:
         """
         ユーザープロンプトを構築する
         """
-        return f"""小学1年生向けの国語クイズを{num_questions}問作成してください。
+        return f"""小学1年生向けの国語クイズを{num_questions}問作成してください。{self._build_category_hint(category)}
 
 【必須条件】
 1. ひらがな・カタカナ・数字のみ使用
@@ -180,6 +642,15 @@ C) 選択肢3
 
 {num_questions}問すべて作成してください。"""
     
+    def _build_category_hint(self, category: str = None) -> str:
+        """
+        出題分野の指定行を構築する（指定が無い場合は空文字）
+        """
+        label = CATEGORY_PROMPT_HINTS.get(category)
+        if not label:
+            return ""
+        return f"\n\n【今回の重点分野】{label}の問題を中心に作成してください。"
+    
     def _parse_response(self, content: str) -> List[Dict]:
         """
         ChatGPTの応答をパースして問題リストに変換する
@@ -209,9 +680,6 @@ C) 選択肢3
         if len(lines) < 5:  # 問題文 + 3選択肢 + 正解
             return None
         
-        # 問題文を取得
-        question_text = _to_hiragana(lines[0].strip())
-        
         # 選択肢を取得
         choices = []
         choice_pattern = r'^[A-C]\)\s*(.+)$'
@@ -219,11 +687,14 @@ C) 選択肢3
         for line in lines[1:4]:
             match = re.match(choice_pattern, line)
             if match:
-                choices.append(_to_hiragana(match.group(1).strip()))
+                choices.append(match.group(1).strip())
         
         if len(choices) != 3:
             return None
         
+        # 問題文と選択肢をまとめてひらがな化
+        question_text, *choices = to_hiragana_batch([lines[0].strip()] + choices)
+        
         # 正解を取得
         correct_answer = None
         for line in lines:
@@ -243,50 +714,22 @@ C) 選択肢3
             "answer": correct_answer
         }
     
-    def _generate_math_questions(self, num_questions: int) -> List[Dict]:
+    def _generate_math_questions(self, num_questions: int, category: str = None, fill_shortage: bool = True,
+                                 use_cache: bool = True) -> List[Dict]:
         """
         小学1年生レベルの算数問題を生成する
         
         Args:
             num_questions: 生成する問題数
+            category: 重点的に出題する分野（問題プール補充用、任意）
+            fill_shortage: 生成できなかった分を問題プール・フォールバック問題で補うか
+            use_cache: 生成応答のキャッシュを使うか（問題プール補充では新しい問題が必要なため False）
             
         Returns:
             問題のリスト
         """
-        try:
-            print(f"算数問題生成開始 - モデル: gpt-4o-mini, 問題数: {num_questions}")
-            prompt = self._build_math_prompt(num_questions)
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self._get_math_system_prompt()
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,  # 数学は創造性よりも正確性を重視
-                max_tokens=800,
-                top_p=0.8
-            )
-            
-            content = response.choices[0].message.content
-            questions = self._parse_math_response(content)
-            
-            # 不足分があれば追加生成
-            if len(questions) < num_questions:
-                remaining = num_questions - len(questions)
-                questions.extend(self._generate_math_questions(remaining))
-            
-            return questions[:num_questions]
-            
-        except Exception as e:
-            print(f"算数問題生成エラー: {e}")
-            # フォールバック算数問題を返す
-            return self._get_fallback_math_questions(num_questions)
+        print(f"算数問題生成開始 - モデル: gpt-4o-mini, 問題数: {num_questions}")
+        return self._plan_questions(num_questions, 'math', category, fill_shortage, use_cache)
     
     def _get_math_system_prompt(self) -> str:
         """
@@ -313,11 +756,11 @@ C) 選択肢3
 
 文章問題の場合も答えは数字のみにしてください。"""
     
-    def _build_math_prompt(self, num_questions: int) -> str:
+    def _build_math_prompt(self, num_questions: int, category: str = None) -> str:
         """
         算数問題用のユーザープロンプトを構築する
         """
-        return f"""小学1年生向けの算数問題を{num_questions}問作成してください。
+        return f"""小学1年生向けの算数問題を{num_questions}問作成してください。{self._build_category_hint(category)}
 
 【必須条件】
 1. ひらがな・カタカナ・数字のみ使用（漢字禁止）
@@ -468,9 +911,12 @@ C) 選択肢3
         """重複排除とひらがな化を保証"""
         unique_questions = []
         seen_texts = set()
+        texts = to_hiragana_batch([text for q in questions for text in [q["question"], *q["choices"]]])
+        position = 0
         for q in questions:
-            q["question"] = _to_hiragana(q["question"])
-            q["choices"] = [_to_hiragana(c) for c in q["choices"]]
+            q["question"] = texts[position]
+            q["choices"] = texts[position + 1:position + 1 + len(q["choices"])]
+            position += 1 + len(q["choices"])
             if q["question"] not in seen_texts:
                 unique_questions.append(q)
                 seen_texts.add(q["question"])
@@ -588,4 +1034,15 @@ C) 選択肢3
         for i in range(num_questions):
             questions.append(fallback_questions[i % len(fallback_questions)])
         
-        return questions 
\ No newline at end of file
+        return questions 
+
+
+_quiz_generator = None
+
+
+def get_quiz_generator() -> QuizGeneratorService:
+    """プロセス共通の QuizGeneratorService を取得する"""
+    global _quiz_generator
+    if _quiz_generator is None:
+        _quiz_generator = QuizGeneratorService()
+    return _quiz_generator
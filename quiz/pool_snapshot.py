@@ -0,0 +1,334 @@
+"""
+問題プールのプロセス内スナップショット
+
+問題プールはバッチ処理（refill_question_pool など）でしか変わらないため、クイズ開始のたびに
+DBを読む代わりに、id・カテゴリ・品質スコア・使用回数をコンパクトな配列で保持して
+メモリ上で抽出する。
+
+更新の検知:
+    - 問題の保存・削除時に、同じプロセスのスナップショットは即座に再読み込み対象になる
+    - 他のプロセス（別のワーカーや refill_question_pool などのコマンド）にはコミット後に
+      DB の PoolVersion のバージョン番号を加算して知らせる
+      （補充などの一括保存は batched_pool_changes で囲み、保存のたびではなく最後に1回だけ加算する）
+      （各プロセスは POOL_SNAPSHOT_VERSION_CHECK_INTERVAL 秒ごとに主キーで1行読んで確認）。
+      Django キャッシュは既定でプロセスごとの LocMemCache のため使わない
+    - それ以外でも POOL_SNAPSHOT_TTL 秒経ったら読み直す
+
+使用回数はメモリ上で加算し、バックグラウンドスレッドがまとめてDBへ書き戻す。
+"""
+import atexit
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PoolVersion, PreGeneratedQuestion
+from .question_sampler import weighted_sample_unseen
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+# 更新されてもスナップショットを読み直さない列
+STATS_FIELDS = {'used_count', 'attempt_count', 'correct_count', 'correct_rate'}
+
+# 配列に入れるためのコード表
+QUESTION_TYPE_CODES = [code for code, _ in PreGeneratedQuestion.QUESTION_TYPES]
+CATEGORY_CODES = [code for code, _ in PreGeneratedQuestion._meta.get_field('category').choices]
+ANSWER_FORMAT_CODES = [code for code, _ in PreGeneratedQuestion.ANSWER_FORMATS]
+
+
+class PoolSnapshot:
+    """
+    ある時点の有効な問題プール（読み込み後は使用回数以外は変更しない）
+
+    抽出に使う列は array で、問題文・選択肢は出題時に辞書へ戻すためタプルで持つ。
+    """
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded_at = time.time()
+        self.ids = array('q')
+        self.type_codes = array('B')
+        self.category_codes = array('B')
+        self.quality_scores = array('h')
+        self.used_counts = array('q')
+        self.answer_format_codes = array('B')
+        self.answers = array('h')        # 選択問題の正解インデックス（無ければ -1）
+        self.correct_values = array('h')  # 数値問題の正解（無ければ -1）
+        self.texts = []                  # (問題文, 選択肢1, 選択肢2, 選択肢3)
+        self.positions = {}              # id → 配列上の位置
+
+        for row in rows:
+            (question_id, question_type, category, quality_score, used_count, answer_format,
+             correct_answer, correct_value, question_text, choice_1, choice_2, choice_3) = row
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+            self.type_codes.append(_code(QUESTION_TYPE_CODES, question_type))
+            self.category_codes.append(_code(CATEGORY_CODES, category))
+            self.quality_scores.append(quality_score)
+            self.used_counts.append(used_count)
+            self.answer_format_codes.append(_code(ANSWER_FORMAT_CODES, answer_format))
+            self.answers.append(-1 if correct_answer is None else correct_answer)
+            self.correct_values.append(-1 if correct_value is None else correct_value)
+            self.texts.append((question_text, choice_1, choice_2, choice_3))
+
+    @classmethod
+    def load(cls, version=None) -> 'PoolSnapshot':
+        rows = PreGeneratedQuestion.objects.filter(is_active=True).values_list(
+            'id', 'question_type', 'category', 'quality_score', 'used_count', 'answer_format',
+            'correct_answer', 'correct_value', 'question_text', 'choice_1', 'choice_2', 'choice_3'
+        )
+        return cls(rows.iterator(), version)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidates(self, question_type: str, category: str = None, min_quality_score: int = 0):
+        """(id, used_count, quality_score) の候補リスト"""
+        type_code = _code(QUESTION_TYPE_CODES, question_type)
+        category_code = _code(CATEGORY_CODES, category) if category else None
+        return [
+            (self.ids[i], self.used_counts[i], self.quality_scores[i])
+            for i in range(len(self.ids))
+            if self.type_codes[i] == type_code
+            and (category_code is None or self.category_codes[i] == category_code)
+            and self.quality_scores[i] >= min_quality_score
+        ]
+
+    def to_dict(self, question_id: int) -> Dict:
+        """PreGeneratedQuestion.to_dict と同じ形式の辞書"""
+        i = self.positions[question_id]
+        question_text, choice_1, choice_2, choice_3 = self.texts[i]
+        answer_format = ANSWER_FORMAT_CODES[self.answer_format_codes[i]]
+        data = {
+            'pregenerated_id': question_id,
+            'question': question_text,
+            'question_type': QUESTION_TYPE_CODES[self.type_codes[i]],
+            'answer_format': answer_format,
+            'quality_score': self.quality_scores[i],
+            'category': CATEGORY_CODES[self.category_codes[i]],
+        }
+        if answer_format == 'multiple_choice':
+            data.update({
+                'choices': [choice_1, choice_2, choice_3],
+                'answer': None if self.answers[i] < 0 else self.answers[i],
+            })
+        elif answer_format == 'numeric':
+            data['correct_value'] = None if self.correct_values[i] < 0 else self.correct_values[i]
+        return data
+
+    def memory_bytes(self) -> int:
+        """配列と文字列の概算メモリ使用量（バイト）"""
+        arrays = [self.ids, self.type_codes, self.category_codes, self.quality_scores,
+                  self.used_counts, self.answer_format_codes, self.answers, self.correct_values]
+        size = sum(item.buffer_info()[1] * item.itemsize for item in arrays)
+        size += sys.getsizeof(self.texts) + sys.getsizeof(self.positions)
+        for texts in self.texts:
+            size += sys.getsizeof(texts) + sum(sys.getsizeof(text) for text in texts)
+        return size
+
+
+def _code(codes: List[str], value: str) -> int:
+    try:
+        return codes.index(value)
+    except ValueError:
+        return len(codes)
+
+
+class PoolSnapshotCache:
+    """プロセス内のスナップショットの管理（再読み込みと使用回数の書き戻し）"""
+
+    def __init__(self):
+        self._snapshot: Optional[PoolSnapshot] = None
+        self._dirty = False
+        self._version_checked_at = 0.0
+        self._load_lock = threading.Lock()
+        self._usage = Counter()
+        self._usage_lock = threading.Lock()
+        self._flusher = None
+
+    def get(self) -> PoolSnapshot:
+        """最新のスナップショット（必要なら読み直す）"""
+        snapshot = self._snapshot
+        if snapshot is None or self._needs_reload(snapshot):
+            with self._load_lock:
+                snapshot = self._snapshot
+                if snapshot is None or self._needs_reload(snapshot):
+                    self._dirty = False
+                    snapshot = PoolSnapshot.load(self._current_version())
+                    self._version_checked_at = time.time()
+                    self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        """このプロセスのスナップショットを次回の取得時に読み直す"""
+        self._dirty = True
+
+    def sample(self, count: int, question_type: str, category: str = None,
+               min_quality_score: int = 0, seen=None) -> List[Dict]:
+        """
+        スナップショットから重み付きで問題を選ぶ（DBは読まない）
+
+        品質基準を満たす問題が足りない場合は品質を問わず選ぶ（get_random_questions と同じ）。
+        seen（ユーザーが最近見た問題）を渡すと、見ていない問題を優先する。
+        """
+        snapshot = self.get()
+        candidates = snapshot.candidates(question_type, category)
+        high_quality_candidates = [c for c in candidates if c[2] >= min_quality_score]
+        if len(high_quality_candidates) >= count:
+            candidates = high_quality_candidates
+
+        selected_ids = weighted_sample_unseen(candidates, count, seen)
+        self.record_usage(snapshot, selected_ids)
+        return [snapshot.to_dict(question_id) for question_id in selected_ids]
+
+    def record_usage(self, snapshot: PoolSnapshot, question_ids: List[int]):
+        """使用回数をメモリ上で加算し、書き戻し待ちに追加する"""
+        with self._usage_lock:
+            for question_id in question_ids:
+                snapshot.used_counts[snapshot.positions[question_id]] += 1
+                self._usage[question_id] += 1
+            pending = len(self._usage)
+        if pending >= SPEED_OPTIMIZATION_CONFIG['POOL_USAGE_FLUSH_BATCH']:
+            self.flush_usage()
+        else:
+            self._start_flusher()
+
+    def flush_usage(self) -> int:
+        """
+        書き戻し待ちの使用回数をDBに反映する（更新した問題数を返す）
+
+        加算数ごとに UPDATE ... SET used_count = used_count + n WHERE id IN (...) を1回ずつ実行する。
+        """
+        with self._usage_lock:
+            usage, self._usage = self._usage, Counter()
+        if not usage:
+            return 0
+
+        ids_by_increment = defaultdict(list)
+        for question_id, increment in usage.items():
+            ids_by_increment[increment].append(question_id)
+        try:
+            with transaction.atomic():
+                for increment, question_ids in ids_by_increment.items():
+                    PreGeneratedQuestion.objects.filter(id__in=question_ids).update(
+                        used_count=F('used_count') + increment
+                    )
+        except Exception as e:
+            # 次回の書き戻しで再試行する
+            print(f"使用回数の書き戻しエラー: {e}")
+            with self._usage_lock:
+                self._usage.update(usage)
+            return 0
+        return len(usage)
+
+    def stats(self) -> Dict:
+        """スナップショットの件数・経過時間・メモリ使用量"""
+        snapshot = self._snapshot
+        with self._usage_lock:
+            pending = len(self._usage)
+        if snapshot is None:
+            return {'loaded': False, 'pending_usage': pending}
+        return {
+            'loaded': True,
+            'questions': len(snapshot),
+            'version': snapshot.version,
+            'age_seconds': round(time.time() - snapshot.loaded_at, 1),
+            'memory_bytes': snapshot.memory_bytes(),
+            'pending_usage': pending,
+        }
+
+    def _needs_reload(self, snapshot: PoolSnapshot) -> bool:
+        if self._dirty:
+            return True
+        now = time.time()
+        if now - snapshot.loaded_at > SPEED_OPTIMIZATION_CONFIG['POOL_SNAPSHOT_TTL']:
+            return True
+        if now - self._version_checked_at > SPEED_OPTIMIZATION_CONFIG['POOL_SNAPSHOT_VERSION_CHECK_INTERVAL']:
+            self._version_checked_at = now
+            version = self._current_version()
+            # 確認できなかった場合は今のスナップショットを使い続ける（次の確認間隔で再確認する）
+            return version is not None and version != snapshot.version
+        return False
+
+    @staticmethod
+    def _current_version() -> Optional[int]:
+        """DB のバージョン番号（読めなかった場合は None）"""
+        try:
+            return PoolVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+        except Exception as e:
+            print(f"問題プールのバージョン確認エラー: {e}")
+            return None
+
+    def _start_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._usage_lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='quiz-pool-usage', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(SPEED_OPTIMIZATION_CONFIG['POOL_USAGE_FLUSH_INTERVAL'])
+            try:
+                self.flush_usage()
+            finally:
+                # このスレッドのDB接続を残さない
+                connection.close()
+
+
+pool_snapshot_cache = PoolSnapshotCache()
+atexit.register(pool_snapshot_cache.flush_usage)
+
+
+def bump_pool_version():
+    """他のプロセスにスナップショットの読み直しを知らせる（DBのバージョン番号を加算）"""
+    try:
+        PoolVersion.objects.get_or_create(pk=1)
+        PoolVersion.objects.filter(pk=1).update(version=F('version') + 1)
+    except Exception as e:
+        print(f"問題プールのバージョン更新エラー: {e}")
+
+
+_batch_state = threading.local()
+
+
+@contextmanager
+def batched_pool_changes():
+    """
+    ブロック内での問題の保存・削除ではバージョンを加算せず、終了時に1回だけ加算する
+
+    refill_pool などの1問ずつ保存する一括処理で、保存のたびに他のプロセスが読み直さないようにする。
+    入れ子にした場合は一番外側の終了時に加算する。
+    """
+    depth = getattr(_batch_state, 'depth', 0)
+    if depth == 0:
+        _batch_state.changed = False
+    _batch_state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _batch_state.depth = depth
+        if depth == 0 and _batch_state.changed:
+            transaction.on_commit(bump_pool_version)
+
+
+@receiver(post_save, sender=PreGeneratedQuestion)
+@receiver(post_delete, sender=PreGeneratedQuestion)
+def _pool_changed(sender, update_fields=None, **kwargs):
+    # 使用統計だけの更新では出題内容は変わらない
+    if update_fields and set(update_fields) <= STATS_FIELDS:
+        return
+    pool_snapshot_cache.invalidate()
+    if getattr(_batch_state, 'depth', 0):
+        _batch_state.changed = True
+        return
+    transaction.on_commit(bump_pool_version)
@@ -2,11 +2,25 @@
 事前生成高品質問題管理サービス
 """
 import random
+from collections import Counter
 from typing import List, Dict
 from django.db import transaction
+from django.db.models import Count, F
 from .models import PreGeneratedQuestion
-from .openai_service import QuizGeneratorService
+from .answer_stats import aggregate_answer_stats
+from .generation_engine import GenerationEngine, RateLimiter, estimate_request_tokens
+from .openai_service import QuizGeneratorService, get_quiz_generator
+from .pool_snapshot import batched_pool_changes, pool_snapshot_cache
+from .question_sampler import weighted_sample_unseen
 from .quality_checker import QuestionQualityChecker, batch_evaluate_questions, filter_high_quality_questions
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+
+# 問題プールで在庫を管理するカテゴリ（問題タイプ別）
+POOL_CATEGORIES = {
+    'language': ['animals', 'sounds', 'opposites', 'colors', 'hiragana', 'others'],
+    'math': ['addition', 'subtraction', 'counting', 'numbers'],
+}
 
 
 class PreGeneratedQuestionService:
@@ -14,33 +28,49 @@ class PreGeneratedQuestionService:
     
     def __init__(self):
         self.quality_checker = QuestionQualityChecker()
-        self.openai_service = QuizGeneratorService()
         self.min_quality_score = 70  # 最低品質スコア
     
-    @transaction.atomic
-    def generate_and_store_questions(self, count: int = 50) -> Dict:
+    @property
+    def openai_service(self) -> QuizGeneratorService:
+        """問題生成サービス（プロセス共通のインスタンス）"""
+        return get_quiz_generator()
+    
+    def generate_and_store_questions(self, count: int = 50, concurrency: int = None,
+                                     requests_per_minute: int = None, tokens_per_minute: int = None,
+                                     batch_size: int = 10) -> Dict:
         """
-        高品質問題を生成してDBに保存
+        高品質問題を並列生成してDBに保存
+        
+        API呼び出しは GenerationEngine でスレッド並列に実行し、完了したバッチから
+        順に品質評価・DB保存を行う（全件の生成完了を待たない）。
+        保存はバッチごとの短いトランザクションで行う。
         
         Args:
             count: 生成する問題数
+            concurrency: 同時API呼び出し数（省略時は設定値）
+            requests_per_minute: 1分あたりのリクエスト数上限（省略時は設定値）
+            tokens_per_minute: 1分あたりのトークン数上限（省略時は設定値）
+            batch_size: 1回のAPI呼び出しで生成する問題数
             
         Returns:
             生成結果の統計情報
         """
-        print(f"🚀 {count}問の高品質問題生成を開始...")
+        config = SPEED_OPTIMIZATION_CONFIG
+        concurrency = concurrency or config['GENERATION_CONCURRENCY']
+        rate_limiter = RateLimiter(
+            requests_per_minute or config['OPENAI_REQUESTS_PER_MINUTE'],
+            tokens_per_minute or config['OPENAI_TOKENS_PER_MINUTE']
+        )
+        tokens_per_batch = estimate_request_tokens(self.openai_service._chat_params(batch_size))
         
-        # 品質の高い問題が必要数集まるまで生成を続ける
-        high_quality_questions = []
-        total_generated = 0
-        max_attempts = count * 3  # 最大試行回数
+        print(f"🚀 {count}問の高品質問題生成を開始... (並列数: {concurrency})")
         
-        while len(high_quality_questions) < count and total_generated < max_attempts:
-            # バッチで問題生成（一度に10問）
-            batch_size = min(10, count - len(high_quality_questions))
-            raw_questions = self.openai_service._generate_ai_questions(batch_size)
-            total_generated += len(raw_questions)
-            
+        high_quality_found = 0
+        saved_count = 0
+        
+        def store_batch(raw_questions: List[Dict]) -> int:
+            """完了したバッチを品質評価して保存し、保存数を返す（呼び出し元スレッドで実行）"""
+            nonlocal high_quality_found, saved_count
             # 品質評価
             evaluated_questions = batch_evaluate_questions(raw_questions)
             
@@ -49,50 +79,87 @@ class PreGeneratedQuestionService:
                 evaluated_questions, 
                 self.min_quality_score
             )
+            high_quality_found += len(batch_high_quality)
             
-            high_quality_questions.extend(batch_high_quality)
-            
-            print(f"📊 進捗: {len(high_quality_questions)}/{count} (生成済み:{total_generated})")
+            # DBに保存（目標数を超えた分は保存しない）
+            stored = 0
+            with transaction.atomic():
+                for question_data in batch_high_quality[:count - saved_count]:
+                    if self._save_question_to_db(question_data):
+                        stored += 1
+            saved_count += stored
+            return stored
         
-        # DBに保存
-        saved_count = 0
-        for question_data in high_quality_questions[:count]:
-            if self._save_question_to_db(question_data):
-                saved_count += 1
+        def report(stats: Dict):
+            print(f"📊 進捗: {stats['accepted']}/{count} (生成済み:{stats['generated']}, "
+                  f"{stats['questions_per_second']}問/秒)")
+        
+        engine = GenerationEngine(
+            lambda size: self.openai_service._generate_ai_questions(size, fill_shortage=False, use_cache=False),
+            concurrency=concurrency,
+            rate_limiter=rate_limiter,
+            tokens_per_batch=tokens_per_batch
+        )
+        # 他のプロセスへのスナップショットの読み直しの通知は、保存のたびではなく最後に1回だけ行う
+        with batched_pool_changes():
+            stats = engine.run(
+                target=count,
+                batch_size=batch_size,
+                max_generated=count * 3,  # 最大試行回数
+                on_batch=store_batch,
+                progress=report
+            )
         
         result = {
             'requested_count': count,
-            'total_generated': total_generated,
-            'high_quality_found': len(high_quality_questions),
+            'total_generated': stats['generated'],
+            'high_quality_found': high_quality_found,
             'saved_to_db': saved_count,
-            'success_rate': len(high_quality_questions) / total_generated if total_generated > 0 else 0
+            'success_rate': high_quality_found / stats['generated'] if stats['generated'] > 0 else 0,
+            'api_calls': stats['api_calls'],
+            'elapsed_seconds': stats['elapsed_seconds'],
+            'questions_per_second': stats['questions_per_second'],
+            'rate_limited_seconds': stats['rate_limited_seconds'],
         }
         
-        print(f"✅ 完了: {saved_count}問をDBに保存")
+        print(f"✅ 完了: {saved_count}問をDBに保存 ({stats['questions_per_second']}問/秒)")
         return result
     
     def _save_question_to_db(self, question_data: Dict) -> bool:
         """問題をDBに保存"""
         try:
-            # 重複チェック
-            if PreGeneratedQuestion.objects.filter(
-                question_text=question_data['question']
-            ).exists():
-                return False
+            # 一括保存のトランザクション内で失敗しても他の問題の保存を続けられるようセーブポイントで保護
+            with transaction.atomic():
+                # 重複チェック
+                if PreGeneratedQuestion.objects.filter(
+                    question_text=question_data['question']
+                ).exists():
+                    return False
             
-            # カテゴリ自動判定
-            category = self._determine_category(question_data)
+                if question_data.get('answer_format') == 'numeric':
+                    PreGeneratedQuestion.objects.create(
+                        question_text=question_data['question'],
+                        question_type='math',
+                        answer_format='numeric',
+                        correct_value=question_data['correct_value'],
+                        quality_score=question_data['quality_score'],
+                        category=question_data.get('category') or self._determine_math_category(question_data)
+                    )
+                    return True
             
-            PreGeneratedQuestion.objects.create(
-                question_text=question_data['question'],
-                choice_1=question_data['choices'][0],
-                choice_2=question_data['choices'][1],
-                choice_3=question_data['choices'][2],
-                correct_answer=question_data['answer'],
-                quality_score=question_data['quality_score'],
-                category=category
-            )
-            return True
+                # カテゴリ自動判定
+                category = question_data.get('category') or self._determine_category(question_data)
+            
+                PreGeneratedQuestion.objects.create(
+                    question_text=question_data['question'],
+                    choice_1=question_data['choices'][0],
+                    choice_2=question_data['choices'][1],
+                    choice_3=question_data['choices'][2],
+                    correct_answer=question_data['answer'],
+                    quality_score=question_data['quality_score'],
+                    category=category
+                )
+                return True
             
         except Exception as e:
             print(f"⚠️ DB保存エラー: {e}")
@@ -121,51 +188,236 @@ class PreGeneratedQuestionService:
         
         return 'others'
     
-    def get_random_questions(self, count: int = 10, category: str = None) -> List[Dict]:
+    def _determine_math_category(self, question_data: Dict) -> str:
+        """算数問題のカテゴリを自動判定"""
+        text = question_data['question']
+        
+        if any(word in text for word in ['+', '＋', 'ぜんぶで', 'あわせて']):
+            return 'addition'
+        
+        if any(word in text for word in ['-', '－', 'のこり', 'ちがい']):
+            return 'subtraction'
+        
+        if any(word in text for word in ['●', 'いくつ']):
+            return 'counting'
+        
+        return 'numbers'
+    
+    def get_pool_deficits(self, question_type: str = 'language', low_water_mark: int = None) -> Dict[str, int]:
+        """
+        カテゴリごとの在庫不足数を取得（GROUP BY 1クエリ）
+        
+        Args:
+            question_type: 問題タイプ ('language' または 'math')
+            low_water_mark: カテゴリごとの最低在庫数
+            
+        Returns:
+            {カテゴリ: 不足数} の辞書（不足の無いカテゴリは 0）
+        """
+        if low_water_mark is None:
+            low_water_mark = SPEED_OPTIMIZATION_CONFIG['POOL_LOW_WATER_MARK']
+        
+        stock = dict(
+            PreGeneratedQuestion.objects.filter(
+                is_active=True,
+                question_type=question_type,
+                quality_score__gte=self.min_quality_score
+            ).values_list('category').annotate(total=Count('id')).order_by()
+        )
+        
+        return {
+            category: max(low_water_mark - stock.get(category, 0), 0)
+            for category in POOL_CATEGORIES[question_type]
+        }
+    
+    def refill_pool(self, question_type: str = 'language', low_water_mark: int = None,
+                    batch_size: int = None, max_batches: int = None) -> Dict:
+        """
+        在庫が最低在庫数を下回っているカテゴリをバッチ生成で補充する
+        
+        不足の大きいカテゴリから順に、そのカテゴリを重点分野としてプロンプトに指定して生成する。
+        生成結果のカテゴリは自動判定なので狙い通りにならないこともあるが、
+        API呼び出し回数は max_batches で打ち切る。
+        
+        Args:
+            question_type: 問題タイプ ('language' または 'math')
+            low_water_mark: カテゴリごとの最低在庫数
+            batch_size: 1回のAPI呼び出しで生成する問題数
+            max_batches: API呼び出し回数の上限
+            
+        Returns:
+            補充結果の統計情報
+        """
+        config = SPEED_OPTIMIZATION_CONFIG
+        batch_size = batch_size or config['POOL_REFILL_BATCH_SIZE']
+        max_batches = max_batches if max_batches is not None else config['POOL_REFILL_MAX_BATCHES']
+        
+        deficits = self.get_pool_deficits(question_type, low_water_mark)
+        initial_deficits = dict(deficits)
+        saved = Counter()
+        total_generated = 0
+        batches = 0
+        
+        # 他のプロセスへのスナップショットの読み直しの通知は、保存のたびではなく最後に1回だけ行う
+        with batched_pool_changes():
+            while batches < max_batches:
+                pending = [category for category, deficit in deficits.items() if deficit > 0]
+                if not pending:
+                    break
+                
+                target_category = max(pending, key=deficits.get)
+                candidates = self._generate_pool_batch(question_type, batch_size, target_category)
+                batches += 1
+                total_generated += len(candidates)
+                
+                for question_data in candidates:
+                    if self._save_question_to_db(question_data):
+                        category = question_data['category']
+                        saved[category] += 1
+                        if deficits.get(category, 0) > 0:
+                            deficits[category] -= 1
+                
+                print(f"📦 プール補充 ({question_type}): {target_category} 重点 "
+                      f"バッチ{batches}/{max_batches} 保存累計:{sum(saved.values())}")
+        
+        return {
+            'question_type': question_type,
+            'initial_deficits': initial_deficits,
+            'remaining_deficits': deficits,
+            'api_batches': batches,
+            'total_generated': total_generated,
+            'saved_by_category': dict(saved),
+            'saved_to_db': sum(saved.values()),
+        }
+    
+    def _generate_pool_batch(self, question_type: str, batch_size: int, category: str) -> List[Dict]:
+        """プール補充用に1バッチ生成し、品質基準を満たすものだけをカテゴリ付きで返す"""
+        if question_type == 'math':
+            questions = self.openai_service._generate_math_questions(batch_size, category, fill_shortage=False, use_cache=False)
+        else:
+            questions = self.openai_service._generate_ai_questions(batch_size, category, fill_shortage=False, use_cache=False)
+        return self._prepare_pool_candidates(questions, question_type)
+    
+    def _prepare_pool_candidates(self, questions: List[Dict], question_type: str) -> List[Dict]:
+        """生成された問題から品質基準を満たすものを選び、品質スコアとカテゴリを付ける"""
+        if question_type == 'math':
+            for question_data in questions:
+                # 算数問題はパース時に答えの範囲(0-20)を検証済みのため最低品質スコアで登録
+                question_data['quality_score'] = self.min_quality_score
+                question_data['category'] = self._determine_math_category(question_data)
+            return questions
+        
+        evaluated_questions = batch_evaluate_questions(questions)
+        questions = filter_high_quality_questions(evaluated_questions, self.min_quality_score)
+        for question_data in questions:
+            question_data['category'] = self._determine_category(question_data)
+        return questions
+    
+    def store_generated_questions(self, questions: List[Dict], question_type: str = 'language') -> int:
+        """
+        生成済みの問題を品質評価してプールに保存する（保存数を返す）
+        
+        ヘッジ生成で間に合わなかった応答など、既に生成された問題を無駄にしないために使う。
+        """
+        saved_count = 0
+        with batched_pool_changes(), transaction.atomic():
+            for question_data in self._prepare_pool_candidates(questions, question_type):
+                if self._save_question_to_db(question_data):
+                    saved_count += 1
+        return saved_count
+    
+    def get_random_questions(self, count: int = 10, category: str = None, question_type: str = 'language',
+                             seen=None) -> List[Dict]:
         """
         ランダムに高品質問題を取得
         
         Args:
             count: 取得する問題数
             category: カテゴリ指定（任意）
+            question_type: 問題タイプ ('language' または 'math')
+            seen: ユーザーが最近見た問題の判定器（UserSeenQuestions.filter_for_user、任意）。
+                  見ていない問題を優先し、足りない場合のみ見た問題から選ぶ
             
         Returns:
             問題のリスト
         """
-        query = PreGeneratedQuestion.objects.filter(is_active=True)
+        if SPEED_OPTIMIZATION_CONFIG['POOL_SNAPSHOT']:
+            # プロセス内のスナップショットから抽出する（DBは読まず、使用回数は後でまとめて書き戻す）
+            return pool_snapshot_cache.sample(
+                count, question_type, category=category, min_quality_score=self.min_quality_score, seen=seen
+            )
+        
+        query = PreGeneratedQuestion.objects.filter(is_active=True, question_type=question_type)
         
         if category:
             query = query.filter(category=category)
         
-        # 使用回数が少ない順で取得し、その中からランダム選択（重複を減らす）
-        high_quality_questions = query.filter(
-            quality_score__gte=self.min_quality_score
-        ).order_by('used_count', '-quality_score')[:count * 3]  # 選択肢を多めに取得
+        # 品質の条件もSQLで絞り、使用回数の少ない順に上限件数だけを読む
+        # （カテゴリ指定なしは quiz_pregen_least_used_idx の順に読んで LIMIT で止まる）。
+        # 品質基準を満たす問題が足りない場合のみ、品質を問わず読み直す
+        limit = SPEED_OPTIMIZATION_CONFIG['POOL_SAMPLING_CANDIDATES']
+        columns = ('id', 'used_count', 'quality_score')
+        candidates = list(
+            query.filter(quality_score__gte=self.min_quality_score).order_by('used_count').values_list(*columns)[:limit]
+        )
+        if len(candidates) < count:
+            candidates = list(query.order_by('used_count').values_list(*columns)[:limit])
         
-        if high_quality_questions.count() < count:
-            # 足りない場合は全問題から使用回数順で取得
-            high_quality_questions = query.order_by('used_count', '-quality_score')[:count * 3]
+        # 使用回数が少なく品質の高い問題ほど選ばれやすい重み付きランダム抽出
+        selected_ids = weighted_sample_unseen(candidates, count, seen)
+        if not selected_ids:
+            return []
         
-        # ランダム選択
-        selected_questions = random.sample(
-            list(high_quality_questions), 
-            min(count, high_quality_questions.count())
-        )
+        questions_by_id = PreGeneratedQuestion.objects.in_bulk(selected_ids)
         
-        # 使用回数を更新
-        for question in selected_questions:
-            question.used_count += 1
-            question.save(update_fields=['used_count'])
+        # 使用回数を1回のUPDATEでまとめて更新
+        PreGeneratedQuestion.objects.filter(id__in=selected_ids).update(used_count=F('used_count') + 1)
         
-        return [q.to_dict() for q in selected_questions]
+        return [questions_by_id[question_id].to_dict() for question_id in selected_ids if question_id in questions_by_id]
     
-    def get_mixed_questions(self, count: int = 10, pregenerated_ratio: float = 0.7) -> List[Dict]:
+    def get_pool_questions(self, count: int = 10, question_type: str = 'language', seen=None) -> List[Dict]:
+        """
+        問題プールのみから問題を取得（OpenAI API は呼ばない）
+        
+        プールが不足している場合はフォールバック問題で補完する。
+        プールの補充は refill_question_pool コマンドが担当する。
+        
+        Args:
+            count: 取得する問題数
+            question_type: 問題タイプ ('language' または 'math')
+            seen: ユーザーが最近見た問題の判定器（任意）
+            
+        Returns:
+            問題のリスト
+        """
+        questions = self.get_random_questions(count, question_type=question_type, seen=seen)
+        
+        if len(questions) < count:
+            print(f"⚠️ 問題プール不足 ({question_type}): {len(questions)}/{count} - フォールバック問題で補完")
+            if question_type == 'math':
+                fallback_questions = self.openai_service._get_fallback_math_questions(count)
+            else:
+                fallback_questions = self.openai_service._get_fallback_questions(count)
+            
+            used_texts = {q['question'] for q in questions}
+            for question_data in fallback_questions:
+                if len(questions) >= count:
+                    break
+                if question_data['question'] not in used_texts:
+                    questions.append(question_data)
+                    used_texts.add(question_data['question'])
+        
+        random.shuffle(questions)
+        return questions[:count]
+    
+    def get_mixed_questions(self, count: int = 10, pregenerated_ratio: float = 0.7, seen=None) -> List[Dict]:
         """
         事前生成問題とAI生成問題を混合して取得
         
         Args:
             count: 総問題数
             pregenerated_ratio: 事前生成問題の割合 (0.0-1.0)
+            seen: ユーザーが最近見た問題の判定器（任意）
             
         Returns:
             混合問題のリスト
@@ -177,7 +429,7 @@ class PreGeneratedQuestionService:
         
         # 事前生成問題を取得
         if pregenerated_count > 0:
-            pregenerated_questions = self.get_random_questions(pregenerated_count)
+            pregenerated_questions = self.get_random_questions(pregenerated_count, seen=seen)
             questions.extend(pregenerated_questions)
         
         # 不足分をAI生成で補完
@@ -191,30 +443,14 @@ class PreGeneratedQuestionService:
         random.shuffle(questions)
         return questions[:count]
     
-    def update_question_stats(self, question_text: str, is_correct: bool):
+    def update_question_stats(self) -> Dict:
         """
-        問題の統計情報を更新
+        問題の回答数・正解数・正答率を更新（前回以降の回答を差分集計する）
         
-        Args:
-            question_text: 問題文
-            is_correct: 正解かどうか
+        Returns:
+            集計結果（aggregate_answer_stats の戻り値）
         """
-        try:
-            question = PreGeneratedQuestion.objects.get(
-                question_text=question_text,
-                is_active=True
-            )
-            
-            # 正答率の更新
-            total_attempts = question.used_count
-            if total_attempts > 0:
-                current_correct_count = question.correct_rate * (total_attempts - 1)
-                new_correct_count = current_correct_count + (1 if is_correct else 0)
-                question.correct_rate = new_correct_count / total_attempts
-                question.save(update_fields=['correct_rate'])
-                
-        except PreGeneratedQuestion.DoesNotExist:
-            pass  # 事前生成問題でない場合は何もしない
+        return aggregate_answer_stats()
     
     def get_db_stats(self) -> Dict:
         """DB内の問題統計を取得"""
@@ -268,5 +504,17 @@ def batch_generate_questions(count: int = 100):
     print(f"高品質問題数: {result['high_quality_found']}")
     print(f"DB保存数: {result['saved_to_db']}")
     print(f"成功率: {result['success_rate']:.1%}")
+    print(f"処理時間: {result['elapsed_seconds']}秒 ({result['questions_per_second']}問/秒)")
     
-    return result 
\ No newline at end of file
+    return result 
+
+
+_pregenerated_service = None
+
+
+def get_pregenerated_service() -> PreGeneratedQuestionService:
+    """プロセス共通の PreGeneratedQuestionService を取得する"""
+    global _pregenerated_service
+    if _pregenerated_service is None:
+        _pregenerated_service = PreGeneratedQuestionService()
+    return _pregenerated_service
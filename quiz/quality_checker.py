@@ -1,31 +1,217 @@
 """
 クイズ問題の品質自動評価システム
+
+評価は CompiledQualityEvaluator で行う。キーワード（語彙・難しい概念・丁寧語・楽しい要素・
+疑問の表現）は1つの正規表現にまとめてあり、問題文＋選択肢を1回走査するだけで全ての基準を採点する。
+QuestionQualityChecker の _check_* メソッドは採点基準の参照実装で、コンパイル版と結果が
+一致することをテストとベンチマーク（bench_quality_checker）で確認している。
 """
 import re
 from typing import Dict, List, Tuple
 
+# 小学1年生に適した語彙リスト
+GRADE1_VOCABULARY = {
+    'animals': ['いぬ', 'ねこ', 'とり', 'うし', 'ぶた', 'うま', 'ひつじ', 'やぎ'],
+    'colors': ['あか', 'あお', 'きいろ', 'みどり', 'しろ', 'くろ', 'ももいろ'],
+    'sounds': ['わんわん', 'にゃーにゃー', 'もーもー', 'ざあざあ', 'ぴかぴか'],
+    'opposites': ['おおきい', 'ちいさい', 'あつい', 'つめたい', 'うえ', 'した'],
+    'basic_words': ['がっこう', 'せんせい', 'おうち', 'おかあさん', 'おとうさん']
+}
+
+# 複雑すぎる概念・丁寧語・楽しい要素・疑問の表現
+COMPLEX_CONCEPTS = ['分数', '割り算', '掛け算', '引き算', '足し算', '数学', '理科']
+POLITE_WORDS = ['です', 'ます', 'でしょう']
+FUN_ELEMENTS = ['どうぶつ', 'おと', 'いろ', 'あそび', 'うた']
+QUESTION_MARKERS = ['？', 'でしょう', 'なん']
+
+# 品質評価基準
+QUALITY_CRITERIA = {
+    'hiragana_katakana_only': 25,      # ひらがな・カタカナのみ使用
+    'appropriate_length': 20,           # 適切な文字数
+    'clear_question': 20,              # 明確な問題文
+    'valid_choices': 20,               # 妥当な選択肢
+    'age_appropriate': 15              # 年齢に適した内容
+}
+
+# 文字種の判定（漢字・英字は不可、ひらがな・カタカナ・記号のみなら満点）
+FORBIDDEN_CHARACTERS = r'[a-zA-Z一-龯]'
+ALLOWED_CHARACTERS = r'あ-んア-ンー・（）「」？！。、\s'
+
+
+class CompiledQualityEvaluator:
+    """
+    品質基準をまとめて採点する評価器
+    
+    語彙・難しい概念・丁寧語・楽しい要素・疑問の表現の全キーワードを1つの接頭辞木の正規表現にまとめ、
+    問題文＋選択肢を1回走査して見つかった分類をビットで集める。基準ごとに「どれかのキーワードが
+    含まれるか」を何十回も調べる参照実装と違い、走査は先頭文字が一致する位置だけで行われる。
+    
+    同じ位置から始まる短いキーワードは長いキーワードの接頭辞なので、各キーワードにはその分類も
+    まとめて持たせ、次の探索は一致した位置の1文字後から始める（重なったキーワードも数える）。
+    文字種は「ひらがな・カタカナ・記号のみか」を1回照合し、そうでない場合だけ漢字・英字を探す。
+    """
+    
+    VOCABULARY = 1
+    COMPLEX = 2
+    POLITE = 4
+    FUN = 8
+    QUESTION = 16
+    AGE_FLAGS = VOCABULARY | COMPLEX | POLITE | FUN
+    
+    def __init__(self):
+        keyword_flags = {}
+        groups = [
+            ([word for words in GRADE1_VOCABULARY.values() for word in words], self.VOCABULARY),
+            (COMPLEX_CONCEPTS, self.COMPLEX),
+            (POLITE_WORDS, self.POLITE),
+            (FUN_ELEMENTS, self.FUN),
+            (QUESTION_MARKERS, self.QUESTION),
+        ]
+        for words, flag in groups:
+            for word in words:
+                keyword_flags[word] = keyword_flags.get(word, 0) | flag
+        
+        # キーワード → (接頭辞を含めた分類（疑問の表現を除く）, 接頭辞の疑問の表現で最も短いものの長さ)
+        self._keywords = {}
+        for word in keyword_flags:
+            flags, question_length = 0, 0
+            for prefix, prefix_flags in keyword_flags.items():
+                if not word.startswith(prefix):
+                    continue
+                flags |= prefix_flags & ~self.QUESTION
+                if prefix_flags & self.QUESTION and (not question_length or len(prefix) < question_length):
+                    question_length = len(prefix)
+            self._keywords[word] = (flags, question_length)
+        
+        # 年齢に適した内容の点数（語彙 +3、難しい概念なし +5、丁寧語 +4、楽しい要素 +3）を分類の組み合わせごとに用意する
+        self.age_scores = []
+        for flags in range(self.AGE_FLAGS + 1):
+            age_score = 0
+            if flags & self.VOCABULARY:
+                age_score += 3
+            if not flags & self.COMPLEX:
+                age_score += 5
+            if flags & self.POLITE:
+                age_score += 4
+            if flags & self.FUN:
+                age_score += 3
+            self.age_scores.append(min(age_score, QUALITY_CRITERIA['age_appropriate']))
+        
+        self._keyword_pattern = re.compile(_trie_pattern(keyword_flags))
+        self._allowed_pattern = re.compile(f'[{ALLOWED_CHARACTERS}]+')
+        self._forbidden_pattern = re.compile(FORBIDDEN_CHARACTERS)
+    
+    def scan(self, question: str, text: str) -> int:
+        """
+        問題文＋選択肢（text）のキーワードを走査し、見つかった分類のビットを返す
+        
+        疑問の表現（QUESTION）は問題文の中で完結しているものだけを数える。
+        """
+        keywords = self._keywords
+        search = self._keyword_pattern.search
+        question_end = len(question)
+        flags = 0
+        match = search(text)
+        while match:
+            start = match.start()
+            keyword_flags, question_length = keywords[match.group()]
+            flags |= keyword_flags
+            if question_length and start + question_length <= question_end:
+                flags |= self.QUESTION
+            match = search(text, start + 1)
+        return flags
+    
+    def character_check(self, text: str) -> Tuple[bool, bool]:
+        """(ひらがな・カタカナ・記号のみか, 漢字・英字を含むか)"""
+        if self._allowed_pattern.fullmatch(text):
+            return True, False
+        return False, self._forbidden_pattern.search(text) is not None
+    
+    def score(self, question_data: Dict) -> Dict[str, int]:
+        """基準ごとの点数（QuestionQualityChecker の参照実装と同じ結果）"""
+        question = question_data['question']
+        choices = question_data['choices']
+        text = question + ' '.join(choices)
+        flags = self.scan(question, text)
+        allowed_only, forbidden = self.character_check(text)
+        choice_lengths = list(map(len, choices))
+        valid_choice_lengths = min(choice_lengths) >= 1 and max(choice_lengths) <= 15
+        
+        # 1. ひらがな・カタカナのみ（空文字列は部分的な適合として扱う）
+        if forbidden:
+            hiragana_score = 0
+        elif allowed_only:
+            hiragana_score = QUALITY_CRITERIA['hiragana_katakana_only']
+        else:
+            hiragana_score = 10
+        
+        # 2. 適切な文字数
+        length_score = (10 if 10 <= len(question) <= 40 else 5) + (10 if valid_choice_lengths else 5)
+        
+        # 3. 明確な問題文（疑問の表現 + 答えが問題文に含まれていない）
+        clear_score = 10 if flags & self.QUESTION else 0
+        if choices[question_data['answer']].lower() not in question.lower():
+            clear_score += 10
+        
+        # 4. 妥当な選択肢
+        choices_score = 0
+        if len(choices) == 3:
+            choices_score += 5
+        if len(set(choices)) == len(choices):
+            choices_score += 5
+        if all(map(str.strip, choices)):
+            choices_score += 5
+        if valid_choice_lengths:
+            choices_score += 5
+        
+        return {
+            'hiragana_katakana_only': hiragana_score,
+            'appropriate_length': length_score,
+            'clear_question': clear_score,
+            'valid_choices': choices_score,
+            # 5. 年齢に適した内容
+            'age_appropriate': self.age_scores[flags & self.AGE_FLAGS],
+        }
+
+
+def _trie_pattern(words) -> str:
+    """
+    キーワードを接頭辞木の形の正規表現にする（例: おと, おとうさん → お(?:と(?:うさん)?)）
+    
+    各位置で全キーワードを順に試さずに済み、同じ位置では最長のキーワードに一致する。
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[''] = {}
+    
+    def build(node) -> str:
+        branches = [re.escape(character) + build(child) for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if '' in node:
+            return f'(?:{pattern})?'
+        return pattern
+    
+    return build(trie)
+
+
+# プロセス共通の評価器（正規表現のコンパイルは1回だけ）
+compiled_evaluator = CompiledQualityEvaluator()
+
 
 class QuestionQualityChecker:
     """問題の品質を自動評価するクラス"""
     
     def __init__(self):
         # 小学1年生に適した語彙リスト
-        self.grade1_vocabulary = {
-            'animals': ['いぬ', 'ねこ', 'とり', 'うし', 'ぶた', 'うま', 'ひつじ', 'やぎ'],
-            'colors': ['あか', 'あお', 'きいろ', 'みどり', 'しろ', 'くろ', 'ももいろ'],
-            'sounds': ['わんわん', 'にゃーにゃー', 'もーもー', 'ざあざあ', 'ぴかぴか'],
-            'opposites': ['おおきい', 'ちいさい', 'あつい', 'つめたい', 'うえ', 'した'],
-            'basic_words': ['がっこう', 'せんせい', 'おうち', 'おかあさん', 'おとうさん']
-        }
+        self.grade1_vocabulary = GRADE1_VOCABULARY
         
         # 品質評価基準
-        self.quality_criteria = {
-            'hiragana_katakana_only': 25,      # ひらがな・カタカナのみ使用
-            'appropriate_length': 20,           # 適切な文字数
-            'clear_question': 20,              # 明確な問題文
-            'valid_choices': 20,               # 妥当な選択肢
-            'age_appropriate': 15              # 年齢に適した内容
-        }
+        self.quality_criteria = QUALITY_CRITERIA
     
     def evaluate_question(self, question_data: Dict) -> Tuple[int, Dict]:
         """
@@ -37,23 +223,19 @@ class QuestionQualityChecker:
         Returns:
             (total_score, evaluation_details)
         """
-        scores = {}
-        
-        # 1. ひらがな・カタカナのみチェック
-        scores['hiragana_katakana_only'] = self._check_hiragana_katakana_only(question_data)
-        
-        # 2. 適切な文字数チェック
-        scores['appropriate_length'] = self._check_appropriate_length(question_data)
-        
-        # 3. 明確な問題文チェック
-        scores['clear_question'] = self._check_clear_question(question_data)
-        
-        # 4. 妥当な選択肢チェック
-        scores['valid_choices'] = self._check_valid_choices(question_data)
-        
-        # 5. 年齢に適した内容チェック
-        scores['age_appropriate'] = self._check_age_appropriate(question_data)
-        
+        return self._build_result(compiled_evaluator.score(question_data))
+    
+    def reference_scores(self, question_data: Dict) -> Dict[str, int]:
+        """参照実装（基準ごとに個別に判定する）による点数"""
+        return {
+            'hiragana_katakana_only': self._check_hiragana_katakana_only(question_data),
+            'appropriate_length': self._check_appropriate_length(question_data),
+            'clear_question': self._check_clear_question(question_data),
+            'valid_choices': self._check_valid_choices(question_data),
+            'age_appropriate': self._check_age_appropriate(question_data),
+        }
+    
+    def _build_result(self, scores: Dict[str, int]) -> Tuple[int, Dict]:
         total_score = sum(scores.values())
         
         evaluation_details = {
@@ -156,8 +338,7 @@ class QuestionQualityChecker:
                 break
         
         # 複雑すぎる概念が含まれていないかチェック
-        complex_concepts = ['分数', '割り算', '掛け算', '引き算', '足し算', '数学', '理科']
-        if not any(concept in text for concept in complex_concepts):
+        if not any(concept in text for concept in COMPLEX_CONCEPTS):
             score += 5
         
         # 適切な敬語・丁寧語が使われているかチェック
@@ -165,8 +346,7 @@ class QuestionQualityChecker:
             score += 4
         
         # 楽しい要素が含まれているかチェック
-        fun_elements = ['どうぶつ', 'おと', 'いろ', 'あそび', 'うた']
-        if any(element in text for element in fun_elements):
+        if any(element in text for element in FUN_ELEMENTS):
             score += 3
         
         return min(score, self.quality_criteria['age_appropriate'])
@@ -193,6 +373,10 @@ class QuestionQualityChecker:
         return recommendations
 
 
+# 一括評価で使う共通の評価インスタンス（状態を持たない）
+_batch_checker = QuestionQualityChecker()
+
+
 def batch_evaluate_questions(questions: List[Dict]) -> List[Dict]:
     """
     複数の問題を一括評価
@@ -203,7 +387,7 @@ def batch_evaluate_questions(questions: List[Dict]) -> List[Dict]:
     Returns:
         評価結果付きの問題リスト
     """
-    checker = QuestionQualityChecker()
+    checker = _batch_checker
     evaluated_questions = []
     
     for question in questions:
@@ -0,0 +1,145 @@
+"""
+問題プールの品質スコアの一括再計算（列指向）
+
+品質基準（quality_checker）を変えた後に、PreGeneratedQuestion の選択問題を全て採点し直す。
+行ごとに辞書を作って evaluate_question を呼ぶ代わりに、チャンク単位で問題文・選択肢を列として読み、
+文字列を見る処理（キーワード走査・文字種・答えが問題文に含まれるか）だけを行ごとに行って、
+長さの判定と点数の計算は列全体に対して NumPy のベクトル演算でまとめて行う
+（NumPy は requirements.txt に含める。無い環境でも動くよう、行ごとに CompiledQualityEvaluator.score で
+採点する処理を残しており、テストで両者の点数が一致することを確認している）。
+
+書き戻しは点数が変わった行だけを新しい点数ごとにまとめ、UPDATE ... WHERE id IN (...) で行う
+（点数は 0〜100 の限られた値のため、行ごとの CASE 式を作る bulk_update より文が小さい）。
+算数（数値入力）の問題は品質評価の対象外のため再計算しない。
+"""
+import time
+from collections import defaultdict
+from typing import Dict, List, Sequence
+
+from django.db import transaction
+
+from .models import PreGeneratedQuestion
+from .pool_snapshot import bump_pool_version, pool_snapshot_cache
+from .quality_checker import QUALITY_CRITERIA, compiled_evaluator
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無い環境では行ごとに採点する
+    np = None
+
+# 1回の UPDATE で更新する問題数
+UPDATE_CHUNK_SIZE = 1000
+
+
+def score_columns(questions: Sequence[str], choices_1: Sequence[str], choices_2: Sequence[str],
+                  choices_3: Sequence[str], answers: Sequence[int]) -> List[int]:
+    """
+    列（同じ長さのリスト）で渡した選択問題の品質スコアを返す
+
+    結果は QuestionQualityChecker.evaluate_question の合計点と同じ。
+    """
+    if np is None:
+        return [
+            sum(compiled_evaluator.score({'question': question, 'choices': list(choices), 'answer': answer}).values())
+            for question, answer, *choices in zip(questions, answers, choices_1, choices_2, choices_3)
+        ]
+
+    evaluator = compiled_evaluator
+    count = len(questions)
+    texts = [
+        f'{question}{choice_1} {choice_2} {choice_3}'
+        for question, choice_1, choice_2, choice_3 in zip(questions, choices_1, choices_2, choices_3)
+    ]
+
+    # 文字列を見る処理（行ごと）
+    flags = np.fromiter(map(evaluator.scan, questions, texts), dtype=np.int64, count=count)
+    characters = np.array(list(map(evaluator.character_check, texts)), dtype=bool).reshape(count, 2)
+    answer_in_question = np.fromiter(
+        (
+            (choice_1, choice_2, choice_3)[answer].lower() in question.lower()
+            for question, choice_1, choice_2, choice_3, answer in zip(questions, choices_1, choices_2, choices_3, answers)
+        ),
+        dtype=bool, count=count
+    )
+    distinct = np.fromiter(
+        (len({choice_1, choice_2, choice_3}) == 3 for choice_1, choice_2, choice_3 in zip(choices_1, choices_2, choices_3)),
+        dtype=bool, count=count
+    )
+    not_blank = np.ones(count, dtype=bool)
+    for choices in (choices_1, choices_2, choices_3):
+        not_blank &= np.fromiter(map(bool, map(str.strip, choices)), dtype=bool, count=count)
+
+    # 長さの判定と点数の計算（列全体）
+    question_lengths = np.fromiter(map(len, questions), dtype=np.int64, count=count)
+    choice_lengths = np.stack([
+        np.fromiter(map(len, choices), dtype=np.int64, count=count) for choices in (choices_1, choices_2, choices_3)
+    ])
+    valid_choice_lengths = (choice_lengths.min(axis=0) >= 1) & (choice_lengths.max(axis=0) <= 15)
+    allowed_only, forbidden = characters[:, 0], characters[:, 1]
+
+    hiragana_scores = np.where(forbidden, 0, np.where(allowed_only, QUALITY_CRITERIA['hiragana_katakana_only'], 10))
+    length_scores = (np.where((question_lengths >= 10) & (question_lengths <= 40), 10, 5)
+                     + np.where(valid_choice_lengths, 10, 5))
+    clear_scores = np.where(flags & evaluator.QUESTION, 10, 0) + np.where(answer_in_question, 0, 10)
+    choices_scores = 5 + 5 * distinct + 5 * not_blank + 5 * valid_choice_lengths
+    age_scores = np.asarray(evaluator.age_scores)[flags & evaluator.AGE_FLAGS]
+
+    return (hiragana_scores + length_scores + clear_scores + choices_scores + age_scores).tolist()
+
+
+def rescore_question_pool(chunk_size: int = None, dry_run: bool = False) -> Dict:
+    """
+    問題プールの選択問題を全て採点し直し、点数が変わった問題の品質スコアを更新する
+
+    Args:
+        chunk_size: 1回に読み込んで採点する問題数
+        dry_run: True の場合は採点だけ行い、DBを更新しない
+
+    Returns:
+        採点した問題数・点数が変わった問題数・処理時間
+    """
+    chunk_size = chunk_size or SPEED_OPTIMIZATION_CONFIG['QUALITY_RESCORE_CHUNK_SIZE']
+    started = time.perf_counter()
+    result = {'questions': 0, 'changed': 0, 'vectorized': np is not None}
+    queryset = PreGeneratedQuestion.objects.filter(
+        answer_format='multiple_choice', correct_answer__isnull=False
+    ).order_by('id')
+
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).values_list(
+            'id', 'question_text', 'choice_1', 'choice_2', 'choice_3', 'correct_answer', 'quality_score'
+        )[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        ids, questions, choices_1, choices_2, choices_3, answers, old_scores = zip(*rows)
+        scores = score_columns(questions, choices_1, choices_2, choices_3, answers)
+
+        ids_by_score = defaultdict(list)
+        for question_id, old_score, score in zip(ids, old_scores, scores):
+            if score != old_score:
+                ids_by_score[score].append(question_id)
+
+        if not dry_run:
+            with transaction.atomic():
+                for score, question_ids in ids_by_score.items():
+                    for start in range(0, len(question_ids), UPDATE_CHUNK_SIZE):
+                        PreGeneratedQuestion.objects.filter(
+                            id__in=question_ids[start:start + UPDATE_CHUNK_SIZE]
+                        ).update(quality_score=score)
+
+        result['questions'] += len(rows)
+        result['changed'] += sum(len(question_ids) for question_ids in ids_by_score.values())
+
+    # update() では保存シグナルが送られないため、スナップショットの読み直しをここで知らせる
+    if result['changed'] and not dry_run:
+        pool_snapshot_cache.invalidate()
+        transaction.on_commit(bump_pool_version)
+
+    elapsed = time.perf_counter() - started
+    result['elapsed_seconds'] = round(elapsed, 2)
+    result['questions_per_second'] = round(result['questions'] / elapsed) if elapsed > 0 else 0
+    return result
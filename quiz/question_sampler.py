@@ -0,0 +1,65 @@
+"""
+問題プールの重み付きランダム抽出
+
+使用回数が少ない（新しい）問題と品質スコアが高い問題ほど選ばれやすくする。
+Efraimidis–Spirakis 法（各候補に log(u) / 重み のキーを付けて上位 k 件を選ぶ）を使うため、
+候補全体を並べ替えずに O(n log k) で重複なく抽出できる。
+"""
+import heapq
+import math
+import random
+from typing import Container, List, Optional, Sequence, Tuple
+
+# 候補は (id, used_count, quality_score) のタプル
+Candidate = Tuple[int, int, int]
+
+
+def candidate_weight(used_count: int, quality_score: int, min_used_count: int) -> float:
+    """
+    候補の重み
+
+    最も使われていない問題を基準に、使用回数が1増えるごとに選ばれにくくする（鮮度）。
+    品質スコア（0-100）に比例して選ばれやすくする。
+    """
+    freshness = 1.0 / (1 + used_count - min_used_count)
+    quality = max(quality_score, 1) / 100
+    return freshness * quality
+
+
+def weighted_sample(candidates: Sequence[Candidate], count: int, rng: random.Random = None) -> List[int]:
+    """
+    候補から重み付きで count 件を重複なく選び、id のリストを返す
+
+    Args:
+        candidates: (id, used_count, quality_score) のリスト
+        count: 選ぶ件数
+        rng: 乱数生成器（省略時は random モジュール）
+    """
+    if count <= 0 or not candidates:
+        return []
+    rng = rng or random
+    min_used_count = min(used_count for _, used_count, _ in candidates)
+
+    def key(candidate: Candidate) -> float:
+        question_id, used_count, quality_score = candidate
+        # 1 - random() は (0, 1] のため log が定義できる
+        return math.log(1.0 - rng.random()) / candidate_weight(used_count, quality_score, min_used_count)
+
+    return [question_id for question_id, _, _ in heapq.nlargest(count, candidates, key=key)]
+
+
+def weighted_sample_unseen(candidates: Sequence[Candidate], count: int, seen: Optional[Container[int]] = None,
+                           rng: random.Random = None) -> List[int]:
+    """
+    ユーザーがまだ見ていない候補から優先して選ぶ
+
+    見ていない候補が足りない場合は、その全てに見た候補からの重み付き抽出を足す。
+    """
+    if seen is None:
+        return weighted_sample(candidates, count, rng)
+    unseen, already_seen = [], []
+    for candidate in candidates:
+        (already_seen if candidate[0] in seen else unseen).append(candidate)
+    if len(unseen) >= count:
+        return weighted_sample(unseen, count, rng)
+    return [question_id for question_id, _, _ in unseen] + weighted_sample(already_seen, count - len(unseen), rng)
@@ -0,0 +1,79 @@
+"""
+ストリーミング応答の問題ブロック分割
+
+モデルの応答は「問題N: ...」で始まり「正解: A」（算数は「答え: 5」）の行で終わるブロックの並び。
+届いた断片を順に渡すと、完成したブロックの本文（見出しを除いた部分）を返す。
+ブロックは次の見出しが届いた時か、答えの行が改行まで届いた時点で完成とみなすため、
+最後の問題以外も次の問題を待たずにパースできる。
+
+返すブロックの本文は re.split(r'問題\\d+:', content) で分割した場合と同じ行を含む
+（答えの行より後ろの余分な行は含まないが、パーサーはそれらを使わない）。
+"""
+import re
+from typing import List, Sequence
+
+HEADER_PATTERN = re.compile(r'問題\d+:')
+
+# 答えの行の書き出し（問題タイプごと。パーサーが答えとして読む行と同じ）
+ANSWER_PREFIXES = {
+    'language': ('正解:', '答え:'),
+    'math': ('答え:', 'こたえ:'),
+}
+
+# 見出しの途中で断片が切れた場合に残しておく文字数（「問題」+ 数字 + 「:」）
+_HEADER_TAIL = 8
+
+
+class QuestionStreamParser:
+    """
+    応答の断片から完成した問題ブロックを取り出す
+
+    Args:
+        answer_prefixes: 答えの行の書き出し（ANSWER_PREFIXES の値）
+    """
+
+    def __init__(self, answer_prefixes: Sequence[str]):
+        prefixes = '|'.join(re.escape(prefix) for prefix in answer_prefixes)
+        self._answer_pattern = re.compile(rf'^[ \t]*(?:{prefixes})[^\n]*\n', re.MULTILINE)
+        self._buffer = ''
+        self._in_block = False
+
+    def feed(self, text: str) -> List[str]:
+        """断片を追加し、完成したブロックを返す"""
+        self._buffer += text
+        blocks = []
+        while True:
+            if not self._in_block:
+                header = HEADER_PATTERN.search(self._buffer)
+                if header is None:
+                    # 見出しより前の文章は捨てる（見出しの途中で切れている分は残す）
+                    self._buffer = self._buffer[-_HEADER_TAIL:]
+                    break
+                self._buffer = self._buffer[header.end():]
+                self._in_block = True
+
+            header = HEADER_PATTERN.search(self._buffer)
+            # 最初の行は問題文のため、答えの行は2行目以降から探す
+            first_line_end = self._buffer.find('\n')
+            answer = None
+            if first_line_end >= 0:
+                answer = self._answer_pattern.search(self._buffer, first_line_end + 1)
+            if answer is not None and (header is None or answer.end() <= header.start()):
+                end = answer.end()
+            elif header is not None:
+                end = header.start()
+            else:
+                break
+            blocks.append(self._buffer[:end])
+            self._buffer = self._buffer[end:]
+            self._in_block = False
+        return blocks
+
+    def finish(self) -> List[str]:
+        """応答の終わりで、最後の（答えの行が改行で終わっていない）ブロックを返す"""
+        block, self._buffer = self._buffer, ''
+        if self._in_block and block.strip():
+            self._in_block = False
+            return [block]
+        self._in_block = False
+        return []
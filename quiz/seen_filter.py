@@ -0,0 +1,72 @@
+"""
+ユーザーが最近見た問題の判定（2世代のブルームフィルター）
+
+出題済みの問題（PreGeneratedQuestion の id）を固定サイズのビット列に記録する。
+現在の世代が容量に達したら1つ前の世代と入れ替えるため、どれだけ回答しても
+サイズは一定で、直近 容量〜容量×2 問程度が「見た問題」として扱われる。
+誤判定（見ていない問題を見たと判定する）は偽陽性率の分だけ起こるが、見た問題を
+見落とすことはない。
+"""
+import hashlib
+import math
+from typing import Iterable, Tuple
+
+
+def filter_size(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """容量と偽陽性率からビット数とハッシュ関数の数を求める"""
+    bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+    bits = (bits + 7) // 8 * 8
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class RollingBloomFilter:
+    """
+    現在と1つ前の2世代からなるブルームフィルター
+
+    Args:
+        capacity: 1世代に記録する問題数
+        error_rate: 1世代あたりの偽陽性率
+        current / previous: 保存済みのビット列（bytes）
+        current_count: 現在の世代に記録した問題数
+    """
+
+    def __init__(self, capacity: int, error_rate: float, current: bytes = b'', previous: bytes = b'',
+                 current_count: int = 0):
+        self.capacity = capacity
+        self.bits, self.hashes = filter_size(capacity, error_rate)
+        size = self.bits // 8
+        # 設定が変わってサイズが合わない場合は空から始める
+        self.current = bytearray(current) if len(current) == size else bytearray(size)
+        self.previous = bytearray(previous) if len(previous) == size else bytearray(size)
+        self.current_count = current_count if len(current) == size else 0
+
+    def _positions(self, question_id: int):
+        # 2つのハッシュ値の組み合わせで k 個の位置を作る（Kirsch–Mitzenmacher 法）
+        digest = hashlib.blake2b(str(question_id).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _test(bits: bytearray, positions) -> bool:
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def __contains__(self, question_id: int) -> bool:
+        positions = self._positions(question_id)
+        return self._test(self.current, positions) or self._test(self.previous, positions)
+
+    def add(self, question_id: int):
+        positions = self._positions(question_id)
+        if self._test(self.current, positions):
+            return
+        if self.current_count >= self.capacity:
+            self.previous, self.current = self.current, bytearray(len(self.current))
+            self.current_count = 0
+        for position in positions:
+            self.current[position >> 3] |= 1 << (position & 7)
+        self.current_count += 1
+
+    def update(self, question_ids: Iterable[int]):
+        for question_id in question_ids:
+            self.add(question_id)
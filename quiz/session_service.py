@@ -0,0 +1,239 @@
+"""
+クイズセッション作成サービス
+"""
+import asyncio
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import AsyncIterator, Iterator, List, Dict
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from .models import QuizSession, Question, UserSeenQuestions
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+# ストリーミング生成の残りの問題を受信・保存するスレッドプール（応答後も処理を続けるためリクエストとは独立）
+_executor = ThreadPoolExecutor(
+    max_workers=SPEED_OPTIMIZATION_CONFIG['STREAMING_SESSION_WORKERS'],
+    thread_name_prefix='quiz-stream'
+)
+
+# 実行中の残りの問題の保存（非同期版のタスクは参照を保持しないと途中で回収されるため）
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def drain_streaming(timeout: float = None) -> bool:
+    """実行中の残りの問題の保存（スレッド版）の完了を待つ（全て完了したら True）"""
+    with _pending_lock:
+        pending = list(_pending)
+    futures = [item for item in pending if not isinstance(item, asyncio.Task)]
+    _, not_done = wait(futures, timeout=timeout)
+    return not not_done
+
+
+def _close(questions):
+    """ジェネレーターなら閉じる（ストリーミング応答の受信を止める）"""
+    close = getattr(questions, 'close', None)
+    if close is not None:
+        close()
+
+
+class SessionBuilder:
+    """
+    セッション作成と問題の保存を1トランザクションで行うサービス
+
+    問題は bulk_create で一括INSERTするため、10問でもDBへの往復は
+    セッション作成と合わせて2回で済む。途中で失敗した場合は
+    ロールバックされ、問題の欠けたセッションは残らない。
+    問題プールから出題した問題は、同じトランザクションでユーザーの出題済み問題に記録する。
+    """
+
+    def __init__(self, user, question_type: str = 'language'):
+        self.user = user
+        self.question_type = question_type
+
+    def build(self, questions_data: List[Dict]) -> QuizSession:
+        """
+        セッションを作成し、問題を一括保存する
+
+        Args:
+            questions_data: 問題のリスト（QuizGeneratorService / PreGeneratedQuestionService の形式）
+
+        Returns:
+            作成したクイズセッション
+        """
+        with transaction.atomic():
+            session = QuizSession.objects.create(user=self.user)
+            Question.objects.bulk_create([
+                self._build_question(session, number, question_data)
+                for number, question_data in enumerate(questions_data, 1)
+            ])
+            UserSeenQuestions.record(
+                self.user, [question_data.get('pregenerated_id') for question_data in questions_data]
+            )
+        return session
+
+    def _build_question(self, session: QuizSession, number: int, question_data: Dict) -> Question:
+        """問題データから未保存の Question インスタンスを組み立てる"""
+        question = Question(
+            session=session,
+            text=question_data['question'],
+            question_number=number,
+            question_type=question_data.get('question_type', self.question_type),
+            answer_format=question_data.get('answer_format', 'multiple_choice'),
+            source_id=question_data.get('pregenerated_id')
+        )
+
+        if question.answer_format == 'numeric':
+            question.correct_value = question_data.get('correct_value')
+        else:
+            question.choices = question_data.get('choices', [])
+            question.correct_idx = question_data.get('answer', 0)
+
+        return question
+
+
+class StreamingSessionBuilder(SessionBuilder):
+    """
+    ストリーミング生成の問題でセッションを作成するサービス
+
+    最初の数問（STREAMING_FIRST_QUESTIONS）が届いた時点でセッションを作成して返し、
+    残りの問題は届き次第バックグラウンドで問題番号順に保存する。
+    ゲーム画面は問題一覧が揃うまで取得し直すため、回答中に残りの問題が追加されていく。
+    応答が途中で失敗したり問題数が足りなかった場合は、不足分を問題プール → フォールバック問題で
+    補い、セッションは必ず total 問になる（回答API・ゲーム画面は10問揃っている前提のため）。
+
+    Args:
+        fill: 不足分を返す関数 fill(不足数, 取得済みの問題文の集合)
+              （省略時は QuizGeneratorService._fill_shortage）
+    """
+
+    def __init__(self, user, question_type: str = 'language', first_count: int = None, fill=None):
+        super().__init__(user, question_type)
+        if first_count is None:
+            first_count = SPEED_OPTIMIZATION_CONFIG['STREAMING_FIRST_QUESTIONS']
+        self.first_count = max(first_count, 1)
+        self.fill = fill
+        # 残りの問題の保存（Future または asyncio.Task。テストで完了を待つため）
+        self.remaining = None
+
+    def build_streaming(self, questions: Iterator[Dict], total: int = 10) -> QuizSession:
+        """
+        最初の問題でセッションを作成し、残りの問題の保存をスレッドプールに任せる
+
+        Args:
+            questions: 問題を1問ずつ返すイテレーター（QuizGeneratorService.stream_questions）
+            total: セッションの問題数
+        """
+        questions = iter(questions)
+        count = min(self.first_count, total)
+        first = []
+        try:
+            first.extend(itertools.islice(questions, count))
+        except Exception as e:
+            print(f"ストリーミング問題の取得エラー: {e}")
+        try:
+            first.extend(self._fill_shortage(count - len(first), first))
+            session = self.build(first)
+        except Exception:
+            _close(questions)
+            raise
+        self.remaining = _executor.submit(self._append_remaining, session, questions, first, total)
+        self._track(self.remaining)
+        return session
+
+    async def abuild_streaming(self, questions: AsyncIterator[Dict], total: int = 10) -> QuizSession:
+        """build_streaming の非同期版（残りの問題はイベントループ上で受信し、保存はスレッドで行う）"""
+        count = min(self.first_count, total)
+        first = []
+        try:
+            if count > 0:
+                async for question_data in questions:
+                    first.append(question_data)
+                    if len(first) >= count:
+                        break
+        except Exception as e:
+            print(f"ストリーミング問題の取得エラー: {e}")
+        try:
+            if len(first) < count:
+                first.extend(await sync_to_async(self._fill_shortage)(count - len(first), first))
+            session = await sync_to_async(self.build)(first)
+        except Exception:
+            await questions.aclose()
+            raise
+        self.remaining = asyncio.ensure_future(self._aappend_remaining(session, questions, first, total))
+        self._track(self.remaining)
+        return session
+
+    def _append_remaining(self, session: QuizSession, questions: Iterator[Dict],
+                          saved_questions: List[Dict], total: int) -> int:
+        """残りの問題を届き次第保存し、不足分を補う（ワーカースレッドで実行）"""
+        saved = list(saved_questions)
+        try:
+            try:
+                for question_data in itertools.islice(questions, total - len(saved)):
+                    self._build_question(session, len(saved) + 1, question_data).save()
+                    saved.append(question_data)
+            except Exception as e:
+                print(f"ストリーミング問題の保存エラー（セッション {session.id}）: {e}")
+            finally:
+                # 途中で打ち切った場合も応答の受信を止める
+                _close(questions)
+            self._save_shortage(session, saved, total, len(saved_questions))
+        finally:
+            # ワーカースレッドのDB接続を残さない
+            connection.close()
+        return len(saved)
+
+    async def _aappend_remaining(self, session: QuizSession, questions: AsyncIterator[Dict],
+                                 saved_questions: List[Dict], total: int) -> int:
+        saved = list(saved_questions)
+        try:
+            if len(saved) < total:
+                async for question_data in questions:
+                    await sync_to_async(self._build_question(session, len(saved) + 1, question_data).save)()
+                    saved.append(question_data)
+                    if len(saved) >= total:
+                        break
+        except Exception as e:
+            print(f"ストリーミング問題の保存エラー（セッション {session.id}）: {e}")
+        finally:
+            await questions.aclose()
+        await sync_to_async(self._save_shortage)(session, saved, total, len(saved_questions))
+        return len(saved)
+
+    def _save_shortage(self, session: QuizSession, saved: List[Dict], total: int, recorded: int):
+        """不足分を補って保存し、問題プールから出題した問題を出題済みに記録する"""
+        shortage = self._fill_shortage(total - len(saved), saved)
+        if shortage:
+            print(f"ストリーミング問題の不足分を補います（セッション {session.id}）: {len(shortage)}問")
+            Question.objects.bulk_create([
+                self._build_question(session, number, question_data)
+                for number, question_data in enumerate(shortage, len(saved) + 1)
+            ])
+            saved.extend(shortage)
+        # 最初の問題（recorded 問）は build() で記録済み
+        UserSeenQuestions.record(
+            self.user, [question_data.get('pregenerated_id') for question_data in saved[recorded:]]
+        )
+        print(f"ストリーミング問題の保存完了（セッション {session.id}）: {len(saved)}/{total}問")
+
+    def _fill_shortage(self, shortage: int, saved: List[Dict]) -> List[Dict]:
+        if shortage <= 0:
+            return []
+        exclude = {question_data['question'] for question_data in saved}
+        if self.fill is not None:
+            return self.fill(shortage, exclude)[:shortage]
+        from .openai_service import get_quiz_generator
+        return get_quiz_generator()._fill_shortage(shortage, self.question_type, exclude)[:shortage]
+
+    @staticmethod
+    def _track(background):
+        with _pending_lock:
+            _pending.add(background)
+        background.add_done_callback(StreamingSessionBuilder._discard_pending)
+
+    @staticmethod
+    def _discard_pending(background):
+        with _pending_lock:
+            _pending.discard(background)
@@ -27,6 +27,68 @@ SPEED_OPTIMIZATION_CONFIG = {
     
     # 6. API応答時間制限
     'API_TIMEOUT': 15,  # 15秒でタイムアウト
+
+    # 7. クイズ開始時は問題プールのみを使用（OpenAIを待たない）
+    'START_FROM_POOL_ONLY': True,
+
+    # 8. 問題プールの補充設定（refill_question_pool コマンド）
+    'POOL_LOW_WATER_MARK': 30,      # カテゴリごとの最低在庫数
+    'POOL_REFILL_BATCH_SIZE': 10,   # 1回のAPI呼び出しで生成する問題数
+    'POOL_REFILL_MAX_BATCHES': 20,  # 1回の補充で行うAPI呼び出しの上限
+    'POOL_REFILL_INTERVAL': 300,    # ワーカーモードの補充間隔（秒）
+
+    # 9. 一括生成の並列数とレート制限（generate_and_store_questions）
+    'GENERATION_CONCURRENCY': 8,          # 同時API呼び出し数
+    'OPENAI_REQUESTS_PER_MINUTE': 500,    # RPM 上限
+    'OPENAI_TOKENS_PER_MINUTE': 200000,   # TPM 上限
+
+    # 10. ヘッジ生成（START_FROM_POOL_ONLY が False の場合のクイズ開始）
+    'HEDGED_GENERATION': True,     # 予算時間を過ぎたら問題プールで応答する
+    'HEDGE_BUDGET_SECONDS': 2.0,   # OpenAI の応答を待つ時間（秒）
+    'HEDGE_WORKERS': 8,            # 生成依頼と遅延分の保存を行うスレッド数
+
+    # 11. 生成応答のキャッシュ（同じプロンプトの応答を使い回す。期間は CACHE_DURATION）
+    'GENERATION_CACHE_BACKEND': 'memory',   # 'memory' / 'file' / 'django' / None（無効）
+    'GENERATION_CACHE_VARIANTS': 5,         # 1つのプロンプトに貯めて順番に使う応答の数
+    'GENERATION_CACHE_MAX_KEYS': 256,       # memory / file で保持するプロンプトの数（LRU）
+    'GENERATION_CACHE_DIR': None,           # file の保存先（None なら BASE_DIR/.generation_cache）
+    'GENERATION_CACHE_ALIAS': 'default',    # django で使う CACHES のエイリアス
+    'OPENAI_INPUT_COST_PER_1M_TOKENS': 0.15,   # 節約額の計算用（gpt-4o-mini, USD）
+    'OPENAI_OUTPUT_COST_PER_1M_TOKENS': 0.60,
+
+    # 12. OpenAI クライアントの接続プール（プロセス共通のクライアントで使用）
+    'OPENAI_MAX_CONNECTIONS': 100,            # 同時接続数の上限
+    'OPENAI_MAX_KEEPALIVE_CONNECTIONS': 20,   # 使い回すために残しておく接続数
+    'OPENAI_KEEPALIVE_EXPIRY': 30,            # 使われていない接続を閉じるまでの秒数
+    'OPENAI_HTTP2': True,                     # h2 がインストールされていれば HTTP/2 を使う
+
+    # 13. 問題プールのプロセス内スナップショット（get_random_questions）
+    'POOL_SNAPSHOT': True,                       # メモリ上の問題プールから出題する
+    'POOL_SNAPSHOT_TTL': 300,                    # 変更が無くても読み直す間隔（秒）
+    'POOL_SNAPSHOT_VERSION_CHECK_INTERVAL': 5,   # 他プロセスでの変更を確認する間隔（秒）
+    'POOL_USAGE_FLUSH_INTERVAL': 10,             # 使用回数をDBへ書き戻す間隔（秒）
+    'POOL_USAGE_FLUSH_BATCH': 500,               # 書き戻し待ちがこの問題数に達したら即時に書き戻す
+    'POOL_SAMPLING_CANDIDATES': 500,             # スナップショット未使用時にDBから読む候補数（使用回数の少ない順）
+
+    # 14. ユーザーごとの出題済み問題（見た問題を優先的に除外する）
+    'SEEN_FILTER_CAPACITY': 2000,     # 1世代に記録する問題数（直近 2000〜4000問を除外）
+    'SEEN_FILTER_ERROR_RATE': 0.01,   # 見ていない問題を見たと誤判定する割合（約2.4KB/世代）
+
+    # 15. 問題プールの回答数・正解数の差分集計（aggregate_question_stats コマンド）
+    'ANSWER_STATS_BATCH_SIZE': 10000,   # 1トランザクションで集計する回答IDの範囲
+    'ANSWER_STATS_INTERVAL': 60,        # ワーカーモードの集計間隔（秒）
+    'ANSWER_STATS_COMMIT_LAG': 10,      # 観測した最大の回答IDを集計に使うまでの時間（秒。回答の保存より十分長く）
+
+    # 16. 品質スコアの一括再計算（rescore_question_pool コマンド）
+    'QUALITY_RESCORE_CHUNK_SIZE': 20000,  # 1回に読み込んで採点する問題数
+
+    # 17. ひらがな化（pykakasi）の結果のキャッシュ
+    'HIRAGANA_CACHE_SIZE': 10000,       # プロセス内に保持する変換結果の件数
+
+    # 18. ストリーミング生成（START_FROM_POOL_ONLY が False の場合のクイズ開始。HEDGED_GENERATION より優先）
+    'STREAMING_GENERATION': False,      # 最初の問題が届いた時点でセッションを作成して応答する
+    'STREAMING_FIRST_QUESTIONS': 1,     # 応答前に保存する問題数（残りは届き次第バックグラウンドで保存）
+    'STREAMING_SESSION_WORKERS': 8,     # 残りの問題を受信・保存するスレッド数
 }
 
 # 実装提案：
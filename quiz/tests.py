@@ -1,3 +1,1176 @@
-from django.test import TestCase
-
-# Create your tests here.
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    Answer, PoolVersion, PreGeneratedQuestion, Question, QuizSession, StatsWatermark, UserQuizStats,
+    UserSeenQuestions
+)
+from .fake_openai_server import FakeOpenAIServer
+from .answer_stats import aggregate_answer_stats
+from .generation_cache import FileCacheBackend, GenerationCache, MemoryCacheBackend
+from .generation_engine import GenerationEngine, RateLimiter
+from .generation_planner import GenerationPlanner, YieldTracker
+from .hedged_generation import HedgedGenerator, drain_background
+from .management.commands.bench_import_time import STAGE_SCRIPTS, run_importtime
+from .management.commands.bench_quality_checker import build_corpus
+from .openai_client import get_async_openai_client, get_openai_client, reset_clients
+from .openai_service import HiraganaCache, QuizGeneratorService, _to_hiragana, get_quiz_generator, to_hiragana_batch
+from .pre_generated_service import PreGeneratedQuestionService
+from . import pool_snapshot, quality_rescore
+from .quality_checker import QuestionQualityChecker
+from .quality_rescore import rescore_question_pool, score_columns
+from .pool_snapshot import batched_pool_changes, bump_pool_version, pool_snapshot_cache
+from .question_stream import ANSWER_PREFIXES, QuestionStreamParser
+from .question_sampler import weighted_sample
+from .seen_filter import RollingBloomFilter
+from .session_service import SessionBuilder, StreamingSessionBuilder
+from .warmup import warm_up
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+from .views import (
+    session_questions_api, start_quiz_api, start_quiz_async_api, submit_answer_api, submit_answers_batch_api
+)
+
+
+def create_pool_question(number, **kwargs):
+    defaults = {
+        'question_text': f'もんだい{number} は どれでしょう？',
+        'choice_1': 'いぬ',
+        'choice_2': 'ねこ',
+        'choice_3': 'とり',
+        'correct_answer': 0,
+        'quality_score': 90,
+        'category': 'animals',
+    }
+    defaults.update(kwargs)
+    return PreGeneratedQuestion.objects.create(**defaults)
+
+
+@override_settings(OPENAI_API_KEY='test-key')
+class QuestionPoolTests(TestCase):
+    """問題プールからの出題と補充対象の判定"""
+
+    def test_pool_questions_never_call_openai(self):
+        for number in range(12):
+            create_pool_question(number)
+
+        with mock.patch.object(QuizGeneratorService, '_generate_ai_questions') as generate:
+            questions = PreGeneratedQuestionService().get_pool_questions(10)
+
+        generate.assert_not_called()
+        self.assertEqual(len(questions), 10)
+        self.assertEqual(len({q['question'] for q in questions}), 10)
+
+    def test_pool_shortage_is_filled_with_fallback_questions(self):
+        for number in range(3):
+            create_pool_question(number)
+
+        with mock.patch.object(QuizGeneratorService, '_generate_ai_questions') as generate:
+            questions = PreGeneratedQuestionService().get_pool_questions(10)
+
+        generate.assert_not_called()
+        self.assertEqual(len(questions), 10)
+
+    def tearDown(self):
+        pool_snapshot_cache.flush_usage()
+
+    @mock.patch.dict(SPEED_OPTIMIZATION_CONFIG, {'POOL_SNAPSHOT': False})
+    def test_random_questions_use_two_selects_and_one_bulk_update(self):
+        for number in range(12):
+            create_pool_question(number, used_count=number % 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            questions = PreGeneratedQuestionService().get_random_questions(5)
+
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual(statements, ['SELECT', 'SELECT', 'UPDATE'])
+        self.assertEqual(len({q['question'] for q in questions}), 5)
+        self.assertEqual(sum(PreGeneratedQuestion.objects.values_list('used_count', flat=True)), 12 + 5)
+
+    @mock.patch.dict(SPEED_OPTIMIZATION_CONFIG, {'POOL_SNAPSHOT': False, 'POOL_SAMPLING_CANDIDATES': 4})
+    def test_random_questions_read_limited_high_quality_candidates(self):
+        least_used = {create_pool_question(number, used_count=0).question_text for number in range(4)}
+        for number in range(4, 12):
+            create_pool_question(number, used_count=5)
+        create_pool_question(20, used_count=0, quality_score=10)
+
+        with CaptureQueriesContext(connection) as queries:
+            questions = PreGeneratedQuestionService().get_random_questions(3)
+
+        candidate_sql = queries.captured_queries[0]['sql']
+        self.assertIn('"quality_score" >= 70', candidate_sql)
+        self.assertIn('LIMIT 4', candidate_sql)
+        self.assertLessEqual({q['question'] for q in questions}, least_used)
+
+    def test_weighted_sample_prefers_fresh_high_quality_questions(self):
+        rng = random.Random(0)
+        candidates = [(1, 0, 90), (2, 5, 90), (3, 0, 20)]
+        picks = Counter(weighted_sample(candidates, 1, rng)[0] for _ in range(2000))
+
+        self.assertGreater(picks[1], picks[2] * 3)
+        self.assertGreater(picks[1], picks[3] * 3)
+        self.assertEqual(sorted(weighted_sample(candidates, 5, rng)), [1, 2, 3])
+
+    def test_snapshot_serves_questions_without_queries_and_flushes_usage(self):
+        for number in range(12):
+            create_pool_question(number)
+        create_pool_question(50, is_active=False)
+        pool_snapshot_cache.get()
+
+        with CaptureQueriesContext(connection) as queries:
+            questions = PreGeneratedQuestionService().get_random_questions(5)
+
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(len({q['question'] for q in questions}), 5)
+        self.assertEqual(questions[0]['choices'], ['いぬ', 'ねこ', 'とり'])
+        self.assertEqual(pool_snapshot_cache.stats()['questions'], 12)
+        self.assertGreater(pool_snapshot_cache.stats()['memory_bytes'], 0)
+
+        self.assertEqual(pool_snapshot_cache.flush_usage(), 5)
+        self.assertEqual(sum(PreGeneratedQuestion.objects.values_list('used_count', flat=True)), 5)
+
+    def test_snapshot_reloads_after_pool_changes(self):
+        create_pool_question(1)
+        self.assertEqual(len(pool_snapshot_cache.get()), 1)
+
+        create_pool_question(2, question_type='math', answer_format='numeric', correct_value=3)
+
+        self.assertEqual(len(pool_snapshot_cache.get()), 2)
+        self.assertEqual(
+            PreGeneratedQuestionService().get_random_questions(1, question_type='math')[0]['correct_value'], 3
+        )
+
+    def test_snapshot_reloads_after_another_process_bumps_version(self):
+        create_pool_question(1)
+        self.assertEqual(len(pool_snapshot_cache.get()), 1)
+
+        # 別プロセスでの追加（このプロセスのシグナルは届かず、DBのバージョン番号だけが変わる）
+        PreGeneratedQuestion.objects.bulk_create([
+            PreGeneratedQuestion(question_text='べつの もんだい', choice_1='あ', choice_2='い', choice_3='う',
+                                 correct_answer=0, quality_score=90, category='animals')
+        ])
+        bump_pool_version()
+
+        with mock.patch.dict(SPEED_OPTIMIZATION_CONFIG, {'POOL_SNAPSHOT_VERSION_CHECK_INTERVAL': 0}):
+            self.assertEqual(len(pool_snapshot_cache.get()), 2)
+
+    def test_refill_bumps_pool_version_once_per_batch(self):
+        candidates = [
+            {'question': f'ほじゅう {number} は どれ？', 'choices': ['いぬ', 'ねこ', 'とり'], 'answer': 0,
+             'quality_score': 90, 'category': 'animals'}
+            for number in range(3)
+        ]
+
+        with mock.patch.object(PreGeneratedQuestionService, '_generate_pool_batch', return_value=candidates), \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            result = PreGeneratedQuestionService().refill_pool(max_batches=1)
+
+        self.assertEqual(result['saved_to_db'], 3)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(PoolVersion.objects.get(pk=1).version, 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with batched_pool_changes():
+                with batched_pool_changes():
+                    create_pool_question(10)
+                create_pool_question(11)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_snapshot_is_kept_when_version_check_fails(self):
+        create_pool_question(1)
+        PoolVersion.objects.create(pk=1, version=5)
+        snapshot = pool_snapshot_cache.get()
+        self.assertEqual(snapshot.version, 5)
+
+        with mock.patch.object(pool_snapshot, 'PoolVersion') as pool_version, \
+                mock.patch.dict(SPEED_OPTIMIZATION_CONFIG, {'POOL_SNAPSHOT_VERSION_CHECK_INTERVAL': 0}):
+            pool_version.objects.filter.side_effect = RuntimeError('db unavailable')
+            self.assertIs(pool_snapshot_cache.get(), snapshot)
+
+    def test_start_prefers_questions_the_user_has_not_seen(self):
+        user = get_user_model().objects.create_user(username='repeat-player')
+        for number in range(20):
+            create_pool_question(number)
+        factory = RequestFactory()
+        seen_texts = []
+
+        for _ in range(2):
+            request = factory.post('/quiz/api/start/', data=json.dumps({}), content_type='application/json')
+            request.user = user
+            session_id = json.loads(start_quiz_api(request).content)['session_id']
+            seen_texts.append(set(Question.objects.filter(session_id=session_id).values_list('text', flat=True)))
+            QuizSession.objects.filter(id=session_id).update(is_completed=True)
+
+        self.assertEqual(len(seen_texts[0] | seen_texts[1]), 20)
+        self.assertEqual(UserSeenQuestions.objects.get(user=user).current_count, 20)
+
+    def test_seen_filter_rolls_over_at_capacity(self):
+        seen = RollingBloomFilter(capacity=100, error_rate=0.01)
+        seen.update(range(100))
+        self.assertTrue(all(question_id in seen for question_id in range(100)))
+
+        seen.update(range(100, 300))
+
+        self.assertNotIn(0, seen)
+        self.assertIn(299, seen)
+        self.assertLess(sum(question_id in seen for question_id in range(1000, 2000)), 50)
+        self.assertLess(len(seen.current) + len(seen.previous), 300)
+
+    def test_pool_deficits_per_category(self):
+        for number in range(5):
+            create_pool_question(number, category='animals')
+        create_pool_question(99, category='colors', quality_score=10)
+
+        deficits = PreGeneratedQuestionService().get_pool_deficits('language', low_water_mark=4)
+
+        self.assertEqual(deficits['animals'], 0)
+        self.assertEqual(deficits['colors'], 4)
+
+
+class SessionBuilderTests(TestCase):
+    """セッション作成と問題の一括保存"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='builder')
+        self.questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+
+    def test_build_bulk_inserts_all_questions(self):
+        # SAVEPOINT + セッションINSERT + 問題の一括INSERT + RELEASE
+        with self.assertNumQueries(4):
+            session = SessionBuilder(self.user).build(self.questions_data)
+
+        numbers = list(session.questions.values_list('question_number', flat=True))
+        self.assertEqual(numbers, list(range(1, 11)))
+
+    def test_build_rolls_back_on_failure(self):
+        broken = self.questions_data[:5] + [{'choices': ['いぬ', 'ねこ', 'とり']}]
+
+        with self.assertRaises(KeyError):
+            SessionBuilder(self.user).build(broken)
+
+        self.assertFalse(QuizSession.objects.filter(user=self.user).exists())
+
+
+class SubmitAnswerQueryBudgetTests(TransactionTestCase):
+    """
+    回答送信APIのクエリ予算
+
+    本番と同じ autocommit 状態で計測するため TransactionTestCase を使う
+    （TestCase ではテスト全体のトランザクション内でセーブポイントのSQLが加算される）。
+    件数は submit_answer_api の docstring の予算（BEGIN/COMMIT を含む）に合わせる。
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='answerer')
+        questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+        self.session = SessionBuilder(self.user).build(questions_data)
+        self.factory = RequestFactory()
+
+    def submit(self, question_number, selected_idx=0):
+        request = self.factory.post(
+            '/quiz/api/answer/',
+            data=json.dumps({
+                'session_id': self.session.id,
+                'question_number': question_number,
+                'selected_idx': selected_idx,
+            }),
+            content_type='application/json'
+        )
+        request.user = self.user
+        return submit_answer_api(request)
+
+    def test_answer_uses_select_insert_and_counter_update(self):
+        # SELECT, BEGIN, INSERT, UPDATE, COMMIT
+        with self.assertNumQueries(5):
+            response = self.submit(1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content)['is_correct'])
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.answered_count, self.session.score), (1, 1))
+
+    def test_duplicate_answer_is_rejected_by_unique_constraint(self):
+        self.submit(1)
+
+        # SELECT, BEGIN, INSERT（一意制約違反）, ROLLBACK
+        with self.assertNumQueries(4):
+            response = self.submit(1, selected_idx=1)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Answer.objects.filter(question__session=self.session).count(), 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.answered_count, 1)
+
+    def test_other_users_session_is_not_found(self):
+        other = get_user_model().objects.create_user(username='other')
+        request = self.factory.post(
+            '/quiz/api/answer/',
+            data=json.dumps({'session_id': self.session.id, 'question_number': 1, 'selected_idx': 0}),
+            content_type='application/json'
+        )
+        request.user = other
+
+        response = submit_answer_api(request)
+
+        self.assertEqual(response.status_code, 404)
+
+
+class SessionQuestionsApiTests(TestCase):
+    """ゲーム画面用の全問題取得API"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='player')
+        questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+        self.session = SessionBuilder(self.user).build(questions_data)
+        self.factory = RequestFactory()
+
+    def get(self, user):
+        request = self.factory.get(f'/quiz/api/session/{self.session.id}/questions/')
+        request.user = user
+        return session_questions_api(request, self.session.id)
+
+    def test_returns_all_questions_without_answers_in_one_query(self):
+        Answer.objects.create(question=self.session.questions.get(question_number=1), selected_idx=0)
+
+        with self.assertNumQueries(1):
+            response = self.get(self.user)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(data['answered'], [1])
+        self.assertNotIn('answer', data['questions'][0])
+        self.assertNotIn('correct_idx', data['questions'][0])
+
+    def test_other_users_session_is_not_found(self):
+        other = get_user_model().objects.create_user(username='other')
+
+        response = self.get(other)
+
+        self.assertEqual(response.status_code, 404)
+
+
+class SubmitAnswersBatchApiTests(TestCase):
+    """オフライン中にためた回答の一括送信"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='offline')
+        questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+        self.session = SessionBuilder(self.user).build(questions_data)
+        self.factory = RequestFactory()
+
+    def post(self, answers, finish=False):
+        request = self.factory.post(
+            '/quiz/api/answer/batch/',
+            data=json.dumps({'session_id': self.session.id, 'answers': answers, 'finish': finish}),
+            content_type='application/json'
+        )
+        request.user = self.user
+        return json.loads(submit_answers_batch_api(request).content)
+
+    def test_retry_is_idempotent(self):
+        answers = [
+            {'question_number': 1, 'selected_idx': 0, 'answered_at': '2000-01-01T00:00:00Z'},
+            {'question_number': 2, 'selected_idx': 1},
+        ]
+
+        first = self.post(answers)
+        retry = self.post(answers)
+
+        self.assertEqual(first['saved_count'], 2)
+        self.assertEqual(retry['saved_count'], 0)
+        self.assertEqual([r['status'] for r in retry['results']], ['duplicate', 'duplicate'])
+        self.assertEqual([r['is_correct'] for r in retry['results']], [True, False])
+        self.assertEqual(Answer.objects.filter(question__session=self.session).count(), 2)
+        # セッション開始前の回答日時は開始日時に丸められる
+        answer = Answer.objects.get(question__session=self.session, question__question_number=1)
+        self.assertEqual(answer.answered_at, self.session.started_at)
+
+    def test_finish_in_same_request(self):
+        answers = [{'question_number': number, 'selected_idx': 0} for number in range(1, 11)]
+
+        data = self.post(answers, finish=True)
+
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.is_completed)
+        self.assertEqual(data['final_score'], 10)
+
+    def test_recount_after_finish_keeps_final_score(self):
+        # 一括送信の読み込み後に、別のリクエストがセッションを終了した場合
+        stale = QuizSession.objects.get(pk=self.session.pk)
+        self.session.finish_session()
+        question = self.session.questions.get(question_number=1)
+        Answer.objects.bulk_create([Answer(question=question, selected_idx=question.correct_idx, is_correct=True)])
+
+        self.assertEqual(stale.calculate_score(), 0)
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.score, self.session.answered_count), (0, 0))
+
+
+class UserQuizStatsTests(TestCase):
+    """ユーザー統計の差分更新と再集計"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='stats')
+
+    def finish(self, correct_count):
+        questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+        session = SessionBuilder(self.user).build(questions_data)
+        for question in session.questions.all():
+            Answer.objects.create(
+                question=question,
+                selected_idx=0 if question.question_number <= correct_count else 1
+            )
+        session.finish_session()
+        return session
+
+    def test_finish_session_updates_stats_incrementally(self):
+        self.finish(7)
+        self.finish(9)
+
+        stats = UserQuizStats.objects.get(user=self.user)
+        self.assertEqual(stats.total_sessions, 2)
+        self.assertEqual(stats.total_score, 16)
+        self.assertEqual(stats.best_score, 9)
+        self.assertEqual(stats.total_points, 160)
+        self.assertEqual(stats.current_month_sessions(), 2)
+        self.assertEqual(stats.current_week_average(), 8)
+
+    def test_period_buckets_restart_in_a_new_week(self):
+        self.finish(5)
+        stats = UserQuizStats.objects.get(user=self.user)
+
+        next_week = timezone.localdate() + timedelta(days=7)
+
+        self.assertEqual(stats.current_week_average(next_week), 0)
+
+    def test_backfill_matches_incremental_stats(self):
+        self.finish(3)
+        self.finish(10)
+        expected = UserQuizStats.objects.values().get(user=self.user)
+        UserQuizStats.objects.all().delete()
+
+        call_command('backfill_quiz_stats', stdout=StringIO())
+
+        actual = UserQuizStats.objects.values().get(user=self.user)
+        for field in ['total_sessions', 'total_score', 'total_points', 'best_score',
+                      'month_sessions', 'month_score', 'week_sessions', 'week_score']:
+            self.assertEqual(actual[field], expected[field], field)
+
+
+class FinishSessionTests(TestCase):
+    """セッション終了処理の二重実行防止（同じセッションを2回終了しても報酬は1回）"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='finisher')
+        questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+        self.session = SessionBuilder(self.user).build(questions_data)
+        for question in self.session.questions.all():
+            Answer.objects.create(question=question, selected_idx=0)
+
+    def test_double_finish_from_stale_instances_awards_points_once(self):
+        # 2つのタブが同じセッションを未完了の状態で読み込み、順に終了する
+        # （同時実行ではなく、2回目の終了が条件付きUPDATEで何もしないことを確認する）
+        first = QuizSession.objects.get(pk=self.session.pk)
+        second = QuizSession.objects.get(pk=self.session.pk)
+
+        result = first.finish_session()
+        duplicate = second.finish_session()
+
+        self.user.refresh_from_db()
+        self.assertEqual(result['points_earned'], 100)
+        self.assertEqual(duplicate, {'score': 10})
+        self.assertEqual(self.user.points_total, 100)
+        self.assertEqual(self.user.perfect_scores, 1)
+        self.assertEqual(self.user.badges_earned.count('perfect_score'), 1)
+        self.assertEqual(UserQuizStats.objects.get(user=self.user).total_sessions, 1)
+
+    def test_finish_keeps_points_from_other_sessions(self):
+        # 古いユーザーインスタンスを持ったまま、別セッションでポイントが加算される
+        stale_session = QuizSession.objects.select_related('user').get(pk=self.session.pk)
+        get_user_model().objects.filter(pk=self.user.pk).update(points_total=50)
+
+        stale_session.finish_session()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points_total, 150)
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite のテストDBは同時書き込みでロックエラーになるため、行ロックのあるDBで実行する')
+class ConcurrentFinishSessionTests(TransactionTestCase):
+    """別々の接続から同じセッションを同時に終了しても、報酬は1回だけ付与される"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='racer')
+        questions_data = QuizGeneratorService._get_fallback_questions(None, 10)
+        self.session = SessionBuilder(self.user).build(questions_data)
+        for question in self.session.questions.all():
+            Answer.objects.create(question=question, selected_idx=0)
+
+    def test_concurrent_finish_awards_points_once(self):
+        barrier = threading.Barrier(2)
+        results, errors = [], []
+
+        def finish():
+            try:
+                # 各スレッドは自分の接続で、未完了の状態のセッションを読み込んでから同時に終了する
+                session = QuizSession.objects.get(pk=self.session.pk)
+                barrier.wait()
+                results.append(session.finish_session())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=finish) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted('points_earned' in result for result in results), [False, True])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points_total, 100)
+        self.assertEqual(self.user.perfect_scores, 1)
+        self.assertEqual(self.user.badges_earned.count('perfect_score'), 1)
+        stats = UserQuizStats.objects.get(user=self.user)
+        self.assertEqual((stats.total_sessions, stats.total_points), (1, 100))
+
+
+@mock.patch.dict(SPEED_OPTIMIZATION_CONFIG, {'ANSWER_STATS_COMMIT_LAG': 0})
+class QuestionSourceStatsTests(TestCase):
+    """出題元の事前生成問題への紐づけと正答率の集計"""
+
+    def build_session(self, username, pool_questions):
+        user = get_user_model().objects.create_user(username=username)
+        session = SessionBuilder(user).build([question.to_dict() for question in pool_questions])
+        return list(session.questions.order_by('question_number'))
+
+    def test_aggregation_counts_answers_per_source_question(self):
+        first, second = create_pool_question(1), create_pool_question(2)
+        questions = self.build_session('source-stats', [first, second])
+        self.assertEqual([q.source_id for q in questions], [first.id, second.id])
+        Answer.objects.create(question=questions[0], selected_idx=0)
+        Answer.objects.create(question=questions[1], selected_idx=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = aggregate_answer_stats(batch_size=1000)
+
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual(statements.count('UPDATE'), 2)  # 件数の加算 + 処理済み位置
+        self.assertEqual((result['answers'], result['questions']), (2, 2))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.attempt_count, first.correct_count, first.correct_rate), (1, 1, 1.0))
+        self.assertEqual((second.attempt_count, second.correct_count, second.correct_rate), (1, 0, 0.0))
+
+    def test_aggregation_only_reads_answers_after_watermark(self):
+        pool_question = create_pool_question(1)
+        first_session = self.build_session('first-player', [pool_question])
+        Answer.objects.create(question=first_session[0], selected_idx=0)
+        aggregate_answer_stats(batch_size=1)
+
+        second_session = self.build_session('second-player', [pool_question])
+        Answer.objects.create(question=second_session[0], selected_idx=2)
+        result = aggregate_answer_stats(batch_size=1)
+
+        pool_question.refresh_from_db()
+        self.assertEqual(result['answers'], 1)
+        self.assertEqual((pool_question.attempt_count, pool_question.correct_count), (2, 1))
+        self.assertEqual(pool_question.correct_rate, 0.5)
+        self.assertEqual(aggregate_answer_stats()['answers'], 0)
+
+    def test_backfill_links_only_questions_with_matching_content(self):
+        pool_question = create_pool_question(1)
+        session = QuizSession.objects.create(user=get_user_model().objects.create_user(username='legacy'))
+        same = Question.objects.create(
+            session=session, text=pool_question.question_text, question_number=1,
+            choices=['いぬ', 'ねこ', 'とり'], correct_idx=0
+        )
+        other_choices = Question.objects.create(
+            session=session, text=pool_question.question_text, question_number=2,
+            choices=['あか', 'あお', 'きいろ'], correct_idx=0
+        )
+        out = StringIO()
+
+        call_command('backfill_question_sources', batch_size=1, stdout=out)
+
+        same.refresh_from_db()
+        other_choices.refresh_from_db()
+        self.assertEqual(same.source_id, pool_question.id)
+        self.assertIsNone(other_choices.source_id)
+        self.assertIn('照合: 2問 / 紐づけ: 1問', out.getvalue())
+
+    @mock.patch.dict(SPEED_OPTIMIZATION_CONFIG, {'ANSWER_STATS_COMMIT_LAG': 10})
+    def test_answer_committed_below_observed_id_is_not_skipped(self):
+        pool_question = create_pool_question(1)
+        questions = [self.build_session(f'late-{i}', [pool_question])[0] for i in range(3)]
+        first = Answer.objects.create(question=questions[0], selected_idx=0)
+        Answer.objects.create(id=first.id + 2, question=questions[2], selected_idx=0)
+
+        # 観測したばかりの最大の id はまだ使わない
+        self.assertEqual(aggregate_answer_stats()['answers'], 0)
+        # 観測より前に id を割り当てられた回答が、観測の後でコミットされる
+        Answer.objects.create(id=first.id + 1, question=questions[1], selected_idx=1)
+        StatsWatermark.objects.update(observed_at=timezone.now() - timedelta(seconds=60))
+
+        result = aggregate_answer_stats()
+
+        pool_question.refresh_from_db()
+        self.assertEqual(result['answers'], 3)
+        self.assertEqual(result['last_id'], first.id + 2)
+        self.assertEqual((pool_question.attempt_count, pool_question.correct_count), (3, 2))
+
+
+class AsyncGenerationTests(TestCase):
+    """非同期クライアントによる問題生成と非同期の開始API"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake_server = FakeOpenAIServer(delay=0)
+        cls.base_url = cls.fake_server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake_server.stop()
+        super().tearDownClass()
+
+    async def test_agenerate_questions_uses_async_client(self):
+        with override_settings(OPENAI_BASE_URL=self.base_url, OPENAI_API_KEY='sk-test'):
+            service = QuizGeneratorService()
+            language = await service.agenerate_questions(5, use_pregenerated=False)
+            math = await service.agenerate_questions(3, question_type='math')
+
+        self.assertEqual(len(language), 5)
+        self.assertEqual(len(language[0]['choices']), 3)
+        self.assertEqual([q['answer_format'] for q in math], ['numeric'] * 3)
+
+    @override_settings(OPENAI_API_KEY='sk-test')
+    async def test_start_async_api_creates_session(self):
+        user = await get_user_model().objects.acreate(username='async-starter')
+        request = AsyncRequestFactory().post(
+            '/quiz/api/start/async/',
+            data=json.dumps({'question_type': 'language'}),
+            content_type='application/json'
+        )
+        request.user = user
+
+        response = await start_quiz_async_api(request)
+
+        data = json.loads(response.content)
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(await Question.objects.filter(session_id=data['session_id']).acount(), 10)
+
+
+class GenerationEngineTests(TestCase):
+    """並列生成エンジンとレート制限"""
+
+    def test_engine_streams_batches_until_target(self):
+        received = []
+
+        def generate(size):
+            return [{'question': f'もんだい{len(received)}-{i}'} for i in range(size)]
+
+        def accept_half(questions):
+            received.append(len(questions))
+            return len(questions) // 2
+
+        stats = GenerationEngine(generate, concurrency=3).run(
+            target=20, batch_size=10, max_generated=100, on_batch=accept_half
+        )
+
+        self.assertGreaterEqual(stats['accepted'], 20)
+        self.assertLessEqual(stats['generated'], 100)
+        self.assertEqual(stats['api_calls'], len(received))
+        self.assertGreater(stats['questions_per_second'], 0)
+
+    def test_rate_limiter_waits_for_token_budget(self):
+        limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=6000)
+
+        self.assertEqual(limiter.acquire(6000), 0)
+        self.assertGreater(limiter.acquire(10), 0)
+
+    def test_generate_and_store_questions_in_parallel(self):
+        with FakeOpenAIServer(delay=0) as base_url:
+            with override_settings(OPENAI_BASE_URL=base_url, OPENAI_API_KEY='sk-test'):
+                result = PreGeneratedQuestionService().generate_and_store_questions(
+                    count=25, concurrency=4, batch_size=10
+                )
+
+        self.assertEqual(result['saved_to_db'], 25)
+        self.assertEqual(PreGeneratedQuestion.objects.count(), 25)
+        self.assertIn('questions_per_second', result)
+
+
+class GenerationPlannerTests(TestCase):
+    """再試行プランナーの多めの依頼・回数制限・締め切り"""
+
+    def make_questions(self, prefix, count):
+        return [{'question': f'{prefix}{i}'} for i in range(count)]
+
+    def test_over_requests_by_learned_yield_and_fills_the_rest(self):
+        tracker = YieldTracker(alpha=1.0)
+        tracker.observe('language', requested=13, obtained=10)
+        requested_sizes = []
+
+        def request(size, timeout):
+            requested_sizes.append(size)
+            return self.make_questions(f'a{len(requested_sizes)}-', 2)
+
+        def fill(shortage, exclude):
+            return self.make_questions('fill-', shortage)
+
+        planner = GenerationPlanner('language', deadline_seconds=15, max_attempts=2, tracker=tracker)
+        questions = planner.plan(10, request, fill)
+
+        self.assertEqual(requested_sizes[0], 13)
+        self.assertEqual(len(requested_sizes), 2)
+        self.assertEqual(len(questions), 10)
+        self.assertEqual(planner.stats['filled'], 6)
+        self.assertGreater(tracker.factor('language'), 1.3)
+
+    def test_deadline_stops_retries(self):
+        clock = iter([0, 0, 10, 10, 10])
+
+        def request(size, timeout):
+            return []
+
+        with mock.patch('quiz.generation_planner.time.monotonic', side_effect=lambda: next(clock)):
+            planner = GenerationPlanner('math', deadline_seconds=10.5, max_attempts=5, tracker=YieldTracker())
+            questions = planner.plan(5, request, lambda shortage, exclude: self.make_questions('f', shortage))
+
+        self.assertEqual(planner.stats['attempts'], 1)
+        self.assertEqual(len(questions), 5)
+
+    def test_generator_fills_from_fallback_when_api_fails(self):
+        service = QuizGeneratorService.__new__(QuizGeneratorService)
+        service._pregenerated_service = PreGeneratedQuestionService.__new__(PreGeneratedQuestionService)
+        service._pregenerated_service.min_quality_score = 70
+        client = mock.Mock()
+        client.with_options.return_value.chat.completions.create.side_effect = RuntimeError('boom')
+
+        with mock.patch('quiz.openai_service.get_openai_client', return_value=client):
+            questions = service._generate_math_questions(4)
+
+        self.assertEqual(len(questions), 4)
+        self.assertEqual(client.with_options.return_value.chat.completions.create.call_count, 1)
+
+
+    def test_fill_shortage_does_not_repeat_questions_in_a_session(self):
+        service = QuizGeneratorService.__new__(QuizGeneratorService)
+        service._pregenerated_service = PreGeneratedQuestionService.__new__(PreGeneratedQuestionService)
+        service._pregenerated_service.get_random_questions = mock.Mock(return_value=[])
+
+        for question_type, fallback in (
+            ('language', service._get_fallback_questions(15)),
+            ('math', service._get_fallback_math_questions(5)),
+        ):
+            # セッションで既に出した問題（フォールバック問題の先頭）を除いて補う
+            exclude = {question['question'] for question in fallback}
+            filled = service._fill_shortage(5, question_type, exclude)
+            texts = [question['question'] for question in filled]
+
+            self.assertEqual(len(texts), 5)
+            self.assertEqual(len(set(texts)), 5)
+            self.assertFalse(exclude & set(texts))
+
+
+class HedgedGenerationTests(TransactionTestCase):
+    """予算時間を過ぎた生成はプールで応答し、遅れた結果はプールに保存する"""
+
+    def make_generator(self, delay, questions):
+        release = threading.Event()
+        service = QuizGeneratorService.__new__(QuizGeneratorService)
+        service._pregenerated_service = PreGeneratedQuestionService.__new__(PreGeneratedQuestionService)
+        service._pregenerated_service.min_quality_score = 70
+
+        def generate(num, fill_shortage=True):
+            release.wait(delay)
+            return questions
+
+        service._generate_math_questions = generate
+        return service, release
+
+    def math_questions(self, count):
+        return [
+            {'question': f'{i} + 1 = ?', 'answer_format': 'numeric', 'correct_value': i + 1, 'type': 'math'}
+            for i in range(count)
+        ]
+
+    def test_slow_generation_serves_pool_and_stores_late_result(self):
+        service, release = self.make_generator(5, self.math_questions(3))
+        with mock.patch.object(
+            service._pregenerated_service, 'get_pool_questions', return_value=[{'question': 'pool'}]
+        ) as pool:
+            started = time.perf_counter()
+            questions = HedgedGenerator(service, budget_seconds=0.05).generate(3, question_type='math')
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(questions, [{'question': 'pool'}])
+        pool.assert_called_once_with(3, question_type='math', seen=None)
+        self.assertLess(elapsed, 1)
+
+        release.set()
+        self.assertTrue(drain_background(5))
+        self.assertEqual(PreGeneratedQuestion.objects.filter(question_type='math').count(), 3)
+
+    def test_generation_within_budget_is_returned_and_filled(self):
+        service, release = self.make_generator(0, self.math_questions(2))
+        release.set()
+
+        questions = HedgedGenerator(service, budget_seconds=5).generate(4, question_type='math')
+
+        self.assertEqual(len(questions), 4)
+        self.assertEqual([q['question'] for q in questions[:2]], ['0 + 1 = ?', '1 + 1 = ?'])
+        self.assertFalse(PreGeneratedQuestion.objects.exists())
+
+
+class GenerationCacheTests(TestCase):
+    """同じプロンプトの応答キャッシュ（N件を順番に使い回す）"""
+
+    def params(self, num_questions=10):
+        return QuizGeneratorService.__new__(QuizGeneratorService)._chat_params(num_questions, 'math')
+
+    def test_rotates_variants_after_collecting_enough(self):
+        cache = GenerationCache(MemoryCacheBackend(max_entries=10, ttl=60), variants=2)
+        params = self.params()
+
+        self.assertIsNone(cache.get(params))
+        cache.put(params, 'first')
+        self.assertIsNone(cache.get(params))
+        cache.put(params, 'second')
+
+        self.assertEqual([cache.get(params) for _ in range(3)], ['first', 'second', 'first'])
+        self.assertIsNone(cache.get(self.params(5)))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertGreater(stats['saved_cost_usd'], 0)
+
+    def test_memory_backend_evicts_least_recently_used_and_expired(self):
+        backend = MemoryCacheBackend(max_entries=2, ttl=60)
+        for key in ['a', 'b']:
+            backend.set(key, {'created': time.time(), 'cursor': 0, 'variants': []})
+        backend.get('a')
+        backend.set('c', {'created': time.time(), 'cursor': 0, 'variants': []})
+        backend.set('d', {'created': time.time() - 120, 'cursor': 0, 'variants': []})
+
+        self.assertIsNone(backend.get('b'))
+        self.assertIsNone(backend.get('d'))
+        self.assertIsNotNone(backend.get('c'))
+
+    def test_file_backend_persists_between_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            params = self.params()
+            GenerationCache(FileCacheBackend(directory, max_entries=10, ttl=60), variants=1).put(params, 'stored')
+
+            cache = GenerationCache(FileCacheBackend(directory, max_entries=10, ttl=60), variants=1)
+            self.assertEqual(cache.get(params), 'stored')
+
+    def test_generator_reuses_cached_completion(self):
+        service = QuizGeneratorService.__new__(QuizGeneratorService)
+        client = mock.Mock()
+        create = client.with_options.return_value.chat.completions.create
+        create.return_value.choices = [mock.Mock(message=mock.Mock(content='問題1: 2 + 3 = ?\n答え: 5'))]
+        create.return_value.usage = None
+        cache = GenerationCache(MemoryCacheBackend(max_entries=10, ttl=60), variants=1)
+
+        with mock.patch('quiz.openai_service.get_generation_cache', return_value=cache), \
+                mock.patch('quiz.openai_service.get_openai_client', return_value=client):
+            first = service._generate_math_questions(1, fill_shortage=False)
+            second = service._generate_math_questions(1, fill_shortage=False)
+            service._generate_math_questions(1, fill_shortage=False, use_cache=False)
+
+        self.assertEqual(first, second)
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+class HiraganaConversionTests(TestCase):
+    """ひらがな化の結果をキャッシュし、漢字・カタカナが無い文字列は変換しない"""
+
+    def setUp(self):
+        self.converter = mock.Mock()
+        self.converter.do.side_effect = lambda text: text.replace('犬', 'いぬ').replace('ネコ', 'ねこ')
+        self.cache = HiraganaCache(max_entries=2)
+        patches = [
+            mock.patch('quiz.openai_service.get_hiragana_converter', return_value=self.converter),
+            mock.patch('quiz.openai_service.hiragana_cache', self.cache),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_batch_converts_pending_texts_in_one_call(self):
+        texts = ['犬は どれ？', 'ネコ', 'とり', 'ネコ']
+
+        self.assertEqual(to_hiragana_batch(texts), ['いぬは どれ？', 'ねこ', 'とり', 'ねこ'])
+        self.assertEqual(self.converter.do.call_count, 1)
+
+        self.assertEqual(_to_hiragana('ネコ'), 'ねこ')
+        self.assertEqual(self.converter.do.call_count, 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['skipped']), (1, 2, 1))
+
+    def test_cache_evicts_least_recently_used(self):
+        for text in ['犬', 'ネコ', '犬', 'ネコイヌ']:
+            _to_hiragana(text)
+
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.assertIsNone(self.cache.get('ネコ'))
+        self.assertEqual(self.cache.get('犬'), 'いぬ')
+
+    def test_parsed_question_is_converted(self):
+        service = QuizGeneratorService.__new__(QuizGeneratorService)
+
+        question = service._parse_single_question('犬は どれ？\nA) 犬\nB) ネコ\nC) とり\n正解: A')
+
+        self.assertEqual(question['question'], 'いぬは どれ？')
+        self.assertEqual(question['choices'], ['いぬ', 'ねこ', 'とり'])
+        self.assertEqual(self.converter.do.call_count, 1)
+
+
+class OpenAIClientRegistryTests(TestCase):
+    """OpenAI クライアントと接続プールをプロセスで共有する"""
+
+    def tearDown(self):
+        reset_clients()
+
+    @override_settings(OPENAI_API_KEY='sk-test', OPENAI_BASE_URL='http://127.0.0.1:1/v1')
+    def test_client_is_shared_per_settings(self):
+        client = get_openai_client()
+
+        self.assertIs(get_openai_client(), client)
+        self.assertIs(QuizGeneratorService().client, client)
+        self.assertIs(get_quiz_generator().pregenerated_service.openai_service.client, client)
+        with override_settings(OPENAI_BASE_URL='http://127.0.0.1:2/v1'):
+            self.assertIsNot(get_openai_client(), client)
+
+        reset_clients()
+        self.assertIsNot(get_openai_client(), client)
+
+    @override_settings(OPENAI_API_KEY='sk-test', OPENAI_BASE_URL='http://127.0.0.1:1/v1')
+    async def test_async_client_is_shared_within_event_loop(self):
+        self.assertIs(get_async_openai_client(), get_async_openai_client())
+
+
+class QualityCheckerTests(TestCase):
+    """1回の走査で採点する評価器が参照実装（基準ごとの判定）と同じ点数になる"""
+
+    def test_compiled_scores_match_reference(self):
+        checker = QuestionQualityChecker()
+        corpus = build_corpus(2000, seed=1) + [
+            {'question': '', 'choices': ['', ' '], 'answer': 0},
+            {'question': '漢字 test です', 'choices': ['a', 'b', 'c'], 'answer': 0},
+            {'question': 'これは なに', 'choices': ['でしょう', 'いぬ？', 'ねこ'], 'answer': 0},
+        ]
+
+        for question_data in corpus:
+            self.assertEqual(
+                checker.evaluate_question(question_data)[1]['criteria_scores'],
+                checker.reference_scores(question_data),
+                question_data
+            )
+
+    def test_overlapping_keywords_and_question_markers(self):
+        checker = QuestionQualityChecker()
+        # 「おとうさん」の中の「おと」（楽しい要素）も数え、疑問の表現は問題文の中だけを数える
+        _, details = checker.evaluate_question(
+            {'question': 'おとうさんは どこにいる', 'choices': ['いえでしょう？', 'がっこう', 'こうえん'], 'answer': 1}
+        )
+
+        self.assertEqual(details['criteria_scores']['age_appropriate'], 15)
+        self.assertEqual(details['criteria_scores']['clear_question'], 10)
+
+    def test_score_columns_match_evaluate_question(self):
+        checker = QuestionQualityChecker()
+        corpus = [question for question in build_corpus(500, seed=2) if len(question['choices']) == 3]
+        columns = [[question['question'] for question in corpus]]
+        columns += [[question['choices'][i] for question in corpus] for i in range(3)]
+        columns.append([question['answer'] for question in corpus])
+        expected = [checker.evaluate_question(question)[0] for question in corpus]
+
+        self.assertEqual(score_columns(*columns), expected)
+        with mock.patch.object(quality_rescore, 'np', None):
+            self.assertEqual(score_columns(*columns), expected)
+
+    def test_rescore_updates_only_changed_multiple_choice_questions(self):
+        unchanged = create_pool_question(1)
+        unchanged.quality_score = QuestionQualityChecker().evaluate_question(unchanged.to_dict())[0]
+        unchanged.save()
+        changed = create_pool_question(2, quality_score=0)
+        numeric = PreGeneratedQuestion.objects.create(
+            question_text='1 + 2 = ?', question_type='math', answer_format='numeric', correct_value=3, quality_score=70
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            result = rescore_question_pool(chunk_size=1)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+
+        self.assertEqual((result['questions'], result['changed']), (2, 1))
+        self.assertEqual(len(updates), 1)
+        changed.refresh_from_db()
+        numeric.refresh_from_db()
+        self.assertEqual(changed.quality_score, QuestionQualityChecker().evaluate_question(changed.to_dict())[0])
+        self.assertEqual(numeric.quality_score, 70)
+
+
+    @skipIf(quality_rescore.np is None, 'numpy がインストールされていない')
+    def test_rescore_numpy_and_per_row_paths_write_the_same_scores(self):
+        corpus = [question for question in build_corpus(300, seed=3) if len(question['choices']) == 3]
+        PreGeneratedQuestion.objects.bulk_create([
+            PreGeneratedQuestion(
+                question_text=question['question'], choice_1=question['choices'][0],
+                choice_2=question['choices'][1], choice_3=question['choices'][2],
+                correct_answer=question['answer'], quality_score=0
+            )
+            for question in corpus
+        ])
+        scores = PreGeneratedQuestion.objects.order_by('id').values_list('id', 'quality_score')
+
+        vectorized = rescore_question_pool(chunk_size=64)
+        vectorized_scores = list(scores)
+        PreGeneratedQuestion.objects.update(quality_score=0)
+        with mock.patch.object(quality_rescore, 'np', None):
+            per_row = rescore_question_pool(chunk_size=64)
+
+        self.assertTrue(vectorized['vectorized'])
+        self.assertFalse(per_row['vectorized'])
+        self.assertEqual(
+            (vectorized['questions'], vectorized['changed']), (per_row['questions'], per_row['changed'])
+        )
+        self.assertEqual(list(scores), vectorized_scores)
+
+    def test_rescore_writes_only_changed_rows(self):
+        checker = QuestionQualityChecker()
+        questions = [create_pool_question(number) for number in range(1, 7)]
+        for question in questions:
+            question.quality_score = checker.evaluate_question(question.to_dict())[0]
+            question.save()
+        changed_ids = {questions[1].id, questions[4].id}
+        PreGeneratedQuestion.objects.filter(id__in=changed_ids).update(quality_score=0)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = rescore_question_pool()
+        written_ids = set()
+        for query in queries.captured_queries:
+            if query['sql'].startswith('UPDATE'):
+                written_ids.update(int(i) for i in re.search(r'IN \(([\d, ]+)\)', query['sql']).group(1).split(','))
+
+        self.assertEqual(result['changed'], 2)
+        self.assertEqual(written_ids, changed_ids)
+
+
+class StartupTests(TestCase):
+    """起動時は openai SDK と pykakasi を読み込まず、ウォームアップで読み込む"""
+
+    def test_url_loading_does_not_import_heavy_modules(self):
+        _, modules = run_importtime(STAGE_SCRIPTS['urls'])
+
+        self.assertIn('quiz.views', modules)
+        self.assertNotIn('openai', modules)
+        self.assertNotIn('pykakasi', modules)
+
+    def test_warm_up_before_fork_skips_per_process_resources(self):
+        with mock.patch('quiz.openai_client.get_openai_client') as get_client:
+            timings = warm_up(per_process=False)
+
+        self.assertEqual(list(timings), ['urls', 'openai_sdk', 'hiragana_converter'])
+        get_client.assert_not_called()
+
+
+@override_settings(OPENAI_API_KEY='sk-test')
+class StreamingGenerationTests(TransactionTestCase):
+    """ストリーミング応答から1問ずつパースし、最初の問題でセッションを作成する"""
+
+    def setUp(self):
+        self.fake_server = FakeOpenAIServer(delay=0, question_delay=0.05)
+        self.settings_override = override_settings(OPENAI_BASE_URL=self.fake_server.start())
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.fake_server.stop()
+
+    def test_parser_splits_chunks_like_whole_response(self):
+        service = QuizGeneratorService()
+        rng = random.Random(0)
+        for question_type, content in [
+            ('language', self.fake_server.language_content(6)),
+            ('math', self.fake_server.math_content(6)),
+        ]:
+            parser = QuestionStreamParser(ANSWER_PREFIXES[question_type])
+            blocks = []
+            position = 0
+            while position < len(content):
+                size = rng.randint(1, 12)
+                blocks.extend(parser.feed(content[position:position + size]))
+                position += size
+            blocks.extend(parser.finish())
+
+            parse = service._parse_single_math_question if question_type == 'math' else service._parse_single_question
+            expected = service._parse_content(content, question_type)
+            self.assertEqual([parse(block) for block in blocks], expected)
+
+    def test_stream_questions_yields_before_response_completes(self):
+        service = QuizGeneratorService()
+        started = time.perf_counter()
+        questions = service.stream_questions(10, question_type='math', use_cache=False)
+        first = next(questions)
+        first_elapsed = time.perf_counter() - started
+        rest = list(questions)
+
+        self.assertEqual(first['answer_format'], 'numeric')
+        self.assertEqual(len(rest), 9)
+        # 残り9問の生成（0.05秒ずつ）を待たずに最初の問題が届く
+        self.assertLess(first_elapsed, time.perf_counter() - started - 0.3)
+        self.assertEqual(self.fake_server.request_count, 1)
+
+    def test_build_streaming_saves_remaining_questions_in_background(self):
+        user = get_user_model().objects.create(username='stream-starter')
+        builder = StreamingSessionBuilder(user, 'math', first_count=1)
+
+        session = builder.build_streaming(
+            QuizGeneratorService().stream_questions(10, question_type='math', use_cache=False), total=10
+        )
+
+        self.assertLess(session.questions.count(), 10)
+        self.assertEqual(builder.remaining.result(5), 10)
+        self.assertEqual(
+            list(session.questions.order_by('question_number').values_list('question_number', flat=True)),
+            list(range(1, 11))
+        )
+
+    def test_build_streaming_fills_questions_when_stream_fails(self):
+        user = get_user_model().objects.create(username='stream-failure')
+        builder = StreamingSessionBuilder(user, 'math', first_count=1)
+
+        def failing_stream():
+            yield {'question': '1 + 1 = ?', 'answer_format': 'numeric', 'correct_value': 2}
+            yield {'question': '2 + 2 = ?', 'answer_format': 'numeric', 'correct_value': 4}
+            raise RuntimeError('stream closed')
+
+        session = builder.build_streaming(failing_stream(), total=10)
+
+        self.assertEqual(builder.remaining.result(5), 10)
+        questions = list(session.questions.order_by('question_number'))
+        self.assertEqual([q.question_number for q in questions], list(range(1, 11)))
+        self.assertEqual([q.text for q in questions[:2]], ['1 + 1 = ?', '2 + 2 = ?'])
+        self.assertEqual({q.answer_format for q in questions}, {'numeric'})
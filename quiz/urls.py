@@ -12,7 +12,10 @@ urlpatterns = [
     
     # API エンドポイント
     path('api/start/', views.start_quiz_api, name='start_api'),
+    path('api/start/async/', views.start_quiz_async_api, name='start_async_api'),
     path('api/answer/', views.submit_answer_api, name='answer_api'),
+    path('api/answer/batch/', views.submit_answers_batch_api, name='answer_batch_api'),
+    path('api/session/<int:session_id>/questions/', views.session_questions_api, name='session_questions_api'),
     path('api/finish/', views.finish_quiz_api, name='finish_api'),
     path('api/stats/', views.quiz_stats_api, name='stats_api'),
     path('api/history/', views.quiz_history_api, name='history_api'),
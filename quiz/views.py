@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, Http404
 from django.contrib.auth.decorators import login_required
@@ -5,11 +6,19 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.urls import reverse
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Subquery
 
-from .models import QuizSession, Question, Answer
-from .openai_service import QuizGeneratorService
+from .models import QuizSession, Question, Answer, UserQuizStats, UserSeenQuestions
+from .hedged_generation import HedgedGenerator
+from .openai_service import get_quiz_generator
+from .pre_generated_service import get_pregenerated_service
+from .session_service import SessionBuilder, StreamingSessionBuilder
+from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
 import json
+import time
 
 
 class QuizStartView(LoginRequiredMixin, TemplateView):
@@ -30,32 +39,36 @@ class QuizStartView(LoginRequiredMixin, TemplateView):
 
 
 class QuizGameView(LoginRequiredMixin, TemplateView):
-    """クイズゲーム画面"""
+    """
+    クイズゲーム画面
+    
+    2問目以降は session_questions_api で取得した問題を使ってブラウザ側で進行するため、
+    この画面の描画は通常1セッションにつき1回だけになる。
+    """
     template_name = 'quiz/game.html'
 
     def dispatch(self, request, *args, **kwargs):
         """リクエスト処理前の事前チェック"""
+        if not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        
         session_id = kwargs.get('session_id')
-        session = get_object_or_404(QuizSession, id=session_id, user=request.user)
+        self.session = get_object_or_404(QuizSession, id=session_id, user=request.user)
         
-        # 現在の問題番号を取得
-        answered_count = session.questions.filter(answers__isnull=False).count()
-        current_question_number = answered_count + 1
+        # 現在の問題番号を取得（回答のたびに加算される回答数を使う）
+        self.answered_count = self.session.answered_count
+        current_question_number = self.answered_count + 1
         
         if current_question_number > 10:
             # 全問題完了済み - 結果画面にリダイレクト
-            return redirect('quiz:result', session_id=session.id)
+            return redirect('quiz:result', session_id=self.session.id)
         
         return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        session_id = kwargs.get('session_id')
-        
-        session = get_object_or_404(QuizSession, id=session_id, user=self.request.user)
-        
-        # 現在の問題番号を取得
-        answered_count = session.questions.filter(answers__isnull=False).count()
+        session = self.session
+        answered_count = self.answered_count
         current_question_number = answered_count + 1
         
         # 現在の問題を取得
@@ -175,38 +188,64 @@ class QuizHistoryView(LoginRequiredMixin, TemplateView):
         # ページネーション用に最初の20件を取得
         recent_sessions = sessions[:20]
         
-        # 統計情報
-        total_sessions = sessions.count()
-        if total_sessions > 0:
-            total_score = sum(session.score for session in sessions)
-            average_score = total_score / total_sessions
-            best_score = max(session.score for session in sessions)
-            total_points = sum(session.points_earned for session in sessions)
-        else:
-            average_score = 0
-            best_score = 0
-            total_points = 0
-        
-        # 今月の統計
-        from datetime import datetime, timezone as dt_timezone
-        now = datetime.now(dt_timezone.utc)
-        current_month_sessions = sessions.filter(
-            finished_at__year=now.year,
-            finished_at__month=now.month
-        )
+        # 統計情報（finish_session で差分更新される集計行を読む）
+        stats = UserQuizStats.for_user(user)
         
         context.update({
             'sessions': recent_sessions,
-            'total_sessions': total_sessions,
-            'average_score': round(average_score, 1),
-            'best_score': best_score,
-            'total_points': total_points,
-            'current_month_sessions': current_month_sessions.count(),
+            'total_sessions': stats.total_sessions,
+            'average_score': round(stats.average_score, 1),
+            'best_score': stats.best_score,
+            'total_points': stats.total_points,
+            'current_month_sessions': stats.current_month_sessions(),
         })
         
         return context
 
 
+def _insert_answer(answer):
+    """
+    回答をINSERTする。一意制約違反（回答済み）の場合は False を返す
+    
+    Answer.save が INSERT とセッションの回答数の加算を1トランザクションで行う
+    （セーブポイントは作らない）。回答済みの場合は INSERT の時点で失敗するため、
+    加算は行われずトランザクションごとロールバックされる。
+    """
+    try:
+        answer.save(force_insert=True)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _correct_answer_payload(question):
+    """正解表示用の情報（正解のインデックス/数値と表示文字列）"""
+    if question.answer_format == 'numeric':
+        return {
+            'correct_answer': question.correct_value,
+            'correct_choice': str(question.correct_value),
+        }
+    return {
+        'correct_answer': question.correct_idx,
+        'correct_choice': question.choices[question.correct_idx],
+    }
+
+
+def _parse_answered_at(value, session):
+    """
+    端末から送られた回答日時を解釈する
+    
+    解釈できない値は現在時刻とし、セッション開始前や未来の日時は範囲内に丸める。
+    """
+    now = timezone.now()
+    answered_at = parse_datetime(value) if isinstance(value, str) else None
+    if answered_at is None:
+        return now
+    if timezone.is_naive(answered_at):
+        answered_at = timezone.make_aware(answered_at)
+    return min(max(answered_at, session.started_at), now)
+
+
 # API Views
 @login_required
 def start_quiz_api(request):
@@ -231,37 +270,34 @@ def start_quiz_api(request):
                     'message': '未完了のクイズがあります。続きから始めますか？'
                 })
             
-            print("新しいセッション作成中...")
-            # 新しいセッションを作成
-            session = QuizSession.objects.create(user=request.user)
-            print(f"セッション作成完了: {session.id}")
-            
-            # 問題を生成
-            print("問題生成サービス初期化中...")
-            quiz_generator = QuizGeneratorService()
-            print("問題生成開始...")
-            questions_data = quiz_generator.generate_questions(10, question_type=question_type)
-            print(f"問題生成完了: {len(questions_data)}問")
-            
-            # 問題をデータベースに保存
-            print("問題をデータベースに保存中...")
-            for i, q_data in enumerate(questions_data, 1):
-                question_kwargs = {
-                    'session': session,
-                    'text': q_data['question'],
-                    'question_number': i,
-                    'question_type': q_data.get('question_type', question_type),
-                    'answer_format': q_data.get('answer_format', 'multiple_choice')
-                }
-                
-                if q_data.get('answer_format') == 'numeric':
-                    question_kwargs['correct_value'] = q_data.get('correct_value')
-                else:
-                    question_kwargs['choices'] = q_data.get('choices', [])
-                    question_kwargs['correct_idx'] = q_data.get('answer', 0)
+            # 問題を取得（通常は問題プールのみを使用し、OpenAI APIの応答を待たない）
+            # 最近見た問題は優先的に除外する
+            generation_started = time.perf_counter()
+            seen = UserSeenQuestions.filter_for_user(request.user)
+            session = None
+            if SPEED_OPTIMIZATION_CONFIG['START_FROM_POOL_ONLY']:
+                questions_data = get_pregenerated_service().get_pool_questions(
+                    10, question_type=question_type, seen=seen
+                )
+            elif SPEED_OPTIMIZATION_CONFIG['STREAMING_GENERATION']:
+                # 最初の問題が届いた時点でセッションを作成し、残りは届き次第バックグラウンドで保存する
+                session = StreamingSessionBuilder(request.user, question_type).build_streaming(
+                    get_quiz_generator().stream_questions(10, question_type=question_type), total=10
+                )
+            elif SPEED_OPTIMIZATION_CONFIG['HEDGED_GENERATION']:
+                # 予算時間内に生成が終わらなければ問題プールから出題する
+                questions_data = HedgedGenerator().generate(10, question_type=question_type, seen=seen)
+            else:
+                questions_data = get_quiz_generator().generate_questions(10, question_type=question_type, seen=seen)
+            generation_ms = (time.perf_counter() - generation_started) * 1000
+            if session is None:
+                print(f"問題取得完了: {len(questions_data)}問 ({generation_ms:.1f}ms)")
                 
-                Question.objects.create(**question_kwargs)
-            print("問題保存完了")
+                # セッション作成と問題の保存を1トランザクションで一括実行
+                session = SessionBuilder(request.user, question_type).build(questions_data)
+            else:
+                print(f"最初の問題の取得完了（ストリーミング）: {generation_ms:.1f}ms")
+            print(f"セッション作成完了: {session.id}")
             
             return JsonResponse({
                 'status': 'success',
@@ -282,9 +318,102 @@ def start_quiz_api(request):
     return JsonResponse({'status': 'error', 'message': 'POST method required'}, status=405)
 
 
+def _authenticated_user(request):
+    """ログイン中のユーザー（未ログインの場合は None）。セッションの読み込みでDBを使う"""
+    return request.user if request.user.is_authenticated else None
+
+
+async def start_quiz_async_api(request):
+    """
+    クイズセッション開始API（非同期版）
+    
+    ASGI（uvicorn）で動かすと、OpenAI API の応答を待つ間もイベントループが
+    他のリクエストを処理できる。DBアクセスは非同期ORMまたはスレッドで行う。
+    Django 4.2 の login_required は非同期ビューに対応していないため、認証はビュー内で確認する。
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST method required'}, status=405)
+    
+    user = await sync_to_async(_authenticated_user)(request)
+    if user is None:
+        return JsonResponse({'status': 'error', 'message': 'ログインが必要です'}, status=401)
+    
+    try:
+        data = json.loads(request.body)
+        question_type = data.get('question_type', 'language')  # 'language' or 'math'
+        
+        # 未完了のセッションがあるかチェック
+        ongoing_session = await QuizSession.objects.filter(
+            user=user, is_completed=False
+        ).afirst()
+        
+        if ongoing_session:
+            return JsonResponse({
+                'status': 'ongoing',
+                'session_id': ongoing_session.id,
+                'message': '未完了のクイズがあります。続きから始めますか？'
+            })
+        
+        generation_started = time.perf_counter()
+        seen = await sync_to_async(UserSeenQuestions.filter_for_user)(user)
+        session = None
+        if SPEED_OPTIMIZATION_CONFIG['START_FROM_POOL_ONLY']:
+            questions_data = await sync_to_async(get_pregenerated_service().get_pool_questions)(
+                10, question_type=question_type, seen=seen
+            )
+        elif SPEED_OPTIMIZATION_CONFIG['STREAMING_GENERATION']:
+            session = await StreamingSessionBuilder(user, question_type).abuild_streaming(
+                get_quiz_generator().astream_questions(10, question_type=question_type), total=10
+            )
+        elif SPEED_OPTIMIZATION_CONFIG['HEDGED_GENERATION']:
+            questions_data = await HedgedGenerator().agenerate(10, question_type=question_type, seen=seen)
+        else:
+            questions_data = await get_quiz_generator().agenerate_questions(
+                10, question_type=question_type, seen=seen
+            )
+        generation_ms = (time.perf_counter() - generation_started) * 1000
+        if session is None:
+            print(f"問題取得完了（非同期）: {len(questions_data)}問 ({generation_ms:.1f}ms)")
+            
+            # セッション作成と問題の保存（トランザクションは1スレッド内で完結させる）
+            session = await sync_to_async(SessionBuilder(user, question_type).build)(questions_data)
+        else:
+            print(f"最初の問題の取得完了（非同期・ストリーミング）: {generation_ms:.1f}ms")
+        
+        return JsonResponse({
+            'status': 'success',
+            'session_id': session.id,
+            'question_type': question_type,
+            'message': 'クイズセッションを開始しました！'
+        })
+    
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'status': 'error',
+            'message': '無効なJSONデータです'
+        }, status=400)
+    except Exception as e:
+        print(f"クイズ開始エラー（非同期）: {e}")
+        return JsonResponse({
+            'status': 'error',
+            'message': f'クイズの開始に失敗しました: {str(e)}'
+        }, status=500)
+
+
 @login_required
 def submit_answer_api(request):
-    """回答送信API"""
+    """
+    回答送信API
+    
+    クエリ予算（最終問題以外）: 5クエリ（Django が記録する BEGIN/COMMIT を含む）
+      1. 問題とセッションの取得（select_related による SELECT 1回。所有者チェックも同時に行う）
+      2. BEGIN
+      3. 回答の INSERT 1回（回答済みかどうかは Answer.question の一意制約で判定）
+      4. セッションの回答数・正解数の F() による UPDATE 1回（3 と同じトランザクション。セーブポイントなし）
+      5. COMMIT
+    回答済みの場合は SELECT, BEGIN, INSERT, ROLLBACK の4クエリ。
+    最終問題では finish_session の処理が加わる（回答テーブルの集計は行わない）。
+    """
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
@@ -300,15 +429,24 @@ def submit_answer_api(request):
                     'message': '必要なパラメータが不足しています'
                 }, status=400)
             
-            # セッションと問題を取得
-            session = get_object_or_404(QuizSession, id=session_id, user=request.user)
-            question = get_object_or_404(Question, session=session, question_number=question_number)
+            # 問題とセッションを1クエリで取得
+            question = Question.objects.select_related('session').filter(
+                session_id=session_id,
+                session__user=request.user,
+                question_number=question_number
+            ).first()
             
-            # 既に回答済みかチェック
-            if hasattr(question, 'answers') and question.answers.exists():
+            if question is None:
                 return JsonResponse({
                     'status': 'error',
-                    'message': 'この問題は既に回答済みです'
+                    'message': '問題が見つかりません'
+                }, status=404)
+            
+            session = question.session
+            if session.is_completed:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': 'このクイズセッションは既に完了しています'
                 }, status=400)
             
             # 回答形式に応じたバリデーション
@@ -325,30 +463,27 @@ def submit_answer_api(request):
                         'message': '選択肢が必要です'
                     }, status=400)
             
-            # 回答を保存
-            answer_kwargs = {'question': question}
+            # 回答を保存（回答済みの場合は一意制約違反になる）
+            answer = Answer(question=question)
             if question.answer_format == 'numeric':
-                answer_kwargs['numeric_answer'] = numeric_answer
+                answer.numeric_answer = numeric_answer
             else:
-                answer_kwargs['selected_idx'] = selected_idx
-                
-            answer = Answer.objects.create(**answer_kwargs)
+                answer.selected_idx = selected_idx
+            
+            if not _insert_answer(answer):
+                return JsonResponse({
+                    'status': 'error',
+                    'message': 'この問題は既に回答済みです'
+                }, status=400)
             
             # 次の問題があるかチェック
             next_question_number = question_number + 1
             has_next = next_question_number <= 10
             
-            # 正解表示用の情報を準備
-            if question.answer_format == 'numeric':
-                correct_display = str(question.correct_value)
-            else:
-                correct_display = question.choices[question.correct_idx]
-            
             response_data = {
                 'status': 'success',
                 'is_correct': answer.is_correct,
-                'correct_answer': question.correct_idx if question.answer_format != 'numeric' else question.correct_value,
-                'correct_choice': correct_display,
+                **_correct_answer_payload(question),
                 'has_next': has_next,
                 'next_question_number': next_question_number if has_next else None
             }
@@ -391,6 +526,209 @@ def submit_answer_api(request):
     return JsonResponse({'status': 'error', 'message': 'POST method required'}, status=405)
 
 
+@login_required
+def submit_answers_batch_api(request):
+    """
+    回答一括送信API（オフライン中にためた回答の送信用）
+    
+    リクエスト:
+        {
+            "session_id": 1,
+            "answers": [{"question_number": 1, "selected_idx": 0, "answered_at": "..."}, ...],
+            "finish": true   # 任意。true の場合は同じリクエストでセッションを終了する
+        }
+    
+    回答済みの問題は保存済みの判定結果を返すだけなので、同じバッチを再送しても安全。
+    新しい回答は bulk_create でまとめて1回のINSERTで保存する。
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST method required'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'status': 'error',
+            'message': '無効なJSONデータです'
+        }, status=400)
+    
+    session_id = data.get('session_id')
+    entries = data.get('answers', [])
+    if not session_id or not isinstance(entries, list):
+        return JsonResponse({
+            'status': 'error',
+            'message': '必要なパラメータが不足しています'
+        }, status=400)
+    
+    try:
+        # セッションの全問題と保存済みの判定結果を1クエリで取得
+        questions = {
+            question.question_number: question
+            for question in Question.objects.filter(
+                session_id=session_id,
+                session__user=request.user
+            ).select_related('session').annotate(
+                saved_is_correct=Subquery(
+                    Answer.objects.filter(question=OuterRef('pk')).values('is_correct')[:1]
+                )
+            )
+        }
+        
+        if not questions:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'セッションが見つかりません'
+            }, status=404)
+        
+        session = next(iter(questions.values())).session
+        results = []
+        new_answers = []
+        
+        for entry in entries:
+            question = questions.get(entry.get('question_number')) if isinstance(entry, dict) else None
+            if question is None:
+                results.append({
+                    'question_number': entry.get('question_number') if isinstance(entry, dict) else None,
+                    'status': 'error',
+                    'message': '問題が見つかりません'
+                })
+                continue
+            
+            if question.saved_is_correct is not None:
+                # 回答済み（再送）: 保存済みの判定結果を返す
+                results.append({
+                    'question_number': question.question_number,
+                    'status': 'duplicate',
+                    'is_correct': question.saved_is_correct,
+                    **_correct_answer_payload(question)
+                })
+                continue
+            
+            if session.is_completed:
+                results.append({
+                    'question_number': question.question_number,
+                    'status': 'error',
+                    'message': 'このクイズセッションは既に完了しています'
+                })
+                continue
+            
+            answer = Answer(
+                question=question,
+                answered_at=_parse_answered_at(entry.get('answered_at'), session)
+            )
+            if question.answer_format == 'numeric':
+                answer.numeric_answer = entry.get('numeric_answer')
+                missing = answer.numeric_answer is None
+            else:
+                answer.selected_idx = entry.get('selected_idx')
+                missing = answer.selected_idx is None
+            
+            if missing:
+                results.append({
+                    'question_number': question.question_number,
+                    'status': 'error',
+                    'message': '回答が必要です'
+                })
+                continue
+            
+            answer.is_correct = question.is_correct_answer(
+                selected_idx=answer.selected_idx,
+                numeric_answer=answer.numeric_answer
+            )
+            # 同じバッチ内の重複は最初の回答を採用する
+            question.saved_is_correct = answer.is_correct
+            new_answers.append(answer)
+            results.append({
+                'question_number': question.question_number,
+                'status': 'success',
+                'is_correct': answer.is_correct,
+                **_correct_answer_payload(question)
+            })
+        
+        # 並行した再送と競合しても一意制約で重複は無視される
+        if new_answers:
+            with transaction.atomic():
+                Answer.objects.bulk_create(new_answers, ignore_conflicts=True)
+                # 実際に保存された件数は分からないため、回答テーブルから1回の UPDATE で集計し直す
+                session.calculate_score()
+        
+        answered_count = sum(1 for question in questions.values() if question.saved_is_correct is not None)
+        response_data = {
+            'status': 'success',
+            'results': results,
+            'saved_count': len(new_answers),
+            'answered_count': answered_count,
+            'total_questions': len(questions),
+        }
+        
+        if data.get('finish'):
+            result_data = session.finish_session()
+            response_data.update({
+                'result': result_data,
+                'final_score': session.score,
+                'points_earned': session.points_earned,
+                'redirect_url': reverse('quiz:result', kwargs={'session_id': session.id}),
+            })
+        
+        return JsonResponse(response_data)
+    
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'回答の処理に失敗しました: {str(e)}'
+        }, status=500)
+
+
+@login_required
+def session_questions_api(request, session_id):
+    """
+    セッションの全問題取得API（正解は含まない）
+    
+    ゲーム画面はこの一覧を最初に1回だけ取得し、以降はページを再読み込みせずに
+    ブラウザ側で次の問題へ進む。回答済みの問題番号も同じクエリで返す。
+    """
+    rows = Question.objects.filter(
+        session_id=session_id,
+        session__user=request.user
+    ).annotate(
+        answered=Exists(Answer.objects.filter(question=OuterRef('pk')))
+    ).values_list(
+        'question_number', 'text', 'choices', 'question_type', 'answer_format',
+        'answered', 'session__is_completed'
+    ).order_by('question_number')
+    rows = list(rows)
+    
+    if not rows:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'セッションが見つかりません'
+        }, status=404)
+    
+    questions = []
+    answered = []
+    for number, text, choices, question_type, answer_format, is_answered, _ in rows:
+        question = {
+            'number': number,
+            'text': text,
+            'question_type': question_type,
+            'answer_format': answer_format,
+        }
+        if answer_format == 'multiple_choice':
+            question['choices'] = choices
+        questions.append(question)
+        if is_answered:
+            answered.append(number)
+    
+    return JsonResponse({
+        'status': 'success',
+        'session_id': session_id,
+        'is_completed': rows[0][-1],
+        'total_questions': len(questions),
+        'answered': answered,
+        'questions': questions,
+    }, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
 @login_required
 def quiz_history_api(request):
     """クイズ履歴取得API"""
@@ -458,27 +796,8 @@ def quiz_stats_api(request):
     """クイズ統計情報取得API"""
     user = request.user
     
-    # 基本統計
-    total_sessions = QuizSession.objects.filter(user=user, is_completed=True).count()
-    
-    if total_sessions > 0:
-        sessions = QuizSession.objects.filter(user=user, is_completed=True)
-        total_score = sum(session.score for session in sessions)
-        average_score = total_score / total_sessions
-        best_score = max(session.score for session in sessions)
-        total_points = sum(session.points_earned for session in sessions)
-        
-        # 最近の成績（過去7日間）
-        from datetime import datetime, timedelta
-        week_ago = datetime.now() - timedelta(days=7)
-        recent_sessions = sessions.filter(finished_at__gte=week_ago)
-        recent_average = sum(s.score for s in recent_sessions) / len(recent_sessions) if recent_sessions else 0
-        
-    else:
-        average_score = 0
-        best_score = 0
-        total_points = 0
-        recent_average = 0
+    # 基本統計（finish_session で差分更新される集計行を読む）
+    stats = UserQuizStats.for_user(user)
     
     # ユーザー進捗情報
     next_level_info = user.get_next_level_info()
@@ -494,11 +813,12 @@ def quiz_stats_api(request):
             'perfect_scores': user.perfect_scores,
         },
         'quiz_stats': {
-            'total_sessions': total_sessions,
-            'average_score': round(average_score, 1),
-            'best_score': best_score,
-            'total_points_earned': total_points,
-            'recent_average': round(recent_average, 1),
+            'total_sessions': stats.total_sessions,
+            'average_score': round(stats.average_score, 1),
+            'best_score': stats.best_score,
+            'total_points_earned': stats.total_points,
+            # 今週（月曜日から）の平均スコア
+            'recent_average': round(stats.current_week_average(), 1),
         },
         'progress': {
             'next_level_info': next_level_info,
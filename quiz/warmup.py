@@ -0,0 +1,68 @@
+"""
+ワーカー起動時のウォームアップ
+
+openai SDK と pykakasi は最初に使う時に読み込まれるため、何もしないと各ワーカーの
+最初のリクエストがその読み込み時間を待つことになる。gunicorn.conf.py から次のように呼ぶ:
+
+    - --preload（GUNICORN_PRELOAD=1）の場合、マスタープロセスで warm_up(per_process=False) を呼び、
+      モジュールと辞書をフォーク前に読み込む（ワーカー間でメモリを共有できる）
+    - 各ワーカーの起動直後に warm_up() を呼び、プロセスごとの資源（OpenAI クライアントの接続プール、
+      問題プールのスナップショット）を用意する。DB接続やクライアントはフォーク前に作らない
+
+各手順の失敗はワーカーの起動を止めず、最初に使われる時にもう一度試される。
+"""
+import time
+from typing import Dict
+
+
+def warm_up(per_process: bool = True) -> Dict[str, float]:
+    """
+    重いモジュールを読み込み、必要ならプロセスごとの資源も用意する
+
+    Args:
+        per_process: True の場合は OpenAI クライアントと問題プールのスナップショットも用意する
+                     （フォーク後のワーカーで呼ぶ）
+
+    Returns:
+        手順ごとの所要時間（ミリ秒）
+    """
+    from django.conf import settings
+    from django.urls import get_resolver
+
+    from .openai_client import get_openai_client, load_sdk
+    from .openai_service import get_hiragana_converter
+    from .speed_optimization import SPEED_OPTIMIZATION_CONFIG
+
+    steps = [
+        ('urls', lambda: get_resolver().url_patterns),
+        ('openai_sdk', load_sdk),
+        ('hiragana_converter', get_hiragana_converter),
+    ]
+    if per_process:
+        if settings.OPENAI_API_KEY:
+            steps.append(('openai_client', get_openai_client))
+        if SPEED_OPTIMIZATION_CONFIG['POOL_SNAPSHOT']:
+            steps.append(('pool_snapshot', _load_pool_snapshot))
+
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"ウォームアップエラー ({name}): {e}")
+            continue
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+def _load_pool_snapshot():
+    from django.db import connection
+
+    from .pool_snapshot import pool_snapshot_cache
+
+    try:
+        pool_snapshot_cache.get()
+    finally:
+        # 最初のリクエストまで接続を保持しない
+        connection.close()